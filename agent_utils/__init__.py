@@ -0,0 +1,4 @@
+"""
+Agent 共用元件
+供 main.py 與各範例腳本共用的 checkpointer、middleware 等基礎設施
+"""
@@ -0,0 +1,138 @@
+"""
+非同步 DAG 執行器
+
+多代理人流程常常寫成一連串的 await，但很多步驟其實互不相依
+（例如多日行程中，每一天的餐廳、交通與統籌都可以各自進行）。
+把步驟登記成節點與依賴，依賴完成的節點就立刻開始，並以上限控制同時呼叫 LLM 的數量：
+
+    dag = AsyncDAG(max_concurrency=4)
+    dag.add("Day1/午餐", pick_lunch)
+    dag.add("Day1/交通", travel_time, deps=["Day1/午餐"])   # 依賴的結果依序傳入
+    results = await dag.run()
+    print(dag.report())   # 實際耗時、逐一執行的耗時與關鍵路徑
+
+- 節點必須在依賴之後登記，因此不會有循環
+- 任一節點失敗時取消其餘節點並拋出原本的例外
+- 等待依賴時不佔用並行名額
+"""
+
+import asyncio
+import time
+from collections.abc import Awaitable, Callable, Iterable
+from dataclasses import dataclass
+from typing import Any
+
+
+@dataclass
+class NodeTiming:
+    """節點開始與結束的時間（相對於 run 開始，秒）"""
+
+    start: float
+    end: float
+
+    @property
+    def seconds(self) -> float:
+        return self.end - self.start
+
+
+class AsyncDAG:
+    """依賴完成就執行的非同步節點圖
+
+    Args:
+        max_concurrency: 同時執行的節點上限，None 表示不限制
+    """
+
+    def __init__(self, max_concurrency: int | None = None):
+        self.max_concurrency = max_concurrency
+        self.nodes: dict[
+            str, tuple[Callable[..., Awaitable[Any]], tuple[str, ...]]
+        ] = {}
+        self.timings: dict[str, NodeTiming] = {}
+        self.elapsed = 0.0
+
+    def add(
+        self,
+        name: str,
+        func: Callable[..., Awaitable[Any]],
+        deps: Iterable[str] = (),
+    ) -> None:
+        """登記節點；func 會以依賴節點的結果（依 deps 的順序）為參數呼叫"""
+        deps = tuple(deps)
+        if name in self.nodes:
+            raise ValueError(f"節點 {name} 已經存在")
+        missing = [dep for dep in deps if dep not in self.nodes]
+        if missing:
+            raise ValueError(f"節點 {name} 的依賴 {missing} 尚未登記")
+        self.nodes[name] = (func, deps)
+
+    async def run(self) -> dict[str, Any]:
+        """執行所有節點，回傳 {節點名稱: 結果}"""
+        semaphore = asyncio.Semaphore(self.max_concurrency or len(self.nodes) or 1)
+        started = time.perf_counter()
+        self.timings = {}
+        tasks: dict[str, asyncio.Task] = {}
+
+        async def run_node(name: str) -> Any:
+            func, deps = self.nodes[name]
+            args = [await tasks[dep] for dep in deps]
+            async with semaphore:
+                start = time.perf_counter() - started
+                result = await func(*args)
+                self.timings[name] = NodeTiming(start, time.perf_counter() - started)
+            return result
+
+        for name in self.nodes:
+            tasks[name] = asyncio.create_task(run_node(name), name=name)
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        finally:
+            self.elapsed = time.perf_counter() - started
+        return {name: task.result() for name, task in tasks.items()}
+
+    def critical_path(self) -> list[str]:
+        """最後結束的節點往回找：每一步都是讓它等最久的依賴"""
+        if not self.timings:
+            return []
+        path = [max(self.timings, key=lambda name: self.timings[name].end)]
+        while deps := self.nodes[path[-1]][1]:
+            path.append(max(deps, key=lambda dep: self.timings[dep].end))
+        return path[::-1]
+
+    def report(self) -> str:
+        serial = sum(timing.seconds for timing in self.timings.values())
+        path = self.critical_path()
+        path_seconds = sum(self.timings[name].seconds for name in path)
+        return (
+            f"{len(self.timings)} 個節點，實際耗時 {self.elapsed:.2f} 秒"
+            f"（逐一執行約 {serial:.2f} 秒）；"
+            f"關鍵路徑 {' → '.join(path)}（{path_seconds:.2f} 秒）"
+        )
+
+
+if __name__ == "__main__":
+
+    async def demo():
+        async def step(seconds: float, *_: Any) -> float:
+            await asyncio.sleep(seconds)
+            return seconds
+
+        dag = AsyncDAG(max_concurrency=4)
+        dag.add("規劃", lambda: step(0.2))
+        for day in ("Day1", "Day2", "Day3"):
+            dag.add(f"{day}/午餐", lambda _: step(0.3), deps=["規劃"])
+            dag.add(f"{day}/去程", lambda _: step(0.1), deps=[f"{day}/午餐"])
+            dag.add(f"{day}/回程", lambda _: step(0.1), deps=[f"{day}/午餐"])
+            dag.add(
+                f"{day}/統籌",
+                lambda *_: step(0.05),
+                deps=[f"{day}/去程", f"{day}/回程"],
+            )
+        await dag.run()
+        print(dag.report())
+
+    asyncio.run(demo())
@@ -0,0 +1,43 @@
+"""
+取消進行中的 agent 呼叫後，修復對話紀錄
+
+`agent.ainvoke` / `astream` 被取消時，checkpoint 會停在執行到一半的狀態：
+- 只有使用者訊息，還沒有任何回答
+- 模型已經發出 tool_calls，但還沒有對應的 ToolMessage
+
+下一輪直接接著跑的話，多數 provider 會因為缺少 ToolMessage 而報錯。
+`aclose_interrupted_turn` 會補上取消說明，讓這一輪正常結束：
+
+    task.cancel()
+    await asyncio.wait([task])
+    await aclose_interrupted_turn(agent, config)
+"""
+
+from typing import Any
+
+from langchain_core.messages import AIMessage, ToolMessage
+
+CANCELLED_NOTE = "（使用者取消了這次回答）"
+
+
+async def aclose_interrupted_turn(
+    agent: Any, config: dict, note: str = CANCELLED_NOTE
+) -> bool:
+    """若上一輪沒有跑完，補上缺少的 ToolMessage 與一則取消說明；有修復時回傳 True"""
+    state = await agent.aget_state(config)
+    if not state.next:
+        return False  # 上一輪已正常結束（或取消時還沒寫入任何 checkpoint）
+
+    messages = state.values.get("messages", [])
+    answered = {msg.tool_call_id for msg in messages if isinstance(msg, ToolMessage)}
+    patch = [
+        ToolMessage(note, tool_call_id=call["id"], name=call["name"])
+        for msg in messages
+        if isinstance(msg, AIMessage)
+        for call in msg.tool_calls
+        if call["id"] not in answered
+    ]
+    patch.append(AIMessage(note))
+    # 以 model 節點的身分寫入不含 tool_calls 的回答，圖會判定這一輪已結束
+    await agent.aupdate_state(config, {"messages": patch}, as_node="model")
+    return True
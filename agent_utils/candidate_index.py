@@ -0,0 +1,141 @@
+"""
+候選項目的標籤倒排索引
+
+把整份偏好與所有候選一起貼進提示詞、請 LLM 挑一個，候選一多就放不下。
+改成先在本地篩選與排序，只把前幾名交給 LLM（有明確首選時甚至不必呼叫）：
+
+    index = CandidateIndex(candidates)               # 每個候選都有 tags 欄位
+    ranked = index.search(weights={"schnitzel": 1.0}, exclude=["beef"], k=3)
+    winner = clear_winner(ranked)                    # None 表示還是交給 LLM 決定
+
+- 每個標籤對應一個候選編號陣列（postings list），排除與計分都只碰到相關的候選
+- 排除條件是硬限制（例如不吃牛肉就排除帶 beef 標籤的餐廳），偏好只影響分數
+- 分數相同時維持原本的順序
+
+數萬筆候選的篩選與排序量測：
+    uv run python -m agent_utils.candidate_index
+"""
+
+import random
+import time
+from collections import defaultdict
+from collections.abc import Iterable, Mapping, Sequence
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+
+
+@dataclass
+class Ranked:
+    """排序結果：候選與偏好分數"""
+
+    candidate: dict[str, Any]
+    score: float
+
+
+class CandidateIndex:
+    """標籤 → 候選編號的倒排索引
+
+    Args:
+        candidates: 候選項目，每個都是 dict
+        tag_key: 標籤清單所在的欄位
+    """
+
+    def __init__(self, candidates: Sequence[dict[str, Any]], tag_key: str = "tags"):
+        self.candidates = list(candidates)
+        postings: dict[str, list[int]] = defaultdict(list)
+        for i, candidate in enumerate(self.candidates):
+            for tag in set(candidate.get(tag_key, ())):
+                postings[tag].append(i)
+        self.postings = {
+            tag: np.array(ids, dtype=np.int64) for tag, ids in postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.candidates)
+
+    def allowed(self, exclude: Iterable[str] = ()) -> np.ndarray:
+        """沒有任何排除標籤的候選遮罩"""
+        mask = np.ones(len(self.candidates), dtype=bool)
+        for tag in exclude:
+            ids = self.postings.get(tag)
+            if ids is not None:
+                mask[ids] = False
+        return mask
+
+    def scores(
+        self, weights: Mapping[str, float], exclude: Iterable[str] = ()
+    ) -> np.ndarray:
+        """每個候選的偏好分數（符合的標籤權重加總），被排除的候選為 -inf"""
+        scores = np.zeros(len(self.candidates), dtype=np.float64)
+        for tag, weight in weights.items():
+            ids = self.postings.get(tag)
+            if ids is not None:
+                scores[ids] += weight
+        scores[~self.allowed(exclude)] = -np.inf
+        return scores
+
+    def search(
+        self,
+        weights: Mapping[str, float],
+        exclude: Iterable[str] = (),
+        k: int = 3,
+    ) -> list[Ranked]:
+        """排除後依分數取前 k 名"""
+        scores = self.scores(weights, exclude)
+        survivors = int(np.isfinite(scores).sum())
+        k = min(k, survivors)
+        if k == 0:
+            return []
+        if k < len(scores):
+            # argpartition 在第 k 名同分時任選，改成取所有較高分的，再依編號補滿同分的
+            kth = -np.partition(-scores, k - 1)[k - 1]
+            above = np.flatnonzero(scores > kth)
+            ties = np.flatnonzero(scores == kth)[: k - len(above)]
+            top = np.concatenate([above, ties])
+        else:
+            top = np.arange(k)
+        # 分數高的在前，同分時編號小（原本順序在前）的在前
+        top = top[np.lexsort((top, -scores[top]))]
+        return [Ranked(self.candidates[i], float(scores[i])) for i in top]
+
+
+def clear_winner(
+    ranked: Sequence[Ranked], margin: float = 1.0
+) -> dict[str, Any] | None:
+    """第一名有符合偏好、且領先第二名至少 margin 分時回傳，否則回傳 None"""
+    if not ranked or ranked[0].score <= 0:
+        return None
+    if len(ranked) == 1 or ranked[0].score - ranked[1].score >= margin:
+        return ranked[0].candidate
+    return None
+
+
+if __name__ == "__main__":
+    rng = random.Random(0)
+    vocabulary = [f"tag{i}" for i in range(60)] + ["beef", "pork", "schnitzel"]
+    candidates = [
+        {"name": f"餐廳 {i}", "tags": rng.sample(vocabulary, k=rng.randint(1, 5))}
+        for i in range(50_000)
+    ]
+
+    started = time.perf_counter()
+    index = CandidateIndex(candidates)
+    print(
+        f"建立索引：{len(index)} 筆候選，{(time.perf_counter() - started) * 1000:.0f} ms"
+    )
+
+    weights = {"schnitzel": 2.0, "tag3": 1.0, "tag7": 0.5}
+    exclude = ["beef", "pork"]
+    index.search(weights, exclude)  # 預熱 NumPy
+
+    repeat = 200
+    started = time.perf_counter()
+    for _ in range(repeat):
+        ranked = index.search(weights, exclude, k=5)
+    elapsed = (time.perf_counter() - started) / repeat
+    print(f"排除 + 計分 + 取前 5 名：{elapsed * 1e6:.0f} µs / 次")
+    for item in ranked:
+        print(f"  {item.score:.1f} {item.candidate['name']} {item.candidate['tags']}")
+    print("明確首選：", (clear_winner(ranked) or {}).get("name", "無，交給 LLM"))
@@ -0,0 +1,297 @@
+"""
+對話歷史 token 預算裁剪 Middleware
+
+每一輪送進模型的 prompt 只保留：
+- 系統提示詞
+- 最近 N 輪對話（一輪 = 一則使用者訊息加上之後的 AI / 工具訊息，
+  因此尚未完成的 tool call / tool result 一定完整保留）
+- 更早的對話折疊成一段「累積摘要」，附在系統提示詞後面
+
+摘要依 thread_id 快取，只有折疊範圍往後移動時才增量更新，
+不會每一輪都重新摘要整段歷史。裁剪只影響送出的 prompt，
+checkpoint 中的完整對話不會被修改。
+"""
+
+from collections import OrderedDict, deque
+from collections.abc import Awaitable, Callable, Sequence
+from dataclasses import dataclass
+from typing import Any
+
+from langchain.agents.middleware import AgentMiddleware, ModelRequest, ModelResponse
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import (
+    AIMessage,
+    AnyMessage,
+    HumanMessage,
+    SystemMessage,
+    ToolMessage,
+)
+from langchain_core.messages.utils import count_tokens_approximately
+from langgraph.config import get_config
+from langgraph.constants import TAG_NOSTREAM
+
+SUMMARY_PROMPT = """請將以下對話整理成精簡的重點摘要（繁體中文，條列式，200 字以內）。
+保留使用者的位置、偏好、已查詢過的城市與天氣結果，省略寒暄。
+
+先前的摘要：
+{previous}
+
+新增的對話：
+{transcript}
+"""
+
+# 摘要呼叫不要混進 agent 的串流輸出
+SUMMARY_CONFIG = {"tags": [TAG_NOSTREAM]}
+
+
+def chinese_aware_token_count(messages: Sequence[AnyMessage]) -> int:
+    """粗估 token 數：中文大約 1.5 字元 / token，比預設的 4 字元更貼近實際"""
+    return count_tokens_approximately(messages, chars_per_token=1.5)
+
+
+@dataclass
+class TrimReport:
+    """單次模型呼叫的裁剪結果"""
+
+    thread_id: str
+    original_tokens: int
+    sent_tokens: int
+    folded_messages: int
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.original_tokens - self.sent_tokens
+
+
+@dataclass
+class _SummaryCache:
+    folded_count: int
+    last_folded_id: str | None
+    summary: str
+
+
+class TokenBudgetMiddleware(AgentMiddleware):
+    """限制每一輪 prompt token 數的 middleware
+
+    Args:
+        max_tokens: 每一輪對話訊息（不含系統提示詞與工具 schema）的 token 上限
+        keep_last_turns: 至少完整保留的最近輪數（預算不足時會逐步減少，最少 1 輪）
+        summary_model: 用來產生摘要的模型；None 則用本地規則壓縮，不額外呼叫 LLM
+        token_counter: 計算訊息 token 數的函式
+        max_cached_threads: 摘要快取最多保留的 thread 數（LRU）
+        verbose: 是否印出每一輪節省的 token 數
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 2000,
+        keep_last_turns: int = 3,
+        *,
+        summary_model: BaseChatModel | None = None,
+        token_counter: Callable[
+            [Sequence[AnyMessage]], int
+        ] = chinese_aware_token_count,
+        max_cached_threads: int = 1024,
+        verbose: bool = False,
+    ):
+        super().__init__()
+        self.max_tokens = max_tokens
+        self.keep_last_turns = max(1, keep_last_turns)
+        self.summary_model = summary_model
+        self.token_counter = token_counter
+        self.max_cached_threads = max_cached_threads
+        self.verbose = verbose
+        self.summaries: OrderedDict[str, _SummaryCache] = OrderedDict()
+        self.reports: deque[TrimReport] = deque(maxlen=100)
+
+    # ===== 規劃要折疊的範圍 =====
+    def _plan(self, thread_id: str, messages: list[AnyMessage]) -> int:
+        """回傳要折疊進摘要的訊息數（0 表示不需裁剪）"""
+        if self.token_counter(messages) <= self.max_tokens:
+            return 0
+        # 沿用上次的折疊位置仍在預算內時就不移動，避免每一輪都重新摘要
+        cache = self._cached(thread_id, messages, len(messages) - 1)
+        if (
+            cache
+            and cache.folded_count
+            and isinstance(messages[cache.folded_count], HumanMessage)
+            and self.token_counter(messages[cache.folded_count :]) <= self.max_tokens
+        ):
+            return cache.folded_count
+        turn_starts = [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+        keep = min(self.keep_last_turns, len(turn_starts))
+        if keep == 0:
+            return 0
+        # 保留的部分仍超出預算時，逐步少保留幾輪（最新一輪一定保留）
+        while (
+            keep > 1
+            and self.token_counter(messages[turn_starts[-keep] :]) > self.max_tokens
+        ):
+            keep -= 1
+        return turn_starts[-keep]
+
+    # ===== 摘要 =====
+    def _cached(
+        self, thread_id: str, messages: list[AnyMessage], fold: int
+    ) -> _SummaryCache | None:
+        cache = self.summaries.get(thread_id)
+        if cache is None or cache.folded_count > fold:
+            return None
+        if (
+            cache.folded_count
+            and messages[cache.folded_count - 1].id != cache.last_folded_id
+        ):
+            return None
+        self.summaries.move_to_end(thread_id)
+        return cache
+
+    def _store(
+        self, thread_id: str, messages: list[AnyMessage], fold: int, summary: str
+    ) -> None:
+        self.summaries[thread_id] = _SummaryCache(fold, messages[fold - 1].id, summary)
+        self.summaries.move_to_end(thread_id)
+        while len(self.summaries) > self.max_cached_threads:
+            self.summaries.popitem(last=False)
+
+    @staticmethod
+    def _transcript(messages: Sequence[AnyMessage], limit: int | None = None) -> str:
+        lines = []
+        for m in messages:
+            if isinstance(m, HumanMessage):
+                role = "使用者"
+            elif isinstance(m, AIMessage):
+                role = "助手"
+                if not m.text and m.tool_calls:
+                    names = ", ".join(call["name"] for call in m.tool_calls)
+                    lines.append(f"助手: （呼叫工具 {names}）")
+                    continue
+            elif isinstance(m, ToolMessage):
+                role = f"工具 {m.name}"
+            else:
+                continue
+            text = m.text.strip().replace("\n", " ")
+            if limit and len(text) > limit:
+                text = text[:limit] + "…"
+            lines.append(f"{role}: {text}")
+        return "\n".join(lines)
+
+    def _local_summary(self, previous: str, new_messages: Sequence[AnyMessage]) -> str:
+        """不呼叫 LLM 的壓縮：每則訊息截短後接在舊摘要後面，超出預算時丟掉最舊的行"""
+        lines = [line for line in previous.splitlines() if line]
+        lines += self._transcript(new_messages, limit=60).splitlines()
+        budget = self.max_tokens // 4
+        while (
+            len(lines) > 1
+            and self.token_counter([HumanMessage("\n".join(lines))]) > budget
+        ):
+            lines.pop(0)
+        return "\n".join(lines)
+
+    def _summary_prompt(self, previous: str, new_messages: Sequence[AnyMessage]) -> str:
+        return SUMMARY_PROMPT.format(
+            previous=previous or "（無）", transcript=self._transcript(new_messages)
+        )
+
+    def _summarize(self, thread_id: str, messages: list[AnyMessage], fold: int) -> str:
+        cache = self._cached(thread_id, messages, fold)
+        if cache and cache.folded_count == fold:
+            return cache.summary
+        previous, start = (cache.summary, cache.folded_count) if cache else ("", 0)
+        new_messages = messages[start:fold]
+        if self.summary_model is None:
+            summary = self._local_summary(previous, new_messages)
+        else:
+            summary = self.summary_model.invoke(
+                self._summary_prompt(previous, new_messages), config=SUMMARY_CONFIG
+            ).text
+        self._store(thread_id, messages, fold, summary)
+        return summary
+
+    async def _asummarize(
+        self, thread_id: str, messages: list[AnyMessage], fold: int
+    ) -> str:
+        cache = self._cached(thread_id, messages, fold)
+        if cache and cache.folded_count == fold:
+            return cache.summary
+        previous, start = (cache.summary, cache.folded_count) if cache else ("", 0)
+        new_messages = messages[start:fold]
+        if self.summary_model is None:
+            summary = self._local_summary(previous, new_messages)
+        else:
+            response = await self.summary_model.ainvoke(
+                self._summary_prompt(previous, new_messages), config=SUMMARY_CONFIG
+            )
+            summary = response.text
+        self._store(thread_id, messages, fold, summary)
+        return summary
+
+    # ===== 組出新的 request =====
+    def _rewrite(self, request: ModelRequest, fold: int, summary: str) -> ModelRequest:
+        system_prompt = request.system_prompt or ""
+        system_message = SystemMessage(
+            content=f"{system_prompt}\n\n[先前對話摘要]\n{summary}".strip()
+        )
+        return request.override(
+            messages=request.messages[fold:], system_message=system_message
+        )
+
+    def _report(
+        self, thread_id: str, before: ModelRequest, after: ModelRequest, fold: int
+    ) -> None:
+        def size(request: ModelRequest) -> int:
+            system = [request.system_message] if request.system_message else []
+            return self.token_counter(system + list(request.messages))
+
+        report = TrimReport(thread_id, size(before), size(after), fold)
+        self.reports.append(report)
+        if self.verbose and fold:
+            print(
+                f"✂️  歷史裁剪：{report.original_tokens} → {report.sent_tokens} tokens"
+                f"（節省 {report.saved_tokens}，折疊 {fold} 則訊息）"
+            )
+
+    @staticmethod
+    def _thread_id() -> str:
+        try:
+            return str(get_config()["configurable"].get("thread_id", "default"))
+        except RuntimeError:
+            return "default"
+
+    # ===== Middleware hooks =====
+    def wrap_model_call(
+        self,
+        request: ModelRequest,
+        handler: Callable[[ModelRequest], ModelResponse],
+    ) -> ModelResponse:
+        thread_id = self._thread_id()
+        fold = self._plan(thread_id, request.messages)
+        new_request = request
+        if fold:
+            summary = self._summarize(thread_id, request.messages, fold)
+            new_request = self._rewrite(request, fold, summary)
+        self._report(thread_id, request, new_request, fold)
+        return handler(new_request)
+
+    async def awrap_model_call(
+        self,
+        request: ModelRequest,
+        handler: Callable[[ModelRequest], Awaitable[ModelResponse]],
+    ) -> ModelResponse:
+        thread_id = self._thread_id()
+        fold = self._plan(thread_id, request.messages)
+        new_request = request
+        if fold:
+            summary = await self._asummarize(thread_id, request.messages, fold)
+            new_request = self._rewrite(request, fold, summary)
+        self._report(thread_id, request, new_request, fold)
+        return await handler(new_request)
+
+    def stats(self) -> dict[str, Any]:
+        """最近幾輪的裁剪統計"""
+        saved = [r.saved_tokens for r in self.reports]
+        return {
+            "turns": len(saved),
+            "trimmed_turns": sum(1 for r in self.reports if r.folded_messages),
+            "saved_tokens_total": sum(saved),
+            "saved_tokens_last": saved[-1] if saved else 0,
+        }
@@ -0,0 +1,137 @@
+"""
+本地意圖閘門：在呼叫 agent 之前先擋掉明確與天氣無關的問題
+
+判斷分兩層，全部在本地完成（微秒等級）：
+1. 關鍵字：出現天氣相關字詞就直接放行
+2. 字元 n-gram + 邏輯迴歸：以 intent_gate_data.TRAIN 訓練，
+   只有「無關」機率超過門檻才婉拒，模稜兩可的問題一律交給 agent
+
+評估（標註測試集 + 延遲）：
+    uv run python -m agent_utils.intent_gate
+"""
+
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from agent_utils.intent_gate_data import TEST, TRAIN
+from agent_utils.semantic_cache import HashingEmbedder, normalize_question
+
+WEATHER_KEYWORDS = (
+    "天氣",
+    "氣溫",
+    "溫度",
+    "下雨",
+    "雨傘",
+    "降雨",
+    "晴",
+    "颱風",
+    "濕度",
+    "紫外線",
+    "下雪",
+    "起霧",
+    "打雷",
+    "寒流",
+    "預報",
+    "空氣品質",
+    "weather",
+    "rain",
+    "sunny",
+    "temperature",
+    "snow",
+    "forecast",
+)
+
+
+@dataclass
+class GateDecision:
+    allowed: bool
+    off_topic_score: float  # 無關機率（0~1）
+    reason: str  # keyword / short / model
+
+
+class IntentGate:
+    """天氣意圖閘門
+
+    Args:
+        threshold: 無關機率超過此值才婉拒，越高越保守（越少誤擋）
+        min_length: 正規化後短於此長度的輸入多半是追問或招呼語，直接放行
+        train_data: (文字, 標籤) 訓練資料，標籤為 pass / off_topic
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.8,
+        min_length: int = 4,
+        train_data: list[tuple[str, str]] = TRAIN,
+    ):
+        self.threshold = threshold
+        self.min_length = min_length
+        self.embedder = HashingEmbedder(dim=512, ngram_range=(1, 2))
+        self.weights, self.bias = self._train(train_data)
+
+    def _train(
+        self,
+        data: list[tuple[str, str]],
+        epochs: int = 2000,
+        lr: float = 4.0,
+        l2: float = 1e-4,
+    ) -> tuple[np.ndarray, float]:
+        """以梯度下降訓練邏輯迴歸（資料只有幾十筆，啟動時訓練約數毫秒）"""
+        x = self.embedder([normalize_question(text) for text, _ in data])
+        y = np.array([label == "off_topic" for _, label in data], dtype=np.float32)
+        weights = np.zeros(x.shape[1], dtype=np.float32)
+        bias = 0.0
+        for _ in range(epochs):
+            p = 1.0 / (1.0 + np.exp(-(x @ weights + bias)))
+            error = p - y
+            weights -= lr * (x.T @ error / len(y) + l2 * weights)
+            bias -= lr * float(error.mean())
+        return weights, bias
+
+    def off_topic_score(self, text: str) -> float:
+        x = self.embedder([normalize_question(text)])[0]
+        return float(1.0 / (1.0 + np.exp(-(x @ self.weights + self.bias))))
+
+    def check(self, text: str) -> GateDecision:
+        lowered = text.lower()
+        if any(keyword in lowered for keyword in WEATHER_KEYWORDS):
+            return GateDecision(True, 0.0, "keyword")
+        if len(normalize_question(text)) < self.min_length:
+            return GateDecision(True, 0.0, "short")
+        score = self.off_topic_score(text)
+        return GateDecision(score < self.threshold, score, "model")
+
+
+def evaluate(gate: IntentGate, data: list[tuple[str, str]] = TEST) -> dict[str, float]:
+    """在標註資料上評估：無關問題的婉拒率、相關問題的誤擋率與每次判斷延遲"""
+    latencies = []
+    refused = {"pass": 0, "off_topic": 0}
+    total = {"pass": 0, "off_topic": 0}
+    for text, label in data:
+        started = time.perf_counter()
+        decision = gate.check(text)
+        latencies.append(time.perf_counter() - started)
+        total[label] += 1
+        refused[label] += not decision.allowed
+    latencies_us = np.array(latencies) * 1e6
+    return {
+        "off_topic_recall": refused["off_topic"] / max(total["off_topic"], 1),
+        "false_refusal_rate": refused["pass"] / max(total["pass"], 1),
+        "latency_p50_us": float(np.percentile(latencies_us, 50)),
+        "latency_p99_us": float(np.percentile(latencies_us, 99)),
+    }
+
+
+if __name__ == "__main__":
+    started = time.perf_counter()
+    gate = IntentGate()
+    print(f"訓練時間：{(time.perf_counter() - started) * 1000:.1f} ms")
+    for text, label in TEST:
+        decision = gate.check(text)
+        mark = "✅" if decision.allowed == (label == "pass") else "❌"
+        print(
+            f"{mark} {label:9} {decision.off_topic_score:.2f} {decision.reason:7} {text}"
+        )
+    print(evaluate(gate))
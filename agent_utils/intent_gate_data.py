@@ -0,0 +1,116 @@
+"""
+天氣助手意圖閘門的標註資料
+
+- pass: 應該交給 agent 的問題（天氣相關，以及需要上下文才能判斷的追問、招呼語）
+- off_topic: 明確與天氣無關、可以直接婉拒的問題
+
+TRAIN 用來訓練線性模型，TEST 只用來評估（兩者不重複）。
+"""
+
+TRAIN: list[tuple[str, str]] = [
+    # ---- 天氣相關 ----
+    ("台北天氣如何", "pass"),
+    ("今天台北會下雨嗎", "pass"),
+    ("明天高雄天氣怎麼樣", "pass"),
+    ("現在外面幾度", "pass"),
+    ("這週末台南會不會很熱", "pass"),
+    ("我需要帶傘嗎", "pass"),
+    ("今天適合曬衣服嗎", "pass"),
+    ("颱風什麼時候來", "pass"),
+    ("明天早上會起霧嗎", "pass"),
+    ("濕度多少", "pass"),
+    ("紫外線強不強", "pass"),
+    ("空氣品質好嗎", "pass"),
+    ("下午會變冷嗎", "pass"),
+    ("最高溫幾度", "pass"),
+    ("晚上出門要穿外套嗎", "pass"),
+    ("這幾天會放晴嗎", "pass"),
+    ("東京現在的天氣", "pass"),
+    ("新竹風大不大", "pass"),
+    ("下週會有寒流嗎", "pass"),
+    ("今天降雨機率多少", "pass"),
+    ("週末適合去爬山嗎，天氣好嗎", "pass"),
+    ("我這裡的天氣", "pass"),
+    ("目前氣溫", "pass"),
+    ("會打雷嗎", "pass"),
+    ("天氣預報", "pass"),
+    ("what's the weather in Taipei", "pass"),
+    ("will it rain tomorrow", "pass"),
+    ("how hot is it today", "pass"),
+    # ---- 需要上下文的追問與招呼語：交給 agent ----
+    ("那明天呢", "pass"),
+    ("高雄呢", "pass"),
+    ("謝謝", "pass"),
+    ("你好", "pass"),
+    ("嗨", "pass"),
+    ("再說一次", "pass"),
+    ("為什麼", "pass"),
+    ("那後天", "pass"),
+    # ---- 與天氣無關 ----
+    ("幫我寫一首詩", "off_topic"),
+    ("推薦台北好吃的餐廳", "off_topic"),
+    ("Python 的 list 怎麼排序", "off_topic"),
+    ("今天股市會漲嗎", "off_topic"),
+    ("幫我翻譯這段英文", "off_topic"),
+    ("講個笑話", "off_topic"),
+    ("台積電股價多少", "off_topic"),
+    ("怎麼煮義大利麵", "off_topic"),
+    ("幫我寫一封請假信", "off_topic"),
+    ("誰是美國總統", "off_topic"),
+    ("推薦幾本好看的小說", "off_topic"),
+    ("1 加 1 等於多少", "off_topic"),
+    ("幫我規劃減肥菜單", "off_topic"),
+    ("台北到高雄高鐵票多少錢", "off_topic"),
+    ("幫我debug這段程式碼", "off_topic"),
+    ("如何學好英文", "off_topic"),
+    ("推薦一部電影", "off_topic"),
+    ("比特幣現在多少錢", "off_topic"),
+    ("寫一段 SQL 查詢", "off_topic"),
+    ("解釋量子力學", "off_topic"),
+    ("幫我算這題數學", "off_topic"),
+    ("明天的樂透號碼", "off_topic"),
+    ("怎麼申請信用卡", "off_topic"),
+    ("你覺得哪支手機好用", "off_topic"),
+    ("幫我寫履歷", "off_topic"),
+    ("台北有什麼景點", "off_topic"),
+    ("write me a poem", "off_topic"),
+    ("how to sort a list in python", "off_topic"),
+    ("tell me a joke", "off_topic"),
+    ("who won the world cup", "off_topic"),
+]
+
+TEST: list[tuple[str, str]] = [
+    # ---- 天氣相關 ----
+    ("高雄今天熱不熱", "pass"),
+    ("明天台北天氣好嗎", "pass"),
+    ("晚上會下雨嗎", "pass"),
+    ("今天要帶雨傘嗎", "pass"),
+    ("台中現在溫度", "pass"),
+    ("這週天氣預報", "pass"),
+    ("早上冷不冷", "pass"),
+    ("會下雪嗎", "pass"),
+    ("颱風假會放嗎", "pass"),
+    ("明天風會很大嗎", "pass"),
+    ("今天紫外線指數", "pass"),
+    ("is it sunny in Tainan", "pass"),
+    # ---- 追問與招呼語 ----
+    ("那台南呢", "pass"),
+    ("好的謝謝你", "pass"),
+    ("哈囉", "pass"),
+    ("後天呢", "pass"),
+    # ---- 與天氣無關 ----
+    ("幫我寫一首關於秋天的詩", "off_topic"),
+    ("推薦高雄的美食", "off_topic"),
+    ("JavaScript 怎麼宣告變數", "off_topic"),
+    ("今天美股表現如何", "off_topic"),
+    ("幫我把這句話翻成日文", "off_topic"),
+    ("說一個冷笑話", "off_topic"),
+    ("晚餐要吃什麼", "off_topic"),
+    ("幫我寫一封道歉信", "off_topic"),
+    ("日本首相是誰", "off_topic"),
+    ("推薦好聽的歌", "off_topic"),
+    ("幫我算 123 乘 456", "off_topic"),
+    ("怎麼開立銀行帳戶", "off_topic"),
+    ("write a python function", "off_topic"),
+    ("recommend a good book", "off_topic"),
+]
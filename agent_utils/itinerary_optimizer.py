@@ -0,0 +1,245 @@
+"""
+多日行程排序最佳化
+
+LLM 只負責挑「要去哪些景點、吃哪些餐廳」，排到哪一天、上午還是下午交給本地計算：
+
+    minutes, index = travel_matrix.matrix(sights + restaurants)
+    result = optimize_itinerary(
+        {"sight": sights, "meal": restaurants}, minutes, index, days=2
+    )
+    result.days   # [["美泉宮", "Figlmüller", "霍夫堡"], ...]，順序同 DAY_TEMPLATE
+
+- 每天的格式由 template 決定（預設：上午景點 180 分鐘 → 午餐 90 分鐘 → 下午景點 150 分鐘）
+- 目標：先讓每天都在 09:00–18:00 內結束（超時分鐘數最少），再讓總交通時間最短
+- 候選組合不多時一次用 NumPy 窮舉所有分派，保證最佳
+- 組合太多時改用局部搜尋：每一步把所有「交換兩個同類地點」（跨天或同一天前後對調，
+  即 2-opt 的分派版本）與「換上還沒用到的地點」（or-opt）一次評估，取最好的一步，
+  直到沒有改進；以不同的隨機初始解重啟數次
+- 地點可以比需要的多，多出來的不會排進行程
+
+    uv run python -m agent_utils.itinerary_optimizer
+"""
+
+import itertools
+import math
+import time
+from collections.abc import Mapping, Sequence
+from dataclasses import dataclass
+
+import numpy as np
+
+from agent_utils.schedule_engine import DAY_END, DAY_START
+
+
+@dataclass(frozen=True)
+class Slot:
+    """一天中的一個時段"""
+
+    kind: str  # 要放哪一類地點，對應 places 的 key
+    minutes: int  # 停留時間
+    label: str  # 例如 am / lunch / pm
+
+
+DAY_TEMPLATE = (
+    Slot("sight", 180, "am"),
+    Slot("meal", 90, "lunch"),
+    Slot("sight", 150, "pm"),
+)
+
+
+@dataclass
+class ItineraryPlan:
+    """最佳化結果"""
+
+    days: list[list[str]]  # 每天依 template 順序的地點
+    legs: list[list[float]]  # 每天各段交通分鐘數
+    travel: float  # 總交通分鐘數
+    overtime: float  # 所有天數超過截止時間的分鐘數加總
+    method: str  # exhaustive / local search
+    evaluated: int  # 評估過的候選數
+    seconds: float
+
+    @property
+    def feasible(self) -> bool:
+        return self.overtime == 0
+
+
+def _evaluate(
+    assignments: np.ndarray,
+    minutes: np.ndarray,
+    days: int,
+    template: Sequence[Slot],
+    day_start: float,
+    day_end: float,
+) -> tuple[np.ndarray, np.ndarray]:
+    """一批分派 (n, days × slots) 的 (超時分鐘數, 交通分鐘數)"""
+    routes = assignments.reshape(len(assignments), days, len(template))
+    legs = minutes[routes[:, :, :-1], routes[:, :, 1:]]
+    finish = day_start + sum(slot.minutes for slot in template) + legs.sum(axis=2)
+    overtime = np.maximum(finish - day_end, 0).sum(axis=1)
+    return overtime, legs.sum(axis=(1, 2))
+
+
+def _best(overtime: np.ndarray, travel: np.ndarray) -> int:
+    return int(np.lexsort((travel, overtime))[0])
+
+
+def optimize_itinerary(
+    places: Mapping[str, Sequence[str]],
+    minutes: np.ndarray,
+    index: Mapping[str, int],
+    days: int,
+    template: Sequence[Slot] = DAY_TEMPLATE,
+    *,
+    day_start: float = DAY_START,
+    day_end: float = DAY_END,
+    exact_limit: int = 200_000,
+    restarts: int = 8,
+    seed: int = 0,
+) -> ItineraryPlan:
+    """把地點分派到各天的時段，使超時最少、交通時間最短
+
+    Args:
+        places: {種類: 地點清單}，種類對應 template 中的 Slot.kind
+        minutes: 交通時間矩陣（例如 TravelTimeMatrix.matrix 的結果）
+        index: 地點 → 矩陣的列
+        days: 天數
+        exact_limit: 候選組合數不超過此值時窮舉，否則用局部搜尋
+        restarts: 局部搜尋的重啟次數
+    """
+    started = time.perf_counter()
+    minutes = np.asarray(minutes, dtype=np.float64)
+    positions = {
+        kind: [
+            day * len(template) + s
+            for day in range(days)
+            for s, slot in enumerate(template)
+            if slot.kind == kind
+        ]
+        for kind in dict.fromkeys(slot.kind for slot in template)
+    }
+    items = {}
+    for kind, slots in positions.items():
+        ids = [index[place] for place in dict.fromkeys(places.get(kind, ()))]
+        if len(ids) < len(slots):
+            raise ValueError(f"{kind} 需要 {len(slots)} 個地點，只有 {len(ids)} 個")
+        items[kind] = np.array(ids, dtype=np.int64)
+    width = days * len(template)
+    args = (minutes, days, template, day_start, day_end)
+
+    total = math.prod(math.perm(len(items[k]), len(positions[k])) for k in positions)
+    if total <= exact_limit:
+        # ---- 窮舉：每一類的所有排列做笛卡兒積 ----
+        perms = {
+            kind: np.array(list(itertools.permutations(items[kind], len(slots))))
+            for kind, slots in positions.items()
+        }
+        grid = np.indices([len(p) for p in perms.values()]).reshape(len(perms), -1)
+        assignments = np.empty((grid.shape[1], width), dtype=np.int64)
+        for row, (kind, slots) in zip(grid, positions.items()):
+            assignments[:, slots] = perms[kind][row]
+        overtime, travel = _evaluate(assignments, *args)
+        best = assignments[_best(overtime, travel)]
+        method, evaluated = "exhaustive", len(assignments)
+    else:
+        best, evaluated = _local_search(positions, items, width, args, restarts, seed)
+        method = "local search"
+
+    overtime, travel = _evaluate(best[None, :], *args)
+    names = {i: place for place, i in index.items()}
+    routes = best.reshape(days, len(template))
+    return ItineraryPlan(
+        days=[[names[i] for i in route] for route in routes],
+        legs=[[float(minutes[a, b]) for a, b in itertools.pairwise(r)] for r in routes],
+        travel=float(travel[0]),
+        overtime=float(overtime[0]),
+        method=method,
+        evaluated=evaluated,
+        seconds=time.perf_counter() - started,
+    )
+
+
+def _local_search(
+    positions: dict[str, list[int]],
+    items: dict[str, np.ndarray],
+    width: int,
+    args: tuple,
+    restarts: int,
+    seed: int,
+) -> tuple[np.ndarray, int]:
+    """隨機初始解 + 最佳改進的交換 / 替換，回傳 (最佳分派, 評估過的候選數)"""
+    rng = np.random.default_rng(seed)
+    best, best_score, evaluated = None, None, 0
+    for _ in range(max(restarts, 1)):
+        current = np.empty(width, dtype=np.int64)
+        for kind, slots in positions.items():
+            current[slots] = rng.permutation(items[kind])[: len(slots)]
+        overtime, travel = _evaluate(current[None, :], *args)
+        score = (overtime[0], travel[0])
+
+        while True:
+            neighbors = []
+            for kind, slots in positions.items():
+                # 兩個同類時段互換（跨天交換，或同一天前後對調）
+                for p, q in itertools.combinations(slots, 2):
+                    moved = current.copy()
+                    moved[p], moved[q] = current[q], current[p]
+                    neighbors.append(moved)
+                # 換上還沒排進行程的地點
+                unused = np.setdiff1d(items[kind], current[slots])
+                for p in slots:
+                    for item in unused:
+                        moved = current.copy()
+                        moved[p] = item
+                        neighbors.append(moved)
+            if not neighbors:
+                break
+            batch = np.array(neighbors)
+            overtime, travel = _evaluate(batch, *args)
+            evaluated += len(batch)
+            i = _best(overtime, travel)
+            if (overtime[i], travel[i]) >= score:
+                break
+            current, score = batch[i], (overtime[i], travel[i])
+
+        if best_score is None or score < best_score:
+            best, best_score = current, score
+    return best, evaluated
+
+
+if __name__ == "__main__":
+    from agent_utils.travel_matrix import TravelTimeMatrix
+
+    sights = [
+        "美泉宮",
+        "美景宮",
+        "聖史蒂芬大教堂",
+        "霍夫堡",
+        "國家圖書館",
+        "維也納歌劇院",
+        "藝術史博物館",
+        "自然史博物館",
+        "卡爾教堂",
+        "普拉特公園",
+    ]
+    meals = ["Figlmüller", "Gasthaus Pöschl", "Café Central", "Plachutta", "Naschmarkt"]
+    matrix = TravelTimeMatrix()
+
+    for days in (2, 3, 5):
+        chosen = {"sight": sights[: 2 * days], "meal": meals[:days]}
+        minutes, index = matrix.matrix(chosen["sight"] + chosen["meal"])
+        result = optimize_itinerary(chosen, minutes, index, days=days)
+        print(
+            f"{days} 天（{result.method}，評估 {result.evaluated} 個候選，"
+            f"{result.seconds * 1000:.1f} ms）：交通 {result.travel:.0f} 分鐘，"
+            f"{'可行' if result.feasible else f'超時 {result.overtime:.0f} 分鐘'}"
+        )
+
+    # 3 天的問題同時用兩種方法求解，確認局部搜尋的品質
+    chosen = {"sight": sights[:6], "meal": meals[:3]}
+    minutes, index = matrix.matrix(chosen["sight"] + chosen["meal"])
+    exact = optimize_itinerary(chosen, minutes, index, days=3)
+    local = optimize_itinerary(chosen, minutes, index, days=3, exact_limit=0)
+    print(f"3 天：窮舉 {exact.travel:.0f} 分鐘，局部搜尋 {local.travel:.0f} 分鐘")
+    for day, (route, legs) in enumerate(zip(exact.days, exact.legs), start=1):
+        print(f"  Day{day}: {' → '.join(route)}（交通 {legs}）")
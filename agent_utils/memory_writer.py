@@ -0,0 +1,156 @@
+"""
+背景記憶寫入
+
+用 LLM 從每一句話擷取偏好比規則準確，但多一次模型呼叫就多一次等待。
+`BackgroundMemoryWriter` 在回覆使用者之後才把這句話放進佇列，
+由同一個 event loop 上的 worker 擷取並寫入記憶，下一輪就看得到：
+
+    writer = BackgroundMemoryWriter(memory, llm_extractor(llm)).start()
+    answer = await recommend(user_input)   # 使用者不必等記憶寫入
+    writer.submit(user_input)
+    await writer.flush()                   # 測試或結束前等佇列清空
+
+- 擷取（慢，await 模型）在 worker 中進行；寫入記憶（快）也在同一個 event loop，
+  不需要再為 PreferenceMemory 加鎖
+- 佇列滿了就丟棄並計數，不會反過來拖慢回覆
+- 擷取失敗只記錄錯誤，不影響對話
+"""
+
+import asyncio
+import json
+from collections.abc import Awaitable, Callable
+from contextlib import suppress
+from typing import Any
+
+from agent_utils.preference_memory import (
+    PreferenceFact,
+    PreferenceMemory,
+    extract_preferences,
+    make_fact,
+)
+
+Extractor = Callable[[str], Awaitable[list[PreferenceFact]]]
+
+EXTRACTION_PROMPT = """從使用者這句話擷取飲食限制與口味偏好，只輸出 JSON 陣列，沒有就輸出 []。
+每一項包含：
+- kind：diet 表示能不能吃（過敏、不吃），like 表示喜不喜歡
+- item：食物名稱
+- value：true 或 false
+例如「我不吃牛肉，但喜歡維也納豬排」→
+[{{"kind": "diet", "item": "牛肉", "value": false}}, {{"kind": "like", "item": "維也納豬排", "value": true}}]
+
+使用者：{text}"""
+
+
+async def rule_extractor(text: str) -> list[PreferenceFact]:
+    """規則擷取（預設值，不呼叫模型）"""
+    return extract_preferences(text)
+
+
+def parse_extraction(raw: str) -> list[PreferenceFact]:
+    """解析 LLM 輸出的 JSON 陣列，格式不對的項目略過"""
+    first, last = raw.find("["), raw.rfind("]")
+    if first == -1 or last < first:
+        raise ValueError(f"輸出中沒有 JSON 陣列：{raw[:80]!r}")
+    facts = []
+    for entry in json.loads(raw[first : last + 1]):
+        if not isinstance(entry, dict):
+            continue
+        kind, item, value = entry.get("kind"), entry.get("item"), entry.get("value")
+        if (
+            kind in ("diet", "like")
+            and isinstance(item, str)
+            and item.strip()
+            and isinstance(value, bool)
+        ):
+            facts.append(make_fact(kind, item.strip(), value))
+    return facts
+
+
+def llm_extractor(llm: Any) -> Extractor:
+    """用 chat model 擷取偏好；模型輸出無法解析時退回規則擷取"""
+
+    async def extract(text: str) -> list[PreferenceFact]:
+        response = await llm.ainvoke(EXTRACTION_PROMPT.format(text=text))
+        try:
+            return parse_extraction(str(response.content))
+        except ValueError:
+            return extract_preferences(text)
+
+    return extract
+
+
+class BackgroundMemoryWriter:
+    """以佇列與 worker task 在背景擷取並寫入偏好記憶
+
+    Args:
+        memory: 要寫入的 PreferenceMemory
+        extractor: 非同步擷取函式，預設為規則擷取
+        maxsize: 佇列上限，滿了之後新的句子會被丟棄
+    """
+
+    def __init__(
+        self,
+        memory: PreferenceMemory,
+        extractor: Extractor | None = None,
+        maxsize: int = 100,
+    ):
+        self.memory = memory
+        self.extractor = extractor or rule_extractor
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize)
+        self.task: asyncio.Task | None = None
+        self.changes: list[tuple[str, PreferenceFact]] = []
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.last_error: Exception | None = None
+
+    def start(self) -> "BackgroundMemoryWriter":
+        """在目前的 event loop 建立 worker task"""
+        self.task = asyncio.create_task(self._run(), name="memory-writer")
+        return self
+
+    def submit(self, text: str) -> bool:
+        """把一句話排進佇列，不等待；佇列已滿時回傳 False"""
+        try:
+            self.queue.put_nowait(text)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            text = await self.queue.get()
+            try:
+                facts = await self.extractor(text)
+                self.changes += self.memory.add_facts(facts)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                self.last_error = e
+            finally:
+                self.queue.task_done()
+
+    async def flush(self) -> None:
+        """等到目前佇列中的句子都處理完"""
+        await self.queue.join()
+
+    async def aclose(self) -> None:
+        """處理完剩下的句子後停止 worker"""
+        if self.task is None:
+            return
+        await self.flush()
+        self.task.cancel()
+        with suppress(asyncio.CancelledError):
+            await self.task
+        self.task = None
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "processed": self.processed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "pending": self.queue.qsize(),
+            "changes": len(self.changes),
+        }
@@ -0,0 +1,348 @@
+"""
+長期偏好記憶
+
+從使用者的每一句話擷取飲食限制與口味偏好，連同向量存進 SQLite，
+每次推薦只取回和問題相關的幾條記憶放進提示詞，而不是整份記憶：
+
+    memory = PreferenceMemory("preferences.sqlite")
+    memory.add("我不吃牛肉，但喜歡維也納豬排")   # 擷取、去重、取代衝突的舊偏好
+    memory.recall("維也納豬排餐廳 壽司店", k=3)  # 和這次候選相關的記憶與相似度
+    exclude, weights = memory.preferences()      # 交給 CandidateIndex 篩選與排序
+
+- 擷取規則以子句為單位（「不吃 X」、「喜歡 X」、「對 X 過敏」…），食物名稱對應到候選餐廳的標籤
+- 同一個 key（例如 diet:beef）只保留最新的一條：內容相同視為重複，內容相反就取代舊的
+- 沒有對應標籤的食物用名稱的向量相似度判斷是不是同一件事（「香菜」與「香菜類」）
+- 預設暴力搜尋（NumPy 內積）；記憶很多時可開啟 ann，以隨機超平面 LSH 只比對鄰近的桶
+
+    uv run python -m agent_utils.preference_memory
+"""
+
+import re
+import sqlite3
+import time
+from collections import defaultdict
+from collections.abc import Callable
+from dataclasses import dataclass
+
+import numpy as np
+
+from agent_utils.semantic_cache import HashingEmbedder
+
+# 食物名稱 → 候選餐廳使用的標籤（較長的詞放前面，優先比對）
+FOOD_TAGS = {
+    "維也納豬排": "schnitzel",
+    "炸豬排": "schnitzel",
+    "豬排": "schnitzel",
+    "牛排": "beef",
+    "牛肉": "beef",
+    "豬肉": "pork",
+    "生魚片": "sushi",
+    "壽司": "sushi",
+    "日本料理": "japanese",
+    "日式": "japanese",
+    "海鮮": "seafood",
+    "素食": "vegetarian",
+    "奧地利菜": "austrian",
+    "甜點": "dessert",
+    "咖啡": "coffee",
+    "辣": "spicy",
+}
+KIND_LABELS = {"diet": "飲食限制", "like": "口味偏好"}
+
+_ITEM = r"(?P<item>[^，,。；;！!？?\s]+)"
+# (規則, 種類, 值)：同一個子句只套用第一條符合的規則，否定的寫法要排在肯定的前面
+# 「想吃」只是這一餐的需求，不當成長期偏好
+RULES = [
+    (re.compile(rf"對{_ITEM}過敏"), "diet", False),
+    (re.compile(rf"(?:不吃|不能吃|不碰|戒掉|戒了){_ITEM}"), "diet", False),
+    (re.compile(rf"(?<!不)(?:開始吃|現在吃|可以吃|也吃){_ITEM}"), "diet", True),
+    (re.compile(rf"(?:不喜歡|不愛|討厭){_ITEM}"), "like", False),
+    (re.compile(rf"(?<!不)(?:喜歡|愛吃|最愛){_ITEM}"), "like", True),
+]
+CLAUSE_SPLIT = re.compile(r"[，,。；;！!？?\n]|但是|但|可是|不過")
+
+
+@dataclass
+class PreferenceFact:
+    """一條偏好記憶"""
+
+    key: str  # 種類:標籤，同一個 key 只保留最新的一條
+    kind: str  # diet（能不能吃）/ like（喜不喜歡）
+    tag: str  # 候選餐廳的標籤；沒有對應標籤時為食物名稱本身
+    value: bool
+    text: str  # 給 LLM 看的敘述，例如「不吃牛肉」
+    created: float = 0.0
+    id: int | None = None
+
+    @property
+    def document(self) -> str:
+        """建立向量用的文字，帶上種類讓「餐廳」、「吃」之類的問題也對得上"""
+        return f"{KIND_LABELS[self.kind]}：{self.text}"
+
+
+VERBS = {
+    ("diet", False): "不吃",
+    ("diet", True): "可以吃",
+    ("like", False): "不喜歡",
+    ("like", True): "喜歡",
+}
+
+
+def make_fact(kind: str, item: str, value: bool) -> PreferenceFact:
+    """由 (種類, 食物名稱, 值) 建立記憶，食物名稱對應到候選餐廳的標籤"""
+    tag = next((tag for word, tag in FOOD_TAGS.items() if word in item), item)
+    return PreferenceFact(
+        f"{kind}:{tag}", kind, tag, value, f"{VERBS[kind, value]}{item}"
+    )
+
+
+def extract_preferences(text: str) -> list[PreferenceFact]:
+    """以規則從一句話擷取偏好；同一句話裡後面的說法優先"""
+    facts: dict[str, PreferenceFact] = {}
+    for clause in CLAUSE_SPLIT.split(text):
+        for pattern, kind, value in RULES:
+            match = pattern.search(clause)
+            if not match:
+                continue
+            item = match.group("item").rstrip("了的啦喔")
+            if item:
+                fact = make_fact(kind, item, value)
+                facts[fact.key] = fact
+            break
+    return list(facts.values())
+
+
+def requested_tags(text: str) -> list[str]:
+    """這句話提到、但沒有被擷取成偏好的食物標籤（「想吃海鮮」這類只針對這一餐的需求）"""
+    stated = {fact.tag for fact in extract_preferences(text)}
+    tags: list[str] = []
+    for word, tag in FOOD_TAGS.items():
+        if word in text and tag not in stated and tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+class PreferenceMemory:
+    """以 SQLite 保存、NumPy 搜尋的偏好記憶
+
+    Args:
+        path: SQLite 檔案路徑，":memory:" 代表不落地（測試用）
+        embedder: 文字 → 已正規化向量的函式，預設為 HashingEmbedder
+        dedupe_threshold: 沒有對應標籤的食物，名稱相似度超過此值視為同一件事
+        ann: 是否使用 LSH 近似搜尋
+        ann_bits: LSH 的超平面數（桶數為 2 ** ann_bits）
+        ann_min_size: 記憶少於此數時即使開啟 ann 也直接暴力搜尋
+    """
+
+    def __init__(
+        self,
+        path: str = ":memory:",
+        embedder: Callable[[list[str]], np.ndarray] | None = None,
+        dedupe_threshold: float = 0.7,
+        ann: bool = False,
+        ann_bits: int = 8,
+        ann_min_size: int = 256,
+    ):
+        self.embedder = embedder or HashingEmbedder(dim=512)
+        self.dedupe_threshold = dedupe_threshold
+        self.ann = ann
+        self.ann_bits = ann_bits
+        self.ann_min_size = ann_min_size
+        self.planes: np.ndarray | None = None
+        self.buckets: dict[int, list[int]] = {}
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS preference_facts ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, kind TEXT NOT NULL, "
+            "tag TEXT NOT NULL, value INTEGER NOT NULL, text TEXT NOT NULL, "
+            "vector BLOB NOT NULL, created REAL NOT NULL, active INTEGER NOT NULL DEFAULT 1)"
+        )
+        self.facts: list[PreferenceFact] = []
+        vectors = []
+        for row in self.conn.execute(
+            "SELECT id, key, kind, tag, value, text, vector, created "
+            "FROM preference_facts WHERE active = 1 ORDER BY id"
+        ):
+            fact_id, key, kind, tag, value, text, blob, created = row
+            self.facts.append(
+                PreferenceFact(key, kind, tag, bool(value), text, created, fact_id)
+            )
+            vectors.append(np.frombuffer(blob, dtype=np.float32))
+        self.vectors = np.array(vectors, dtype=np.float32)
+        self._reindex()
+
+    def __len__(self) -> int:
+        return len(self.facts)
+
+    # ---- 寫入 ----
+    def add(self, text: str) -> list[tuple[str, PreferenceFact]]:
+        """以規則擷取並寫入一句話中的偏好，回傳 (動作, 記憶)；動作為 新增 / 重複 / 取代"""
+        return self.add_facts(extract_preferences(text))
+
+    def add_facts(
+        self, facts: list[PreferenceFact]
+    ) -> list[tuple[str, PreferenceFact]]:
+        """寫入其他方式（例如 LLM）擷取的偏好"""
+        return [(self._upsert(fact), fact) for fact in facts]
+
+    def _upsert(self, fact: PreferenceFact) -> str:
+        vector = self.embedder([fact.document])[0].astype(np.float32)
+        fact.created = time.time()
+        same = self._find_same(fact)
+        if same is not None:
+            old = self.facts[same]
+            if old.value == fact.value:
+                old.created = fact.created
+                self.conn.execute(
+                    "UPDATE preference_facts SET created = ? WHERE id = ?",
+                    (old.created, old.id),
+                )
+                self.conn.commit()
+                return "重複"
+            fact.key, fact.tag = old.key, old.tag  # 沿用舊記憶的 key，之後才對得上
+            self.conn.execute(
+                "UPDATE preference_facts SET active = 0 WHERE id = ?", (old.id,)
+            )
+            del self.facts[same]
+            self.vectors = np.delete(self.vectors, same, axis=0)
+
+        cursor = self.conn.execute(
+            "INSERT INTO preference_facts (key, kind, tag, value, text, vector, created) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                fact.key,
+                fact.kind,
+                fact.tag,
+                int(fact.value),
+                fact.text,
+                vector.tobytes(),
+                fact.created,
+            ),
+        )
+        self.conn.commit()
+        fact.id = cursor.lastrowid
+        self.facts.append(fact)
+        self.vectors = (
+            np.vstack([self.vectors, vector]) if len(self.vectors) else vector[None, :]
+        )
+        self._reindex()
+        return "新增" if same is None else "取代"
+
+    def _find_same(self, fact: PreferenceFact) -> int | None:
+        """同一個 key，或同種類且食物名稱的向量非常相似的舊記憶"""
+        for i, old in enumerate(self.facts):
+            if old.key == fact.key:
+                return i
+        known = set(FOOD_TAGS.values())
+        if fact.tag in known:
+            return None
+        # 只比較食物名稱：整句敘述的共同字（「不吃」）會讓不同食物也很相似
+        others = [
+            i
+            for i, old in enumerate(self.facts)
+            if old.kind == fact.kind and old.tag not in known
+        ]
+        if not others:
+            return None
+        vectors = self.embedder([fact.tag] + [self.facts[i].tag for i in others])
+        scores = vectors[1:] @ vectors[0]
+        best = int(np.argmax(scores))
+        return others[best] if scores[best] >= self.dedupe_threshold else None
+
+    # ---- 查詢 ----
+    def recall(
+        self, query: str, k: int = 3, min_score: float = 0.05
+    ) -> list[tuple[PreferenceFact, float]]:
+        """和問題最相關的 k 條記憶"""
+        if not self.facts:
+            return []
+        vector = self.embedder([query])[0]
+        ids = self._candidates(vector)
+        scores = (self.vectors if ids is None else self.vectors[ids]) @ vector
+        if k < len(scores):
+            top = np.argpartition(-scores, k - 1)[:k]
+            order = top[np.argsort(-scores[top])]
+        else:
+            order = np.argsort(-scores)
+        return [
+            (self.facts[i if ids is None else ids[i]], float(scores[i]))
+            for i in order
+            if scores[i] >= min_score
+        ]
+
+    def preferences(self) -> tuple[list[str], dict[str, float]]:
+        """(要排除的標籤, 偏好標籤權重)：不能吃的硬性排除，不喜歡的扣分"""
+        exclude = [f.tag for f in self.facts if f.kind == "diet" and not f.value]
+        weights = {
+            f.tag: 1.0 if f.value else -1.0 for f in self.facts if f.kind == "like"
+        }
+        return exclude, weights
+
+    # ---- LSH 近似搜尋 ----
+    def _hash(self, vectors: np.ndarray) -> np.ndarray:
+        bits = (vectors @ self.planes) > 0
+        return bits @ (1 << np.arange(self.ann_bits))
+
+    def _reindex(self) -> None:
+        if not self.ann or len(self.facts) < self.ann_min_size:
+            self.buckets = {}
+            return
+        if self.planes is None:
+            rng = np.random.default_rng(0)
+            self.planes = rng.standard_normal((self.vectors.shape[1], self.ann_bits))
+        buckets: dict[int, list[int]] = defaultdict(list)
+        for i, code in enumerate(self._hash(self.vectors)):
+            buckets[int(code)].append(i)
+        self.buckets = dict(buckets)
+
+    def _candidates(self, vector: np.ndarray) -> np.ndarray | None:
+        """要比對的記憶編號：LSH 為同一個桶與只差一個位元的桶，None 表示全部比對"""
+        if not self.buckets:
+            return None
+        code = int(self._hash(vector[None, :])[0])
+        ids = list(self.buckets.get(code, ()))
+        for bit in range(self.ann_bits):
+            ids += self.buckets.get(code ^ (1 << bit), ())
+        return np.array(ids, dtype=np.int64) if ids else None
+
+
+if __name__ == "__main__":
+    memory = PreferenceMemory()
+    turns = [
+        "我不吃牛肉，但喜歡維也納豬排",
+        "我也喜歡豬排啦",
+        "我對香菜過敏",
+        "不吃香菜類",
+        "也不吃香菇",
+        "最近不喜歡壽司了",
+        "其實我現在吃牛肉了",
+    ]
+    for turn in turns:
+        changes = [f"{action} {fact.text}" for action, fact in memory.add(turn)]
+        print(f"{turn} → {changes}")
+
+    print("\n目前的記憶：", [fact.text for fact in memory.facts])
+    print("排除 / 加權：", memory.preferences())
+    for fact, score in memory.recall("市中心維也納豬排餐廳 市中心壽司店", k=3):
+        print(f"  {score:.2f} {fact.document}")
+
+    # 大量記憶：暴力搜尋與 LSH 的查詢時間
+    rng = np.random.default_rng(0)
+    for ann in (False, True):
+        big = PreferenceMemory(ann=ann)
+        big.facts = [
+            PreferenceFact(f"like:t{i}", "like", f"t{i}", True, f"喜歡 t{i}")
+            for i in range(50_000)
+        ]
+        vectors = rng.standard_normal((50_000, 512)).astype(np.float32)
+        big.vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        big._reindex()
+        big.recall("市中心維也納豬排餐廳")  # 預熱
+        started = time.perf_counter()
+        for _ in range(50):
+            big.recall("市中心維也納豬排餐廳")
+        elapsed = (time.perf_counter() - started) / 50
+        print(
+            f"50000 條記憶，{'LSH' if ann else '暴力搜尋'}：{elapsed * 1000:.2f} ms / 次"
+        )
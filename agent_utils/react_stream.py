@@ -0,0 +1,315 @@
+"""
+ReAct 串流解析器
+
+邊接收 token 邊辨識 ReAct 輸出中的動作，動作一完成就可以停止生成、立刻執行工具，
+不必等模型寫完（也不必丟掉它自己幻想出來的 Observation 與後續步驟）：
+
+    parser = ReActStreamParser()
+    for chunk in llm.stream(prompt, stop=STOP_SEQUENCES):
+        for event in parser.feed(chunk.text):
+            ...  # event.kind: action / final / observation
+
+支援兩種動作格式：
+- 經典 ReAct 行：`Action: 查天氣(Vienna)`
+- 工具呼叫標記：`to=tool name=查詢開放狀態 <|constrain|>json<|message|>{"place": "美泉宮"}`
+
+整段文字只掃描一次：在一般文字中找標記，進入動作後逐字追蹤括號深度與字串狀態。
+
+模糊測試與吞吐量量測：
+    uv run python -m agent_utils.react_stream
+"""
+
+import json
+import random
+import re
+import time
+from dataclasses import dataclass, field
+
+ACTION_MARKER = "Action:"
+TOOL_MARKER = "to=tool"
+MESSAGE_MARKER = "<|message|>"
+FINAL_MARKER = "Final Answer:"
+OBSERVATION_MARKER = "Observation:"
+# 模型開始自己寫 Observation 時就停止生成
+STOP_SEQUENCES = [OBSERVATION_MARKER]
+
+TEXT_MARKERS = (ACTION_MARKER, TOOL_MARKER, FINAL_MARKER, OBSERVATION_MARKER)
+LONGEST_MARKER = max(len(marker) for marker in TEXT_MARKERS)
+TOOL_NAME = re.compile(r"name=([^\s<]+)")
+
+
+@dataclass
+class ReActEvent:
+    """解析事件"""
+
+    kind: str  # action / final / observation
+    name: str | None = None  # 工具名稱
+    arg: str | None = None  # 經典格式的參數
+    payload: dict | None = field(default=None, repr=False)  # 工具呼叫標記的 JSON 參數
+    end: int = 0  # 事件在累積文字中的結束位置（observation 為標記的開始位置）
+
+
+class ReActStreamParser:
+    """ReAct 串流解析器；final / observation 之後不再解析"""
+
+    def __init__(self):
+        self.text = ""
+        self.pos = 0  # 下一個要掃描的位置
+        self.state = "text"  # text / action / tool
+        self.start = 0  # 目前動作標記的位置
+        self.body_start = -1  # 參數開始的位置（括號或大括號之後）
+        self.name: str | None = None
+        self.depth = 0
+        self.quote: str | None = None  # 目前所在字串的引號
+        self.escaped = False
+        self.done = False
+
+    def feed(self, chunk: str) -> list[ReActEvent]:
+        self.text += chunk
+        events: list[ReActEvent] = []
+        while not self.done and self.pos < len(self.text):
+            if self.state == "text":
+                progressed = self._scan_text(events)
+            elif self.state == "action":
+                progressed = self._scan_action(events)
+            else:
+                progressed = self._scan_tool(events)
+            if not progressed:
+                break
+        return events
+
+    # ---- 一般文字：找下一個標記 ----
+    def _scan_text(self, events: list[ReActEvent]) -> bool:
+        found, marker = -1, ""
+        for candidate in TEXT_MARKERS:
+            i = self.text.find(candidate, self.pos)
+            if i != -1 and (found == -1 or i < found):
+                found, marker = i, candidate
+        if found == -1:
+            # 保留最後幾個字元，標記可能被切在兩個 chunk 之間
+            self.pos = max(self.pos, len(self.text) - LONGEST_MARKER + 1)
+            return False
+
+        self.start = found
+        self.pos = found + len(marker)
+        if marker == FINAL_MARKER:
+            events.append(ReActEvent("final", end=self.pos))
+            self.done = True
+        elif marker == OBSERVATION_MARKER:
+            events.append(ReActEvent("observation", end=found))
+            self.done = True
+        else:
+            self.state = "action" if marker == ACTION_MARKER else "tool"
+            self.body_start = -1
+            self.depth = 0
+            self.quote = None
+            self.escaped = False
+        return True
+
+    def _scan_string(self, ch: str) -> bool:
+        """處理字串內的字元；回傳 True 表示這個字元屬於字串"""
+        if self.quote is None:
+            return False
+        if self.escaped:
+            self.escaped = False
+        elif ch == "\\":
+            self.escaped = True
+        elif ch == self.quote:
+            self.quote = None
+        return True
+
+    # ---- Action: 工具(參數) ----
+    def _scan_action(self, events: list[ReActEvent]) -> bool:
+        text = self.text
+        for i in range(self.pos, len(text)):
+            ch = text[i]
+            if self.body_start == -1:
+                if ch == "(":
+                    self.name = text[self.start + len(ACTION_MARKER) : i].strip()
+                    self.body_start = i + 1
+                    self.depth = 1
+                elif ch == "\n" and text[self.start + len(ACTION_MARKER) : i].strip():
+                    # 工具名稱之後直接換行，不是這種格式，回到一般文字
+                    self.state = "text"
+                    self.pos = i
+                    return True
+                continue
+            if self._scan_string(ch):
+                continue
+            if ch in "\"'":
+                self.quote = ch
+            elif ch == "(":
+                self.depth += 1
+            elif ch == ")":
+                self.depth -= 1
+                if self.depth == 0:
+                    arg = text[self.body_start : i].strip().strip('"').strip("'")
+                    events.append(ReActEvent("action", self.name, arg, end=i + 1))
+                    self.state = "text"
+                    self.pos = i + 1
+                    return True
+        self.pos = len(text)
+        return False
+
+    # ---- to=tool name=... <|message|>{...} ----
+    def _scan_tool(self, events: list[ReActEvent]) -> bool:
+        text = self.text
+        if self.body_start == -1:
+            i = text.find(MESSAGE_MARKER, self.pos)
+            if i == -1:
+                self.pos = max(self.pos, len(text) - len(MESSAGE_MARKER) + 1)
+                return False
+            match = TOOL_NAME.search(text, self.start, i)
+            self.name = match.group(1) if match else None
+            self.body_start = i + len(MESSAGE_MARKER)
+            self.pos = self.body_start
+
+        for i in range(self.pos, len(text)):
+            ch = text[i]
+            if self.depth == 0:
+                if ch == "{":
+                    self.body_start = i
+                    self.depth = 1
+                elif not ch.isspace():
+                    self.state = "text"  # 標記後面不是 JSON 物件
+                    self.pos = i
+                    return True
+                continue
+            if self._scan_string(ch):
+                continue
+            if ch == '"':
+                self.quote = ch
+            elif ch == "{":
+                self.depth += 1
+            elif ch == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    payload = _loads_payload(text[self.body_start : i + 1])
+                    if payload is not None and self.name:
+                        events.append(
+                            ReActEvent("action", self.name, payload=payload, end=i + 1)
+                        )
+                    self.state = "text"
+                    self.pos = i + 1
+                    return True
+        self.pos = len(text)
+        return False
+
+
+def _loads_payload(raw: str) -> dict | None:
+    """解析工具參數 JSON；模型常在字串中間斷行，失敗時移除換行再試一次"""
+    for candidate in (raw, raw.replace("\n", "")):
+        try:
+            payload = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        return payload if isinstance(payload, dict) else None
+    return None
+
+
+def parse_react(text: str, chunk_size: int | None = None) -> list[ReActEvent]:
+    """一次解析整段文字（chunk_size 用來模擬串流切塊）"""
+    parser = ReActStreamParser()
+    if chunk_size is None:
+        return parser.feed(text)
+    events = []
+    for i in range(0, len(text), chunk_size):
+        events += parser.feed(text[i : i + chunk_size])
+    return events
+
+
+# ===== 模糊測試語料：(模型輸出, 預期的第一個事件) =====
+FUZZ_CORPUS: list[tuple[str, tuple | None]] = [
+    ("Thought: 先查天氣\nAction: 查天氣(Vienna)", ("action", "查天氣", "Vienna")),
+    (
+        'Thought: 確認開放\nAction: 查詢開放狀態("美泉宮")\n',
+        ("action", "查詢開放狀態", "美泉宮"),
+    ),
+    ("Action:查詢開放狀態('美景宮')", ("action", "查詢開放狀態", "美景宮")),
+    ("Action: 查天氣(Vienna (Wien))", ("action", "查天氣", "Vienna (Wien)")),
+    ('Action: 查天氣("Vienna)")', ("action", "查天氣", "Vienna)")),
+    (
+        "Thought: 查天氣\nAction: 查天氣(Vienna)\nObservation: 晴天\nThought: 好",
+        ("action", "查天氣", "Vienna"),
+    ),
+    ("Thought: 我先假設\nObservation: 下雨\nAction: 查天氣(Vienna)", ("observation",)),
+    (
+        '<|channel|>commentary to=tool name=查詢開放狀態 <|constrain|>json<|message|>{"place":"美泉\n宮"}',
+        ("action", "查詢開放狀態", {"place": "美泉宮"}),
+    ),
+    (
+        '<|channel|>commentary to=tool name=查天氣 <|message|> {"city": "Vienna", "note": "a}b"}',
+        ("action", "查天氣", {"city": "Vienna", "note": "a}b"}),
+    ),
+    (
+        'Thought: 完成\nFinal Answer: [{"place": "美泉宮", "minutes": 120}]',
+        ("final",),
+    ),
+    ("Thought: 想一想\nAction: 查天氣\nAction Input: Vienna", None),
+    ("to=tool name=查天氣 <|message|>not json", None),
+    ("只有想法，沒有動作。", None),
+    ("Action: 查天氣(Vienna", None),
+]
+
+
+def _summary(event: ReActEvent | None) -> tuple | None:
+    if event is None:
+        return None
+    if event.kind != "action":
+        return (event.kind,)
+    return ("action", event.name, event.payload if event.payload else event.arg)
+
+
+def fuzz(rounds: int = 200, seed: int = 0) -> int:
+    """隨機切塊與隨機突變：結果不能隨切法改變，也不能丟出例外；回傳失敗數"""
+    rng = random.Random(seed)
+    failures = 0
+    for text, expected in FUZZ_CORPUS:
+        for _ in range(rounds):
+            cuts = sorted(rng.sample(range(1, len(text)), k=min(len(text) - 1, 6)))
+            parser = ReActStreamParser()
+            events = []
+            for a, b in zip([0, *cuts], [*cuts, len(text)]):
+                events += parser.feed(text[a:b])
+            if _summary(events[0] if events else None) != expected:
+                failures += 1
+                print(f"❌ {text!r} 切在 {cuts}：{events}")
+                break
+
+        # 隨機突變只檢查不會丟出例外，且整段與逐字解析的結果一致
+        for _ in range(rounds):
+            chars = list(text)
+            for _ in range(rng.randint(1, 4)):
+                pos = rng.randrange(len(chars) + 1)
+                chars.insert(pos, rng.choice("(){}\"'\\\n :<|>Aa宮"))
+            mutated = "".join(chars)
+            whole = [_summary(e) for e in parse_react(mutated)]
+            streamed = [_summary(e) for e in parse_react(mutated, chunk_size=1)]
+            if whole != streamed:
+                failures += 1
+                print(f"❌ 突變結果與切法有關：{mutated!r}")
+                break
+    return failures
+
+
+def benchmark(repeat: int = 2000, chunk_size: int = 4) -> dict[str, float]:
+    """吞吐量：以 chunk_size 個字元為一個 token 模擬串流"""
+    corpus = [text for text, _ in FUZZ_CORPUS]
+    total_chars = sum(len(text) for text in corpus) * repeat
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for text in corpus:
+            parse_react(text, chunk_size=chunk_size)
+    elapsed = time.perf_counter() - started
+    return {
+        "chars": total_chars,
+        "seconds": round(elapsed, 3),
+        "chars_per_second": round(total_chars / elapsed),
+        "us_per_completion": round(elapsed / (repeat * len(corpus)) * 1e6, 1),
+    }
+
+
+if __name__ == "__main__":
+    failures = fuzz()
+    print(f"模糊測試：{len(FUZZ_CORPUS)} 筆語料，失敗 {failures} 筆")
+    print(f"吞吐量：{benchmark()}")
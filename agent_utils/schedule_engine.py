@@ -0,0 +1,214 @@
+"""
+向量化行程可行性檢查
+
+把行程表示成「每一步的分鐘數」矩陣（一列一個候選行程），用 NumPy 一次算出
+所有候選的開始 / 結束時間、超時分鐘數與第一個超時的步驟，取代逐步 datetime + timedelta：
+
+    minutes, travel, lengths = pack_plans([
+        [(120, False), (30, True), (120, False)],   # 參觀 → 交通 → 參觀
+        [(180, False), (30, True), (150, False)],
+    ])
+    result = evaluate_plans(minutes, travel, lengths, travel_factor=1.5)  # 下雨交通 1.5 倍
+    result.feasible, result.overtime
+
+- 時間一律用「當天第幾分鐘」表示（09:00 → 540）
+- travel_factor 只套用在交通步驟，可以是單一數值或每個候選各自的倍率
+- day_start / day_end 可以是單一數值或每列各自的時段（多日行程一天一列）
+
+在本地一次篩選上千個替代方案，只把最有希望的交給 LLM：
+    uv run python -m agent_utils.schedule_engine
+"""
+
+import time
+from collections.abc import Sequence
+from dataclasses import dataclass
+
+import numpy as np
+
+DAY_START = 9 * 60  # 09:00
+DAY_END = 18 * 60  # 18:00
+
+
+def parse_hhmm(text: str) -> int:
+    """'09:30' → 570"""
+    hours, minutes = text.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def format_hhmm(minute: float) -> str:
+    """570 → '09:30'"""
+    minute = int(minute)
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+def effective_minutes(
+    minutes: float, is_travel: bool, travel_factor: float = 1.0
+) -> int:
+    """單一步驟實際花費的分鐘數（交通乘上天氣倍率，無條件捨去）"""
+    return int(minutes * travel_factor) if is_travel else int(minutes)
+
+
+def pack_plans(
+    plans: Sequence[Sequence[tuple[float, bool]]],
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """把長度不同的行程（每步為 (分鐘數, 是否交通)）補齊成矩陣
+
+    Returns:
+        (minutes, travel, lengths)：(n, k) 分鐘數、(n, k) 交通遮罩、(n,) 實際步驟數
+    """
+    width = max((len(plan) for plan in plans), default=0)
+    minutes = np.zeros((len(plans), width), dtype=np.float64)
+    travel = np.zeros((len(plans), width), dtype=bool)
+    lengths = np.array([len(plan) for plan in plans], dtype=np.int64)
+    for row, plan in enumerate(plans):
+        for col, (duration, is_travel) in enumerate(plan):
+            minutes[row, col] = duration
+            travel[row, col] = is_travel
+    return minutes, travel, lengths
+
+
+def with_travel_legs(
+    visits: Sequence[float], travel_minutes: float
+) -> list[tuple[float, bool]]:
+    """景點停留時間之間插入固定的交通時間：[120, 120] → 參觀、交通、參觀"""
+    steps: list[tuple[float, bool]] = []
+    for i, duration in enumerate(visits):
+        if i:
+            steps.append((travel_minutes, True))
+        steps.append((duration, False))
+    return steps
+
+
+@dataclass
+class ScheduleResult:
+    """一批行程的模擬結果（每個欄位的第一維都是候選行程）"""
+
+    starts: np.ndarray  # (n, k) 每一步的開始時間（當天第幾分鐘）
+    ends: np.ndarray  # (n, k) 每一步的結束時間
+    lengths: np.ndarray  # (n,) 實際步驟數
+    finish: np.ndarray  # (n,) 最後一步的結束時間
+    day_end: np.ndarray  # (n,) 每列的截止時間
+    overtime: np.ndarray  # (n,) 超過截止時間的分鐘數，可行則為 0
+    feasible: np.ndarray  # (n,) 是否在截止時間前結束
+    first_late: np.ndarray  # (n,) 第一個結束時間超過截止的步驟，沒有則為 -1
+
+    @property
+    def slack(self) -> np.ndarray:
+        """距離截止時間還剩幾分鐘（超時為負數）"""
+        return self.day_end - self.finish
+
+    def timeline(self, row: int, labels: Sequence[str]) -> list[str]:
+        """單一行程的時間表文字，例如 '09:00–11:00 美泉宮'"""
+        return [
+            f"{format_hhmm(self.starts[row, i])}–{format_hhmm(self.ends[row, i])} {label}"
+            for i, label in enumerate(labels[: self.lengths[row]])
+        ]
+
+    def ranking(self) -> np.ndarray:
+        """可行的行程排前面，其餘依超時分鐘數由少到多"""
+        return np.lexsort((self.overtime, ~self.feasible))
+
+
+def evaluate_plans(
+    minutes: np.ndarray,
+    travel: np.ndarray | None = None,
+    lengths: np.ndarray | None = None,
+    *,
+    travel_factor: float | np.ndarray = 1.0,
+    day_start: float | np.ndarray = DAY_START,
+    day_end: float | np.ndarray = DAY_END,
+) -> ScheduleResult:
+    """一次模擬整批行程
+
+    Args:
+        minutes: (n, k) 每一步的分鐘數，補齊的部分為 0
+        travel: (n, k) 交通步驟遮罩，None 表示沒有交通步驟
+        lengths: (n,) 實際步驟數，None 表示每列都是 k 步
+        travel_factor: 交通時間倍率（例如下雨 1.5），純量或 (n,)
+        day_start / day_end: 當天開始與截止時間，純量或 (n,)
+    """
+    minutes = np.atleast_2d(np.asarray(minutes, dtype=np.float64))
+    n, k = minutes.shape
+    travel = np.zeros((n, k), dtype=bool) if travel is None else np.asarray(travel)
+    lengths = np.full(n, k) if lengths is None else np.asarray(lengths)
+    factor = np.broadcast_to(np.asarray(travel_factor, dtype=np.float64), (n,))
+    start = np.broadcast_to(np.asarray(day_start, dtype=np.float64), (n,))
+    end = np.broadcast_to(np.asarray(day_end, dtype=np.float64), (n,))
+
+    valid = np.arange(k) < lengths[:, None]
+    effective = np.floor(np.where(travel, minutes * factor[:, None], minutes))
+    effective = np.where(valid, effective, 0.0)
+    ends = start[:, None] + np.cumsum(effective, axis=1)
+    starts = ends - effective
+
+    finish = np.where(
+        lengths > 0, ends[np.arange(n), np.maximum(lengths - 1, 0)], start
+    )
+    late = (ends > end[:, None]) & valid
+    return ScheduleResult(
+        starts=starts,
+        ends=ends,
+        lengths=lengths,
+        finish=finish,
+        day_end=end.copy(),
+        overtime=np.maximum(finish - end, 0.0),
+        feasible=finish <= end,
+        first_late=np.where(late.any(axis=1), late.argmax(axis=1), -1),
+    )
+
+
+def shrink_to_fit(
+    minutes: Sequence[float],
+    minimums: Sequence[float],
+    budget: float,
+    priorities: Sequence[int] | None = None,
+    step: int = 5,
+) -> np.ndarray | None:
+    """把總時間縮到 budget 以內，做不到時回傳 None
+
+    優先度數字小的項目先縮；同一優先度依各自可縮短的空間等比例縮短，
+    每項縮短量無條件進位到 step 分鐘，且不會低於 minimums。
+    minimums 由呼叫端決定，只保證總時間；結果是否合理（交通倍率、必要行程等）
+    仍要以 evaluate_plans 或呼叫端自己的檢查確認後才採用。
+    """
+    result = np.asarray(minutes, dtype=np.float64).copy()
+    slack = result - np.minimum(np.asarray(minimums, dtype=np.float64), result)
+    overtime = result.sum() - budget
+    if overtime <= 0:
+        return result
+    if slack.sum() < overtime:
+        return None
+
+    levels = np.zeros(len(result)) if priorities is None else np.asarray(priorities)
+    for level in np.unique(levels):
+        tier = np.where(levels == level, slack, 0.0)
+        if overtime <= 0 or tier.sum() == 0:
+            continue
+        share = tier * min(overtime, tier.sum()) / tier.sum()
+        cuts = np.minimum(np.ceil(share / step) * step, tier)
+        result -= cuts
+        overtime -= cuts.sum()
+    return result
+
+
+if __name__ == "__main__":
+    # 三個景點各停留 60–300 分鐘（每 15 分鐘一檔）× 晴天 / 雨天，全部組合一次檢查
+    options = np.arange(60, 301, 15)
+    grid = np.array(np.meshgrid(options, options, options)).reshape(3, -1).T
+    visits = np.repeat(grid, 2, axis=0)
+    factors = np.tile([1.0, 1.5], len(grid))
+    minutes, travel, lengths = pack_plans([with_travel_legs(row, 30) for row in visits])
+
+    started = time.perf_counter()
+    result = evaluate_plans(minutes, travel, lengths, travel_factor=factors)
+    elapsed = time.perf_counter() - started
+    print(f"檢查 {len(visits)} 個候選行程：{elapsed * 1000:.2f} ms")
+    print(f"可行：{int(result.feasible.sum())}，超時：{int((~result.feasible).sum())}")
+
+    # 雨天可行的行程中，停留時間最長的一個
+    visit_total = np.where(result.feasible & (factors > 1), visits.sum(axis=1), -1)
+    best = int(np.argmax(visit_total))
+    print(f"雨天停留最久的可行行程（共 {visit_total[best]} 分鐘）：")
+    labels = ["景點 A", "交通", "景點 B", "交通", "景點 C"]
+    for line in result.timeline(best, labels):
+        print(" ", line)
@@ -0,0 +1,257 @@
+"""
+語意回應快取
+
+天氣助手的問題大多是少數幾種意圖的不同說法（「台北天氣如何」、「今天台北會下雨嗎」），
+以「使用者所在位置 + 正規化後的問題向量」為 key，在本地向量索引中找相似度
+超過門檻、且尚未過期的舊回答，命中時就不必再跑兩輪 LLM。
+
+- 預設使用字元 n-gram 雜湊向量（純 NumPy、不需額外模型），也可換成任何 embedding 函式
+- 位置不放進向量，而是當成必須完全相同的過濾條件：
+  放進向量會讓同地點的所有問題都變得很像，也可能把台北的答案回給高雄的使用者
+- 日期（今天 / 明天 / 週六…）與天氣項目（雨 / 雪 / 溫度…）同樣必須完全相同：
+  「今天台北會下雨嗎」和「明天台北會下雨嗎」只差一個字，向量相似度很高，答案卻不同
+- TTL 很短（天氣會變），索引大小固定，滿了就覆蓋最舊的一筆
+- 太短的問題（例如「那明天呢」）通常要依賴上下文，不查也不存
+- 非同步程式用 alookup / astore，embedding 在 threadpool 計算，不會卡住 event loop
+"""
+
+import asyncio
+import re
+import time
+import unicodedata
+import zlib
+from collections.abc import Callable
+from dataclasses import dataclass
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# 不影響意圖的贅字，正規化時移除
+FILLER_WORDS = [
+    "請問",
+    "請",
+    "一下",
+    "幫我",
+    "告訴我",
+    "我想知道",
+    "呢",
+    "啊",
+    "吧",
+    "嗎",
+    "的",
+]
+# 常見同義說法統一成同一個詞，讓字元向量更容易對上
+SYNONYMS = {
+    "怎麼樣": "如何",
+    "怎樣": "如何",
+    "好不好": "如何",
+    "會不會": "會",
+    "有沒有": "有",
+    "氣溫": "溫度",
+    "幾度": "溫度",
+    "臺": "台",
+    "今日": "今天",
+    "明日": "明天",
+    "星期": "週",
+    "禮拜": "週",
+    "周": "週",
+}
+PUNCTUATION = re.compile(r"[\s\W_]+", re.UNICODE)
+# 必須完全相同才能共用答案的詞：問的是哪一天、問的是哪一種天氣
+DAY_WORDS = re.compile(r"大後天|後天|明天|今天|昨天|週[一二三四五六日末]")
+WEATHER_WORDS = re.compile(r"雨|雪|溫度|冷|熱|颱風|風|晴|雲|濕度|紫外線|空氣")
+
+
+def normalize_question(text: str) -> str:
+    """全形轉半形、轉小寫、移除贅字與標點"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    for word, canonical in SYNONYMS.items():
+        text = text.replace(word, canonical)
+    for word in FILLER_WORDS:
+        text = text.replace(word, "")
+    return PUNCTUATION.sub("", text)
+
+
+def question_keys(normalized: str) -> tuple[str, frozenset[str]]:
+    """正規化後問題的 (日期, 天氣項目)；沒有提到日期視為今天"""
+    days = DAY_WORDS.findall(normalized)
+    return (
+        "、".join(sorted(set(days))) or "今天",
+        frozenset(WEATHER_WORDS.findall(normalized)),
+    )
+
+
+class HashingEmbedder:
+    """字元 n-gram 雜湊向量：不需下載模型，對中文短句的改寫有不錯的容忍度"""
+
+    def __init__(self, dim: int = 1024, ngram_range: tuple[int, int] = (1, 2)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def __call__(self, texts: list[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        low, high = self.ngram_range
+        for row, text in enumerate(texts):
+            for n in range(low, high + 1):
+                for i in range(len(text) - n + 1):
+                    bucket = zlib.crc32(text[i : i + n].encode()) % self.dim
+                    vectors[row, bucket] += 1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+def embeddings_embedder(embeddings: Embeddings) -> Callable[[list[str]], np.ndarray]:
+    """把 LangChain Embeddings（例如 OpenAIEmbeddings）包成快取可用的 embedding 函式"""
+
+    def embed(texts: list[str]) -> np.ndarray:
+        vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    return embed
+
+
+@dataclass
+class CacheHit:
+    answer: str
+    similarity: float
+    cached_question: str
+    saved_seconds: float
+
+
+class SemanticCache:
+    """以向量相似度比對問題的回應快取
+
+    Args:
+        embedder: 文字 → 已正規化向量的函式，預設為 HashingEmbedder
+        threshold: 餘弦相似度門檻，越高越保守
+        ttl: 快取存活秒數
+        maxsize: 索引最多保留的筆數（環狀覆蓋最舊的）
+        min_length: 正規化後短於此長度的問題不快取
+    """
+
+    def __init__(
+        self,
+        embedder: Callable[[list[str]], np.ndarray] | None = None,
+        threshold: float = 0.8,
+        ttl: float = 300,
+        maxsize: int = 2048,
+        min_length: int = 4,
+    ):
+        self.embedder = embedder or HashingEmbedder()
+        self.threshold = threshold
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.min_length = min_length
+
+        self.vectors: np.ndarray | None = None  # 第一次寫入時依向量維度配置
+        self.expires_at = np.zeros(maxsize, dtype=np.float64)
+        self.locations: list[str | None] = [None] * maxsize
+        self.keys: list[tuple[str, frozenset[str]] | None] = [None] * maxsize
+        self.questions: list[str] = [""] * maxsize
+        self.answers: list[str] = [""] * maxsize
+        self.latencies = np.zeros(maxsize, dtype=np.float64)
+        self.next_slot = 0
+
+        self.lookups = 0
+        self.hits = 0
+        self.saved_seconds = 0.0
+
+    def _embed(self, question: str) -> np.ndarray:
+        return self.embedder([normalize_question(question)])[0]
+
+    def _valid(self, question: str, location: str) -> np.ndarray | None:
+        """位置、日期與天氣項目都相同且未過期的項目遮罩；沒有任何候選時回傳 None"""
+        normalized = normalize_question(question)
+        if self.vectors is None or len(normalized) < self.min_length:
+            return None
+        key = (location, question_keys(normalized))
+        valid = self.expires_at > time.time()
+        valid &= np.array(
+            [(loc, keys) == key for loc, keys in zip(self.locations, self.keys)]
+        )
+        return valid if valid.any() else None
+
+    def lookup(self, question: str, location: str) -> CacheHit | None:
+        """找出相同位置、日期與天氣項目，未過期且最相似的舊回答"""
+        started = time.perf_counter()
+        self.lookups += 1
+        valid = self._valid(question, location)
+        if valid is None:
+            return None
+        return self._best(valid, self._embed(question), started)
+
+    async def alookup(self, question: str, location: str) -> CacheHit | None:
+        """lookup 的非同步版本：embedding 在 threadpool 計算"""
+        started = time.perf_counter()
+        self.lookups += 1
+        if self._valid(question, location) is None:
+            return None  # 沒有候選就不必算 embedding
+        vector = await asyncio.to_thread(self._embed, question)
+        # 等待期間索引可能被寫入（環狀覆蓋），重新計算遮罩
+        valid = self._valid(question, location)
+        if valid is None:
+            return None
+        return self._best(valid, vector, started)
+
+    def _best(
+        self, valid: np.ndarray, vector: np.ndarray, started: float
+    ) -> CacheHit | None:
+        scores = self.vectors @ vector
+        scores[~valid] = -1.0
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+
+        self.hits += 1
+        saved = float(self.latencies[best]) - (time.perf_counter() - started)
+        self.saved_seconds += max(saved, 0.0)
+        return CacheHit(
+            answer=self.answers[best],
+            similarity=float(scores[best]),
+            cached_question=self.questions[best],
+            saved_seconds=saved,
+        )
+
+    def store(self, question: str, location: str, answer: str, latency: float) -> None:
+        """寫入一筆回答；latency 為實際跑 agent 花的秒數，用來估算命中時省下的時間"""
+        if len(normalize_question(question)) < self.min_length:
+            return
+        self._write(self._embed(question), question, location, answer, latency)
+
+    async def astore(
+        self, question: str, location: str, answer: str, latency: float
+    ) -> None:
+        """store 的非同步版本：embedding 在 threadpool 計算"""
+        if len(normalize_question(question)) < self.min_length:
+            return
+        vector = await asyncio.to_thread(self._embed, question)
+        self._write(vector, question, location, answer, latency)
+
+    def _write(
+        self,
+        vector: np.ndarray,
+        question: str,
+        location: str,
+        answer: str,
+        latency: float,
+    ) -> None:
+        if self.vectors is None:
+            self.vectors = np.zeros((self.maxsize, vector.shape[0]), dtype=np.float32)
+        slot = self.next_slot
+        self.vectors[slot] = vector
+        self.expires_at[slot] = time.time() + self.ttl
+        self.locations[slot] = location
+        self.keys[slot] = question_keys(normalize_question(question))
+        self.questions[slot] = question
+        self.answers[slot] = answer
+        self.latencies[slot] = latency
+        self.next_slot = (slot + 1) % self.maxsize
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+            "saved_seconds": round(self.saved_seconds, 2),
+        }
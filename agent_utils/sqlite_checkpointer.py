@@ -0,0 +1,518 @@
+"""
+以 SQLite 儲存的有界 Checkpointer
+
+- 對話狀態寫入磁碟，程序重啟後可依 thread_id 接續對話
+- 每個 thread 只保留最近 N 個 checkpoint 並限制總大小；
+  最新的 checkpoint 超過上限時，從最舊的對話輪次開始捨棄訊息
+- 閒置過久（TTL）或超過 thread 數上限（LRU）的對話會被淘汰
+- 每累積一定次數的寫入就自動執行一次壓縮（compact）
+"""
+
+import asyncio
+import random
+import sqlite3
+import threading
+import time
+from collections.abc import AsyncIterator, Iterator, Sequence
+from types import TracebackType
+from typing import Any, Self
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    SerializerProtocol,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+    writes_sort_key,
+)
+
+# ===== 資料表結構 =====
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id TEXT PRIMARY KEY,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS threads_last_access ON threads (last_access);
+
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT,
+    checkpoint BLOB,
+    metadata_type TEXT,
+    metadata BLOB,
+    size INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    task_path TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+"""
+
+# 未設定上限時使用的極大值，讓 SQL 條件維持同一種寫法
+NO_LIMIT = 2**62
+
+
+class BoundedSqliteSaver(BaseCheckpointSaver[str]):
+    """以 SQLite 儲存、具備淘汰與大小上限的 checkpointer
+
+    Args:
+        path: SQLite 檔案路徑，":memory:" 代表不落地（測試用）
+        ttl_seconds: thread 閒置超過此秒數即刪除，None 表示不限
+        max_threads: 最多保留的 thread 數，超過時淘汰最久未使用者（LRU）
+        max_checkpoints_per_thread: 每個 thread 保留的最近 checkpoint 數
+        max_thread_bytes: 每個 thread 的 checkpoint 總位元組上限；最新一個一定保留，
+            但本身超過上限時會捨棄最舊的對話輪次（至少保留最後一輪）
+        message_channel: 存放對話訊息、可以裁切的 channel
+        compact_every: 每幾次 put 自動執行一次 compact，0 表示只能手動呼叫
+    """
+
+    def __init__(
+        self,
+        path: str = "checkpoints.sqlite",
+        *,
+        ttl_seconds: float | None = 7 * 24 * 3600,
+        max_threads: int | None = 10_000,
+        max_checkpoints_per_thread: int | None = 20,
+        max_thread_bytes: int | None = 2 * 1024 * 1024,
+        compact_every: int = 500,
+        message_channel: str = "messages",
+        serde: SerializerProtocol | None = None,
+    ) -> None:
+        super().__init__(serde=serde)
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_threads = max_threads
+        self.max_checkpoints_per_thread = max_checkpoints_per_thread
+        self.max_thread_bytes = max_thread_bytes
+        self.compact_every = compact_every
+        self.message_channel = message_channel
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # auto_vacuum 必須在建表前設定才會生效
+        self.conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._puts_since_compact = 0
+
+    # ===== 生命週期 =====
+    def close(self) -> None:
+        """關閉資料庫連線"""
+        with self.lock:
+            self.conn.close()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    # ===== 內部工具 =====
+    def _touch(self, thread_id: str) -> None:
+        """更新 thread 的最後存取時間（LRU / TTL 依據）"""
+        self.conn.execute(
+            "INSERT INTO threads (thread_id, last_access) VALUES (?, ?) "
+            "ON CONFLICT(thread_id) DO UPDATE SET last_access = excluded.last_access",
+            (thread_id, time.time()),
+        )
+
+    def _load_writes(
+        self, thread_id: str, checkpoint_ns: str, checkpoint_id: str
+    ) -> list[tuple[str, str, Any]]:
+        rows = self.conn.execute(
+            "SELECT task_id, idx, channel, type, value, task_path FROM writes "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        ).fetchall()
+        rows.sort(key=lambda r: writes_sort_key(r[5], r[0], r[1]))
+        return [
+            (task_id, channel, self.serde.loads_typed((type_, value)))
+            for task_id, _, channel, type_, value, _ in rows
+        ]
+
+    def _row_to_tuple(
+        self, thread_id: str, checkpoint_ns: str, row: tuple
+    ) -> CheckpointTuple:
+        checkpoint_id, parent_id, type_, checkpoint, metadata_type, metadata = row
+        return CheckpointTuple(
+            config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": checkpoint_id,
+                }
+            },
+            checkpoint=self.serde.loads_typed((type_, checkpoint)),
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            pending_writes=self._load_writes(thread_id, checkpoint_ns, checkpoint_id),
+            parent_config=(
+                {
+                    "configurable": {
+                        "thread_id": thread_id,
+                        "checkpoint_ns": checkpoint_ns,
+                        "checkpoint_id": parent_id,
+                    }
+                }
+                if parent_id
+                else None
+            ),
+        )
+
+    def _fit_checkpoint(self, checkpoint: Checkpoint, budget: int) -> tuple[str, bytes]:
+        """序列化 checkpoint；超過 budget 時從最舊的對話輪次開始捨棄訊息"""
+        type_, data = self.serde.dumps_typed(checkpoint)
+        messages = checkpoint["channel_values"].get(self.message_channel)
+        if len(data) <= budget or not isinstance(messages, list):
+            return type_, data
+        # 只在使用者訊息處切開，才不會留下沒有對應 tool call 的 ToolMessage
+        head = 1 if messages and getattr(messages[0], "type", None) == "system" else 0
+        starts = [
+            i
+            for i, message in enumerate(messages)
+            if i > head and getattr(message, "type", None) == "human"
+        ]
+
+        def dumps(start: int) -> tuple[str, bytes]:
+            values = {
+                **checkpoint["channel_values"],
+                self.message_channel: messages[:head] + messages[start:],
+            }
+            return self.serde.dumps_typed({**checkpoint, "channel_values": values})
+
+        # 二分搜尋保留最多訊息、又不超過上限的切點；都太大時只保留最後一輪
+        lo, hi, best = 0, len(starts) - 1, None
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            candidate = dumps(starts[mid])
+            if len(candidate[1]) <= budget:
+                best, hi = candidate, mid - 1
+            else:
+                lo = mid + 1
+        if best is None:
+            best = dumps(starts[-1]) if starts else (type_, data)
+        return best
+
+    def _trim_thread(self, thread_id: str, checkpoint_ns: str) -> None:
+        """只保留最近的 checkpoint，並刪除被淘汰 checkpoint 的 writes"""
+        max_count = self.max_checkpoints_per_thread or NO_LIMIT
+        max_bytes = self.max_thread_bytes or NO_LIMIT
+        self.conn.execute(
+            """
+            DELETE FROM checkpoints
+            WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id IN (
+                SELECT checkpoint_id FROM (
+                    SELECT checkpoint_id,
+                           ROW_NUMBER() OVER (ORDER BY checkpoint_id DESC) AS rn,
+                           SUM(size) OVER (ORDER BY checkpoint_id DESC) AS total
+                    FROM checkpoints
+                    WHERE thread_id = ? AND checkpoint_ns = ?
+                )
+                WHERE rn > 1 AND (rn > ? OR total > ?)
+            )
+            """,
+            (thread_id, checkpoint_ns, thread_id, checkpoint_ns, max_count, max_bytes),
+        )
+        self.conn.execute(
+            """
+            DELETE FROM writes
+            WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN (
+                SELECT checkpoint_id FROM checkpoints
+                WHERE thread_id = ? AND checkpoint_ns = ?
+            )
+            """,
+            (thread_id, checkpoint_ns, thread_id, checkpoint_ns),
+        )
+
+    def _delete_threads(self, thread_ids: Sequence[str]) -> None:
+        for table in ("checkpoints", "writes", "threads"):
+            self.conn.executemany(
+                f"DELETE FROM {table} WHERE thread_id = ?",
+                [(thread_id,) for thread_id in thread_ids],
+            )
+
+    # ===== BaseCheckpointSaver 介面 =====
+    def get_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        """取得指定（或最新）的 checkpoint"""
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        columns = "checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata"
+        with self.lock:
+            if checkpoint_id := get_checkpoint_id(config):
+                row = self.conn.execute(
+                    f"SELECT {columns} FROM checkpoints "
+                    "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_ns, checkpoint_id),
+                ).fetchone()
+            else:
+                row = self.conn.execute(
+                    f"SELECT {columns} FROM checkpoints "
+                    "WHERE thread_id = ? AND checkpoint_ns = ? "
+                    "ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, checkpoint_ns),
+                ).fetchone()
+            if row is None:
+                return None
+            self._touch(thread_id)
+            return self._row_to_tuple(thread_id, checkpoint_ns, row)
+
+    def list(
+        self,
+        config: RunnableConfig | None,
+        *,
+        filter: dict[str, Any] | None = None,
+        before: RunnableConfig | None = None,
+        limit: int | None = None,
+    ) -> Iterator[CheckpointTuple]:
+        """依條件列出 checkpoint（新到舊）"""
+        query = (
+            "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, "
+            "type, checkpoint, metadata_type, metadata FROM checkpoints"
+        )
+        clauses: list[str] = []
+        params: list[Any] = []
+        if config:
+            clauses.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if (
+                checkpoint_ns := config["configurable"].get("checkpoint_ns")
+            ) is not None:
+                clauses.append("checkpoint_ns = ?")
+                params.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                clauses.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before and (before_id := get_checkpoint_id(before)):
+            clauses.append("checkpoint_id < ?")
+            params.append(before_id)
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY checkpoint_id DESC"
+
+        with self.lock:
+            rows = self.conn.execute(query, params).fetchall()
+
+        for thread_id, checkpoint_ns, *row in rows:
+            if limit is not None and limit <= 0:
+                break
+            with self.lock:
+                item = self._row_to_tuple(thread_id, checkpoint_ns, tuple(row))
+            if filter and not all(
+                item.metadata.get(key) == value for key, value in filter.items()
+            ):
+                continue
+            if limit is not None:
+                limit -= 1
+            yield item
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        """寫入 checkpoint（必要時先裁切最舊的訊息），並立即套用單一 thread 的大小上限"""
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        metadata_type, metadata_data = self.serde.dumps_typed(
+            get_checkpoint_metadata(config, metadata)
+        )
+        type_, data = self._fit_checkpoint(
+            checkpoint, (self.max_thread_bytes or NO_LIMIT) - len(metadata_data)
+        )
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        thread_id,
+                        checkpoint_ns,
+                        checkpoint["id"],
+                        config["configurable"].get("checkpoint_id"),
+                        type_,
+                        data,
+                        metadata_type,
+                        metadata_data,
+                        len(data) + len(metadata_data),
+                    ),
+                )
+                self._touch(thread_id)
+                self._trim_thread(thread_id, checkpoint_ns)
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self._puts_since_compact += 1
+            should_compact = (
+                self.compact_every > 0
+                and self._puts_since_compact >= self.compact_every
+            )
+        if should_compact:
+            self.compact()
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        """寫入尚未完成的中間結果（pending writes）"""
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            type_, data = self.serde.dumps_typed(value)
+            rows.append(
+                (
+                    thread_id,
+                    checkpoint_ns,
+                    checkpoint_id,
+                    task_id,
+                    WRITES_IDX_MAP.get(channel, idx),
+                    channel,
+                    type_,
+                    data,
+                    task_path,
+                )
+            )
+        # 特殊 channel（錯誤、中斷等）可覆寫；一般 writes 保留第一次寫入
+        verb = (
+            "INSERT OR REPLACE"
+            if all(c in WRITES_IDX_MAP for c, _ in writes)
+            else "INSERT OR IGNORE"
+        )
+        with self.lock:
+            self.conn.executemany(
+                f"{verb} INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+
+    def delete_thread(self, thread_id: str) -> None:
+        """刪除整個 thread 的所有資料"""
+        with self.lock:
+            self._delete_threads([thread_id])
+
+    def get_next_version(self, current: str | None, channel: None) -> str:
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+    # ===== 非同步介面：丟到執行緒池避免阻塞 event loop =====
+    async def aget_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: RunnableConfig | None,
+        *,
+        filter: dict[str, Any] | None = None,
+        before: RunnableConfig | None = None,
+        limit: int | None = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for item in items:
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(
+            self.put, config, checkpoint, metadata, new_versions
+        )
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    # ===== 淘汰與壓縮 =====
+    def compact(self) -> dict[str, int]:
+        """淘汰過期 / 過多的 thread，並回收磁碟空間
+
+        Returns:
+            統計資訊：expired（TTL 淘汰數）、evicted（LRU 淘汰數）、threads（剩餘 thread 數）
+        """
+        with self.lock:
+            self._puts_since_compact = 0
+            expired: list[str] = []
+            if self.ttl_seconds is not None:
+                cutoff = time.time() - self.ttl_seconds
+                expired = [
+                    row[0]
+                    for row in self.conn.execute(
+                        "SELECT thread_id FROM threads WHERE last_access < ?", (cutoff,)
+                    )
+                ]
+                self._delete_threads(expired)
+
+            evicted: list[str] = []
+            if self.max_threads is not None:
+                (count,) = self.conn.execute("SELECT COUNT(*) FROM threads").fetchone()
+                if count > self.max_threads:
+                    evicted = [
+                        row[0]
+                        for row in self.conn.execute(
+                            "SELECT thread_id FROM threads ORDER BY last_access ASC LIMIT ?",
+                            (count - self.max_threads,),
+                        )
+                    ]
+                    self._delete_threads(evicted)
+
+            self.conn.execute("PRAGMA incremental_vacuum")
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            (remaining,) = self.conn.execute("SELECT COUNT(*) FROM threads").fetchone()
+            return {
+                "expired": len(expired),
+                "evicted": len(evicted),
+                "threads": remaining,
+            }
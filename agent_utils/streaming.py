@@ -0,0 +1,218 @@
+"""
+Agent 串流輸出
+
+把 `agent.stream` / `agent.astream` 的 messages + updates 兩種模式
+整理成單純的事件序列，讓 CLI 與 HTTP 介面都能邊生成邊顯示：
+
+- token: 最終回答的文字片段（含 ToolStrategy 結構化輸出中的 answer 欄位）
+- tool_call: 模型決定呼叫某個工具
+- tool_result: 工具執行完成
+- final: 完整的最終回答
+"""
+
+import json
+from collections.abc import AsyncIterator, Iterator
+from dataclasses import dataclass
+from typing import Any
+
+from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage
+
+STREAM_MODES = ["messages", "updates"]
+
+
+@dataclass
+class StreamEvent:
+    """串流事件"""
+
+    type: str  # token / tool_call / tool_result / final
+    text: str = ""
+    name: str | None = None
+    data: Any = None
+
+
+class PartialJsonField:
+    """從逐步到達的 JSON 片段中，增量解出某個字串欄位的內容
+
+    例如 `{"answer": "台北今天` → 先回傳「台北今天」，之後每次 feed 只回傳新增的部分。
+    """
+
+    def __init__(self, field: str):
+        self.marker = f'"{field}"'
+        self.buffer = ""
+        self.pos: int | None = None  # 欄位字串值目前解析到的位置
+        self.done = False
+
+    def feed(self, delta: str) -> str:
+        """加入新片段，回傳這次新解出的文字"""
+        self.buffer += delta
+        if self.done:
+            return ""
+        if self.pos is None and not self._find_start():
+            return ""
+
+        out = []
+        buf = self.buffer
+        i = self.pos
+        while i < len(buf):
+            ch = buf[i]
+            if ch == '"':
+                self.done = True
+                i += 1
+                break
+            if ch == "\\":
+                # 跳脫字元不完整時先停下，等下一個片段
+                if i + 1 >= len(buf):
+                    break
+                if buf[i + 1] == "u":
+                    if i + 6 > len(buf):
+                        break
+                    out.append(json.loads(f'"{buf[i : i + 6]}"'))
+                    i += 6
+                else:
+                    out.append(json.loads(f'"{buf[i : i + 2]}"'))
+                    i += 2
+                continue
+            out.append(ch)
+            i += 1
+        self.pos = i
+        return "".join(out)
+
+    def _find_start(self) -> bool:
+        key = self.buffer.find(self.marker)
+        if key == -1:
+            return False
+        i = key + len(self.marker)
+        rest = self.buffer[i:].lstrip()
+        if not rest.startswith(":"):
+            return False
+        i = len(self.buffer) - len(rest) + 1
+        rest = self.buffer[i:].lstrip()
+        if not rest:
+            return False
+        if not rest.startswith('"'):
+            # 欄位不是字串（例如 null），不做增量輸出
+            self.done = True
+            return False
+        self.pos = len(self.buffer) - len(rest) + 1
+        return True
+
+
+class StreamTranslator:
+    """把 LangGraph 的 (mode, payload) 轉成 StreamEvent
+
+    Args:
+        response_tool: ToolStrategy 結構化輸出所對應的工具名稱（通常是 schema 類別名）
+        answer_field: 結構化輸出中要即時顯示的欄位
+    """
+
+    def __init__(self, response_tool: str | None = None, answer_field: str = "answer"):
+        self.response_tool = response_tool
+        self.answer_field = answer_field
+        self.tool_names: dict[int, str] = {}
+        self.answer_fields: dict[int, PartialJsonField] = {}
+        self.streamed_text = ""
+        self.final_answer: str | None = None
+        self.last_ai_text = ""
+
+    def handle(self, mode: str, payload: Any) -> list[StreamEvent]:
+        if mode == "messages":
+            return self._handle_message(*payload)
+        if mode == "updates":
+            return self._handle_update(payload)
+        return []
+
+    def finish(self) -> StreamEvent:
+        """串流結束時產生 final 事件"""
+        answer = self.final_answer or self.last_ai_text or self.streamed_text
+        return StreamEvent("final", text=answer or "抱歉，無法生成回應")
+
+    def _handle_message(self, chunk: Any, metadata: dict) -> list[StreamEvent]:
+        if metadata.get("langgraph_node") != "model" or not isinstance(
+            chunk, AIMessageChunk
+        ):
+            return []
+        events = []
+        if text := chunk.text:
+            events.append(self._token(text))
+        for tc in chunk.tool_call_chunks:
+            index = tc.get("index") or 0
+            if tc.get("name"):
+                self.tool_names[index] = tc["name"]
+                # 新的一輪工具呼叫重新開始解析
+                self.answer_fields.pop(index, None)
+            if self.tool_names.get(index) != self.response_tool:
+                continue
+            field = self.answer_fields.setdefault(
+                index, PartialJsonField(self.answer_field)
+            )
+            if text := field.feed(tc.get("args") or ""):
+                events.append(self._token(text))
+        return events
+
+    def _handle_update(self, payload: dict) -> list[StreamEvent]:
+        events = []
+        for node, update in payload.items():
+            if not isinstance(update, dict):
+                continue
+            for msg in update.get("messages", []):
+                if isinstance(msg, AIMessage):
+                    if msg.text:
+                        self.last_ai_text = msg.text.strip()
+                    for call in msg.tool_calls:
+                        if call["name"] != self.response_tool:
+                            events.append(
+                                StreamEvent(
+                                    "tool_call", name=call["name"], data=call["args"]
+                                )
+                            )
+                elif isinstance(msg, ToolMessage) and node == "tools":
+                    events.append(
+                        StreamEvent("tool_result", text=msg.text, name=msg.name)
+                    )
+            structured = update.get("structured_response")
+            if structured is not None:
+                self.final_answer = getattr(structured, self.answer_field, None) or str(
+                    structured
+                )
+        return events
+
+    def _token(self, text: str) -> StreamEvent:
+        self.streamed_text += text
+        return StreamEvent("token", text=text)
+
+
+def stream_agent(
+    agent: Any,
+    inputs: dict,
+    *,
+    config: dict,
+    context: Any = None,
+    response_tool: str | None = None,
+    answer_field: str = "answer",
+) -> Iterator[StreamEvent]:
+    """同步串流：逐一產生 StreamEvent，最後一個一定是 final"""
+    translator = StreamTranslator(response_tool, answer_field)
+    for mode, payload in agent.stream(
+        inputs, config=config, context=context, stream_mode=STREAM_MODES
+    ):
+        yield from translator.handle(mode, payload)
+    yield translator.finish()
+
+
+async def astream_agent(
+    agent: Any,
+    inputs: dict,
+    *,
+    config: dict,
+    context: Any = None,
+    response_tool: str | None = None,
+    answer_field: str = "answer",
+) -> AsyncIterator[StreamEvent]:
+    """非同步串流：逐一產生 StreamEvent，最後一個一定是 final"""
+    translator = StreamTranslator(response_tool, answer_field)
+    async for mode, payload in agent.astream(
+        inputs, config=config, context=context, stream_mode=STREAM_MODES
+    ):
+        for event in translator.handle(mode, payload):
+            yield event
+    yield translator.finish()
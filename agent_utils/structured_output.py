@@ -0,0 +1,229 @@
+"""
+結構化輸出與驗證修復
+
+用範例要求 JSON、再用正規表示式清掉 code fence，格式一錯就只能得到 None、整個流程重跑。
+`StructuredLLM` 以 Pydantic schema 描述輸出，並在格式不對時把錯誤交回模型修正：
+
+    planner = StructuredLLM(llm, Itinerary)
+    itinerary = await planner.ainvoke(prompt)   # Itinerary 實例；修不好時丟出 StructuredOutputError
+    planner.stats()                              # 呼叫、解析失敗、重試與改用提示詞模式的次數
+
+- 優先使用供應商的 JSON schema 模式（with_structured_output(method="json_schema")），
+  模型或 proxy 不支援時自動改成「提示詞附上 schema + 本地驗證」，之後不再嘗試；
+  逾時、限流等其他錯誤照常拋出，不會因此改變模式
+- 驗證失敗時把模型的輸出與錯誤訊息一起送回去修正，最多 max_repairs 次
+- check 可以加上 schema 以外的檢查（例如天數必須和行程相同），丟出 ValueError 同樣會觸發修復
+
+    uv run python -m agent_utils.structured_output
+"""
+
+import json
+from collections.abc import Callable
+from typing import Any
+
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage
+from pydantic import BaseModel, ValidationError
+
+Check = Callable[[Any], None]
+
+
+class StructuredOutputError(ValueError):
+    """修復次數用完仍無法取得符合 schema 的輸出"""
+
+
+def extract_json(text: str) -> str:
+    """取出文字中第一個完整的 JSON 物件或陣列（容許 code fence 與前後說明）"""
+    decoder = json.JSONDecoder()
+    for i, ch in enumerate(text):
+        if ch in "{[":
+            try:
+                _, end = decoder.raw_decode(text, i)
+            except json.JSONDecodeError:
+                continue
+            return text[i:end]
+    raise ValueError("輸出中沒有 JSON")
+
+
+def unsupported_mode(error: Exception) -> bool:
+    """供應商拒絕 JSON schema 模式（而不是逾時、限流、斷線等暫時性錯誤）"""
+    if isinstance(error, NotImplementedError):
+        return True
+    # openai / litellm 的 BadRequestError：400 / 422 且訊息提到 response_format
+    message = str(error).lower()
+    return getattr(error, "status_code", None) in (400, 422) and any(
+        word in message for word in ("response_format", "json_schema", "structured")
+    )
+
+
+def describe_error(error: Exception) -> str:
+    """給模型看的錯誤說明：ValidationError 只列出欄位與原因"""
+    if isinstance(error, ValidationError):
+        return "；".join(
+            f"{'.'.join(map(str, err['loc'])) or '(根)'}：{err['msg']}"
+            for err in error.errors()
+        )
+    return str(error)
+
+
+class StructuredLLM[T: BaseModel]:
+    """以 Pydantic schema 取得模型輸出，並在驗證失敗時請模型修正
+
+    Args:
+        llm: chat model
+        schema: 輸出的 Pydantic 類別
+        max_repairs: 最多請模型修正幾次
+        native: 是否先嘗試供應商的 JSON schema 模式
+    """
+
+    def __init__(
+        self,
+        llm: Any,
+        schema: type[T],
+        max_repairs: int = 2,
+        native: bool = True,
+    ):
+        self.llm = llm
+        self.schema = schema
+        self.max_repairs = max_repairs
+        self.native = native
+        self.structured = None
+        if native:
+            try:
+                self.structured = llm.with_structured_output(
+                    schema, method="json_schema", include_raw=True
+                )
+            except (AttributeError, NotImplementedError, ValueError, TypeError):
+                self.native = False  # 不是 chat model 或不支援 JSON schema 模式
+
+        self.calls = 0
+        self.parse_failures = 0
+        self.retries = 0
+        self.failed = 0
+        self.fallbacks = 0
+
+    # ---- 共用步驟 ----
+    def _first_messages(self, prompt: str) -> list[AnyMessage]:
+        if self.native:
+            return [HumanMessage(prompt)]
+        schema = json.dumps(self.schema.model_json_schema(), ensure_ascii=False)
+        return [
+            HumanMessage(
+                f"{prompt}\n\n只輸出符合以下 JSON schema 的 JSON，不要加上說明或 code fence：\n{schema}"
+            )
+        ]
+
+    def _fallback(self, prompt: str, messages: list[AnyMessage]) -> None:
+        """供應商不支援 JSON schema 模式，之後都改用提示詞模式；保留已累積的修正對話"""
+        self.native = False
+        self.fallbacks += 1
+        messages[:1] = self._first_messages(prompt)
+
+    def _validate(self, result: Any, check: Check | None) -> tuple[T | None, str, str]:
+        """回傳 (結果, 模型原始輸出, 錯誤說明)；結果為 None 表示需要修復"""
+        if isinstance(result, dict):  # JSON schema 模式（include_raw=True）
+            raw = str(result["raw"].content)
+            parsed, error = result["parsed"], result["parsing_error"]
+        else:
+            raw, parsed, error = str(result.content), None, None
+        try:
+            if error is not None:
+                raise error
+            if parsed is None:
+                parsed = self.schema.model_validate_json(extract_json(raw))
+            if check is not None:
+                check(parsed)
+        except ValueError as e:  # ValidationError 也是 ValueError
+            self.parse_failures += 1
+            return None, raw, describe_error(e)
+        return parsed, raw, ""
+
+    def _repair(self, messages: list[AnyMessage], raw: str, error: str) -> None:
+        self.retries += 1
+        messages += [
+            AIMessage(raw),
+            HumanMessage(
+                f"上面的輸出不符合要求：{error}\n請修正後重新輸出完整的 JSON。"
+            ),
+        ]
+
+    def _give_up(self, error: str) -> StructuredOutputError:
+        self.failed += 1
+        return StructuredOutputError(
+            f"{self.schema.__name__} 修正 {self.max_repairs} 次仍不符合要求：{error}"
+        )
+
+    # ---- 呼叫 ----
+    def invoke(self, prompt: str, check: Check | None = None) -> T:
+        self.calls += 1
+        messages = self._first_messages(prompt)
+        for attempt in range(self.max_repairs + 1):
+            if self.native:
+                try:
+                    result = self.structured.invoke(messages)
+                except Exception as e:
+                    if not unsupported_mode(e):
+                        raise
+                    self._fallback(prompt, messages)
+                    result = self.llm.invoke(messages)
+            else:
+                result = self.llm.invoke(messages)
+            parsed, raw, error = self._validate(result, check)
+            if parsed is not None:
+                return parsed
+            if attempt < self.max_repairs:
+                self._repair(messages, raw, error)
+        raise self._give_up(error)
+
+    async def ainvoke(self, prompt: str, check: Check | None = None) -> T:
+        self.calls += 1
+        messages = self._first_messages(prompt)
+        for attempt in range(self.max_repairs + 1):
+            if self.native:
+                try:
+                    result = await self.structured.ainvoke(messages)
+                except Exception as e:
+                    if not unsupported_mode(e):
+                        raise
+                    self._fallback(prompt, messages)
+                    result = await self.llm.ainvoke(messages)
+            else:
+                result = await self.llm.ainvoke(messages)
+            parsed, raw, error = self._validate(result, check)
+            if parsed is not None:
+                return parsed
+            if attempt < self.max_repairs:
+                self._repair(messages, raw, error)
+        raise self._give_up(error)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "calls": self.calls,
+            "parse_failures": self.parse_failures,
+            "retries": self.retries,
+            "failed": self.failed,
+            "fallbacks": self.fallbacks,
+            "native": int(self.native),
+        }
+
+
+if __name__ == "__main__":
+    from langchain_core.language_models.fake_chat_models import (
+        FakeMessagesListChatModel,
+    )
+
+    class Lunch(BaseModel):
+        day: str
+        restaurant: str
+
+    # 假模型：第一次少了欄位，修正後的輸出夾在說明文字與 code fence 中也能取出
+    llm = FakeMessagesListChatModel(
+        responses=[
+            AIMessage('{"day": "Day1"}'),
+            AIMessage(
+                '好的：```json\n{"day": "Day1", "restaurant": "Figlmüller"}\n```'
+            ),
+        ]
+    )
+    picker = StructuredLLM(llm, Lunch)
+    print(picker.invoke("替 Day1 挑一間午餐餐廳"))
+    print(picker.stats())
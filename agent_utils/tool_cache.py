@@ -0,0 +1,279 @@
+"""
+工具結果快取（TTL + LRU + single-flight）
+
+同一個工具常在不同輪、不同使用者間以相同參數重複呼叫，
+用 `cached_tool` 包起來後，重複呼叫直接回傳快取結果：
+
+    @tool
+    @cached_tool(ttl=600, maxsize=256)
+    def get_weather_for_location(city: str) -> str:
+        ...
+
+- ttl: 每個工具各自設定的存活秒數（None 表示不過期）
+- maxsize: LRU 上限，超過時淘汰最久未使用的結果
+- single-flight: 相同參數同時進來的呼叫只會真正執行一次，其餘等待共用結果
+- ToolRuntime 參數不直接當作 key，預設改用 `runtime.context`（例如 user_id）
+- 也可以直接包已經 @tool 過的工具：`cached_tool(ttl=60)(some_tool)`
+- dict / list 等可變的結果，每個呼叫者拿到的都是獨立的複本，修改不會影響快取
+"""
+
+import asyncio
+import copy
+import functools
+import inspect
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any
+
+from langchain.tools import ToolRuntime
+from langchain_core.tools import BaseTool
+
+# 工具名稱 → 快取，方便統一查看命中率
+TOOL_CACHES: dict[str, "ToolCache"] = {}
+
+MISSING = object()
+
+# 不可變的結果可以直接共用，其餘每次回傳前複製
+IMMUTABLE = (str, bytes, int, float, complex, bool, type(None))
+
+
+def _snapshot(value: Any) -> Any:
+    """可變的結果複製一份，呼叫端修改 dict / list 不會影響快取與其他等待者"""
+    return value if isinstance(value, IMMUTABLE) else copy.deepcopy(value)
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    shared: int = 0  # 等待其他同參數呼叫結果的次數（single-flight）
+    evictions: int = 0
+    expirations: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses + self.shared
+        return (self.hits + self.shared) / total if total else 0.0
+
+
+class ToolCache:
+    """單一工具的 TTL + LRU 快取"""
+
+    def __init__(self, name: str, ttl: float | None, maxsize: int):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.entries: OrderedDict[Any, tuple[float, Any]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = CacheStats()
+        # 正在執行中的呼叫：同步用 concurrent Future，非同步用 asyncio Future
+        self.in_flight: dict[Any, Future] = {}
+        self.async_in_flight: dict[Any, asyncio.Future] = {}
+
+    def get(self, key: Any) -> Any:
+        """查快取，找不到或過期時回傳 MISSING（呼叫端需持有 lock）"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return MISSING
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            self.stats.expirations += 1
+            return MISSING
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: Any, value: Any) -> None:
+        """寫入快取（呼叫端需持有 lock）"""
+        expires_at = (
+            time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+        )
+        self.entries[key] = (expires_at, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+def runtime_context_key(runtime: ToolRuntime) -> Any:
+    """預設的 ToolRuntime key：只看 context（例如 Context(user_id='1')）"""
+    return repr(getattr(runtime, "context", None))
+
+
+def _is_runtime_param(param: inspect.Parameter) -> bool:
+    annotation = param.annotation
+    origin = getattr(annotation, "__origin__", annotation)
+    return param.name == "runtime" or (
+        inspect.isclass(origin) and issubclass(origin, ToolRuntime)
+    )
+
+
+def _make_key_builder(
+    func: Callable, runtime_key: Callable[[ToolRuntime], Any]
+) -> Callable[..., Any]:
+    signature = inspect.signature(func)
+    runtime_params = {
+        name for name, param in signature.parameters.items() if _is_runtime_param(param)
+    }
+
+    def build_key(*args: Any, **kwargs: Any) -> Any:
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        return repr(
+            tuple(
+                (name, runtime_key(value) if name in runtime_params else value)
+                for name, value in bound.arguments.items()
+            )
+        )
+
+    return build_key
+
+
+def _wrap_sync(func: Callable, cache: ToolCache, build_key: Callable) -> Callable:
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        key = build_key(*args, **kwargs)
+        with cache.lock:
+            value = cache.get(key)
+            if value is not MISSING:
+                cache.stats.hits += 1
+                return _snapshot(value)
+            future = cache.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = cache.in_flight[key] = Future()
+                cache.stats.misses += 1
+            else:
+                cache.stats.shared += 1
+        if not leader:
+            return _snapshot(future.result())
+
+        try:
+            value = func(*args, **kwargs)
+        except BaseException as e:
+            # 失敗的結果不快取，但要讓正在等待的呼叫收到同樣的錯誤
+            with cache.lock:
+                del cache.in_flight[key]
+            future.set_exception(e)
+            raise
+        # 快取與等待者共用一份複本，執行者拿到原本的物件
+        stored = _snapshot(value)
+        with cache.lock:
+            cache.put(key, stored)
+            del cache.in_flight[key]
+        future.set_result(stored)
+        return value
+
+    return wrapper
+
+
+def _wrap_async(func: Callable, cache: ToolCache, build_key: Callable) -> Callable:
+    @functools.wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        key = build_key(*args, **kwargs)
+        with cache.lock:
+            value = cache.get(key)
+            if value is not MISSING:
+                cache.stats.hits += 1
+                return _snapshot(value)
+            future = cache.async_in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = cache.async_in_flight[key] = (
+                    asyncio.get_running_loop().create_future()
+                )
+                cache.stats.misses += 1
+            else:
+                cache.stats.shared += 1
+        if not leader:
+            # shield：等待者被取消時不影響正在執行的那一次呼叫
+            return _snapshot(await asyncio.shield(future))
+
+        try:
+            value = await func(*args, **kwargs)
+        except BaseException as e:
+            with cache.lock:
+                del cache.async_in_flight[key]
+            if not future.done():
+                future.set_exception(e)
+                future.exception()  # 沒有等待者時避免 "exception was never retrieved"
+            raise
+        stored = _snapshot(value)
+        with cache.lock:
+            cache.put(key, stored)
+            del cache.async_in_flight[key]
+        future.set_result(stored)
+        return value
+
+    return wrapper
+
+
+def cached_tool(
+    ttl: float | None = 300,
+    maxsize: int = 256,
+    *,
+    name: str | None = None,
+    runtime_key: Callable[[ToolRuntime], Any] = runtime_context_key,
+) -> Callable:
+    """工具快取 decorator，可套在原始函式（@tool 之下）或已建立的工具上
+
+    Args:
+        ttl: 快取存活秒數，None 表示不過期
+        maxsize: 最多保留的結果數（LRU）
+        name: 統計用名稱，預設為函式 / 工具名稱
+        runtime_key: 從 ToolRuntime 取出 key 的函式
+    """
+
+    def decorator(target: Any) -> Any:
+        if isinstance(target, BaseTool):
+            cache_name = name or target.name
+            cache = TOOL_CACHES[cache_name] = ToolCache(cache_name, ttl, maxsize)
+            # 不修改原本的工具物件，複製一份換掉實際執行的函式
+            wrapped = target.model_copy()
+            if getattr(target, "func", None) is not None:
+                wrapped.func = _wrap_sync(
+                    target.func, cache, _make_key_builder(target.func, runtime_key)
+                )
+            if getattr(target, "coroutine", None) is not None:
+                wrapped.coroutine = _wrap_async(
+                    target.coroutine,
+                    cache,
+                    _make_key_builder(target.coroutine, runtime_key),
+                )
+            return wrapped
+
+        cache_name = name or target.__name__
+        cache = TOOL_CACHES[cache_name] = ToolCache(cache_name, ttl, maxsize)
+        build_key = _make_key_builder(target, runtime_key)
+        if inspect.iscoroutinefunction(target):
+            wrapper = _wrap_async(target, cache, build_key)
+        else:
+            wrapper = _wrap_sync(target, cache, build_key)
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
+
+
+def tool_cache_stats() -> dict[str, dict[str, Any]]:
+    """所有工具快取的統計（命中率、淘汰數等）"""
+    return {
+        name: {
+            "size": len(cache.entries),
+            "hits": cache.stats.hits,
+            "misses": cache.stats.misses,
+            "shared": cache.stats.shared,
+            "evictions": cache.stats.evictions,
+            "expirations": cache.stats.expirations,
+            "hit_rate": round(cache.stats.hit_rate, 3),
+        }
+        for name, cache in TOOL_CACHES.items()
+    }
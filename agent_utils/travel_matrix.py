@@ -0,0 +1,227 @@
+"""
+交通時間矩陣
+
+每段路線都呼叫一次交通 API，不但慢，結果也無法重現或快取。
+`TravelTimeMatrix` 把查過的時間存成對稱的「地點 × 地點」矩陣，
+並保存在 SQLite；沒查過的路線一次整批交給後端：
+
+    matrix = TravelTimeMatrix(path="travel_times.sqlite")
+    matrix.travel_time("美泉宮", "Figlmüller")              # 單一路線
+    matrix.travel_times([("美泉宮", "霍夫堡"), ...])        # 整批查詢，只有未命中的交給後端
+    minutes, index = matrix.matrix(places)                   # 子矩陣，評估大量候選行程只需陣列索引
+    matrix.stats()                                           # 命中率
+
+- 後端是「路線清單 → 分鐘數清單」的函式，預設為以種子決定的 20–40 分鐘假資料，
+  之後可以換成真正的距離矩陣 API
+- A → B 與 B → A 視為相同，同一地點為 0 分鐘
+- 呼叫後端時不持有鎖；多個執行緒同時查同一條路線，只有一個會交給後端，其他的等結果
+
+    uv run python -m agent_utils.travel_matrix
+"""
+
+import itertools
+import random
+import sqlite3
+import threading
+import time
+import zlib
+from collections.abc import Callable, Sequence
+
+import numpy as np
+
+Backend = Callable[[Sequence[tuple[str, str]]], Sequence[float]]
+
+
+class SeededBackend:
+    """以種子決定的假交通時間：同一組地點永遠得到相同結果，與查詢順序無關"""
+
+    def __init__(self, seed: int = 0, low: int = 20, high: int = 40):
+        self.seed = seed
+        self.low = low
+        self.high = high
+
+    def __call__(self, pairs: Sequence[tuple[str, str]]) -> list[float]:
+        minutes = []
+        for a, b in pairs:
+            key = "\x00".join(sorted((a, b))).encode()
+            rng = random.Random(zlib.crc32(key) ^ self.seed)
+            minutes.append(float(rng.randint(self.low, self.high)))
+        return minutes
+
+
+class TravelTimeMatrix:
+    """以 SQLite 保存的對稱交通時間矩陣
+
+    Args:
+        backend: 查詢未命中路線的函式，預設為 SeededBackend()
+        path: SQLite 檔案路徑，":memory:" 代表不落地（測試用）
+    """
+
+    def __init__(self, backend: Backend | None = None, path: str = ":memory:"):
+        self.backend = backend or SeededBackend()
+        self.index: dict[str, int] = {}
+        self.minutes = np.zeros((0, 0), dtype=np.float64)  # 未查過的路線為 nan
+        self.lock = threading.Lock()  # 平行流程可能從多個執行緒同時查詢
+        self.db_lock = threading.Lock()  # SQLite 寫入另外排隊，不擋住矩陣查詢
+        # 正在向後端查詢的路線 → 查完時 set 的 Event，其他執行緒等它而不重複查
+        self.in_flight: dict[tuple[str, str], threading.Event] = {}
+
+        self.lookups = 0
+        self.hits = 0
+        self.backend_calls = 0
+        self.backend_pairs = 0
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS travel_times ("
+            "a TEXT NOT NULL, b TEXT NOT NULL, minutes REAL NOT NULL, PRIMARY KEY (a, b))"
+        )
+        rows = self.conn.execute("SELECT a, b, minutes FROM travel_times").fetchall()
+        for a, b, _ in rows:
+            self._ensure(a)
+            self._ensure(b)
+        for a, b, minutes in rows:
+            self._set(a, b, minutes)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def _ensure(self, place: str) -> int:
+        """新地點加入矩陣（容量不足時加倍）"""
+        if place in self.index:
+            return self.index[place]
+        i = len(self.index)
+        if i >= len(self.minutes):
+            size = max(8, 2 * len(self.minutes))
+            grown = np.full((size, size), np.nan)
+            grown[: len(self.minutes), : len(self.minutes)] = self.minutes
+            self.minutes = grown
+        self.index[place] = i
+        self.minutes[i, i] = 0.0
+        return i
+
+    def _set(self, a: str, b: str, minutes: float) -> None:
+        i, j = self.index[a], self.index[b]
+        self.minutes[i, j] = self.minutes[j, i] = minutes
+
+    def _fetch(self, missing: list[tuple[str, str]], done: threading.Event) -> None:
+        """向後端查詢（不持有 self.lock），寫入矩陣與 SQLite 後通知等待的執行緒"""
+        try:
+            values = [float(m) for m in self.backend(missing)]
+            with self.lock:
+                self.backend_calls += 1
+                self.backend_pairs += len(missing)
+                for (a, b), minutes in zip(missing, values):
+                    self._set(a, b, minutes)
+            with self.db_lock:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO travel_times (a, b, minutes) VALUES (?, ?, ?)",
+                    [(a, b, m) for (a, b), m in zip(missing, values)],
+                )
+                self.conn.commit()
+        finally:
+            with self.lock:
+                for key in missing:
+                    del self.in_flight[key]
+            done.set()
+
+    def travel_times(self, pairs: Sequence[tuple[str, str]]) -> np.ndarray:
+        """整批查詢，未命中的路線去重後一次交給後端；別的執行緒正在查的路線只等結果"""
+        keys = [tuple(sorted(pair)) for pair in pairs]
+        first = True
+        while True:
+            with self.lock:
+                for a, b in pairs:
+                    self._ensure(a)
+                    self._ensure(b)
+                missing_keys = {
+                    key
+                    for key in keys
+                    if np.isnan(self.minutes[self.index[key[0]], self.index[key[1]]])
+                }
+                if first:
+                    self.lookups += len(pairs)
+                    self.hits += sum(key not in missing_keys for key in keys)
+                    first = False
+                if not missing_keys:
+                    rows = [self.index[a] for a, _ in pairs]
+                    cols = [self.index[b] for _, b in pairs]
+                    return self.minutes[rows, cols].copy()
+                waiting = {
+                    self.in_flight[key] for key in missing_keys if key in self.in_flight
+                }
+                missing = sorted(missing_keys - self.in_flight.keys())
+                done = threading.Event()
+                for key in missing:
+                    self.in_flight[key] = done
+            if missing:
+                self._fetch(missing, done)
+            for event in waiting:
+                event.wait()
+            # 等到的查詢若失敗，路線仍未命中，下一圈改由自己查詢
+
+    def travel_time(self, from_place: str, to_place: str) -> float:
+        return float(self.travel_times([(from_place, to_place)])[0])
+
+    def matrix(self, places: Sequence[str]) -> tuple[np.ndarray, dict[str, int]]:
+        """指定地點之間的完整子矩陣（需要時先整批補齊），以及地點 → 列的對照"""
+        places = list(dict.fromkeys(places))
+        self.travel_times(list(itertools.combinations(places, 2)))
+        with self.lock:
+            ids = [self.index[place] for place in places]
+            sub = self.minutes[np.ix_(ids, ids)].copy()
+        return sub, {place: i for i, place in enumerate(places)}
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "places": len(self.index),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+            "backend_calls": self.backend_calls,
+            "backend_pairs": self.backend_pairs,
+        }
+
+
+if __name__ == "__main__":
+    places = [
+        "美泉宮",
+        "美景宮",
+        "聖史蒂芬大教堂",
+        "霍夫堡",
+        "國家圖書館",
+        "維也納歌劇院",
+        "藝術史博物館",
+        "Figlmüller",
+        "Gasthaus Pöschl",
+        "Café Central",
+    ]
+
+    # 假設後端每次呼叫要 50 ms（真正的交通 API）
+    def slow_backend(pairs):
+        time.sleep(0.05)
+        return SeededBackend()(pairs)
+
+    matrix = TravelTimeMatrix(slow_backend)
+    started = time.perf_counter()
+    minutes, index = matrix.matrix(places)
+    print(
+        f"補齊 {len(places)} 個地點的矩陣：{(time.perf_counter() - started) * 1000:.0f} ms，"
+        f"{matrix.stats()}"
+    )
+
+    # 所有「5 個地點依序造訪」的候選行程，交通總時間只需要陣列索引
+    routes = np.array(list(itertools.permutations(range(len(places)), 5)))
+    started = time.perf_counter()
+    totals = minutes[routes[:, :-1], routes[:, 1:]].sum(axis=1)
+    elapsed = time.perf_counter() - started
+    best = routes[int(np.argmin(totals))]
+    print(
+        f"評估 {len(routes)} 個候選行程：{elapsed * 1000:.1f} ms"
+        f"（逐段呼叫後端約需 {len(routes) * 4 * 0.05 / 60:.0f} 分鐘）"
+    )
+    print(f"交通最短：{' → '.join(places[i] for i in best)}（{totals.min():.0f} 分鐘）")
+
+    # 再查一次相同路線：全部命中快取
+    matrix.travel_times([(places[a], places[b]) for a, b in itertools.pairwise(best)])
+    print("再次查詢後：", matrix.stats())
@@ -0,0 +1,164 @@
+"""
+模型預熱與連線保持
+
+互動式程式的第一個問題常常特別慢：要先跟 LiteLLM proxy 建立 TCP/TLS 連線，
+後端也可能還沒把模型載入。`ModelWarmup` 趁使用者還在輸入第一個問題時，在背景：
+
+1. 送出一個極小的請求（max_tokens=1），建立連線並讓後端載入模型
+2. （選用）定期發送輕量的 GET /models，讓連線池裡的連線不會因為閒置被關閉；
+   只在第一個問題送出前、最多 keepalive_window 秒，不會在使用者閒置時持續打 proxy
+
+httpx 預設閒置 5 秒就關閉連線，建立模型時搭配 `keepalive_http_clients()`：
+
+    model = init_chat_model(MODEL_NAME, **keepalive_http_clients())
+    warmup = ModelWarmup(model, keepalive_interval=4.0).start()   # 同步程式：背景執行緒
+    task = asyncio.create_task(warmup.arun())                     # 非同步程式：同一個 event loop
+    ...
+    warmup.stop()   # 第一個問題送出時停止 ping
+
+設定環境變數 WARMUP=0 可關閉預熱，用來比較冷啟動與預熱後的第一輪延遲。
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Any
+
+import httpx
+import openai
+
+logger = logging.getLogger(__name__)
+
+# 設為 0 關閉預熱（量測冷啟動延遲用）
+WARMUP_ENABLED = os.getenv("WARMUP", "1") != "0"
+# 斷線、逾時、proxy 回傳錯誤等：預熱與 ping 本來就可能遇到，記下來就好
+TRANSIENT_ERRORS = (httpx.HTTPError, openai.APIError)
+
+
+def keepalive_http_clients(
+    keepalive_expiry: float = 300.0, max_connections: int = 20
+) -> dict[str, Any]:
+    """建立閒置逾時較長的同步 / 非同步 httpx client，可直接傳給 ChatOpenAI"""
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+        keepalive_expiry=keepalive_expiry,
+    )
+    return {
+        "http_client": httpx.Client(limits=limits),
+        "http_async_client": httpx.AsyncClient(limits=limits),
+    }
+
+
+class ModelWarmup:
+    """背景預熱模型，並可選擇在短時間內定期 ping 保持連線
+
+    Args:
+        model: 要預熱的 chat model（ChatOpenAI 才有連線保持，其他模型只做預熱請求）
+        prime_prompt: 預熱請求的內容
+        keepalive_interval: ping 的間隔秒數，需短於 proxy 的閒置逾時；None（預設）表示不 ping
+        keepalive_window: 預熱完成後最多 ping 幾秒，呼叫 stop() 也會提早結束
+    """
+
+    def __init__(
+        self,
+        model: Any,
+        prime_prompt: str = "hi",
+        keepalive_interval: float | None = None,
+        keepalive_window: float = 60.0,
+    ):
+        self.model = model
+        self.prime_prompt = prime_prompt
+        self.keepalive_interval = keepalive_interval
+        self.keepalive_window = keepalive_window
+        self.pings = 0
+        self.prime_seconds: float | None = None
+        self.error: Exception | None = None
+        self.done = threading.Event()
+        self.stopped = threading.Event()
+
+    def start(self) -> "ModelWarmup":
+        """在背景執行緒預熱（同步程式使用）"""
+        threading.Thread(target=self.run, name="model-warmup", daemon=True).start()
+        return self
+
+    def run(self) -> None:
+        started = time.perf_counter()
+        try:
+            self.model.invoke(self.prime_prompt, max_tokens=1)
+            self.prime_seconds = time.perf_counter() - started
+        except TRANSIENT_ERRORS as e:
+            self.error = e  # 預熱失敗不影響正常對話
+        except Exception as e:
+            self.error = e  # 不是連線問題也不影響對話，只留下 debug log
+            logger.debug("模型預熱失敗：%r", e, exc_info=True)
+        finally:
+            self.done.set()
+
+        client = getattr(self.model, "root_client", None)
+        if client is None or self.keepalive_interval is None:
+            return
+        deadline = time.monotonic() + self.keepalive_window
+        while (
+            not self.stopped.wait(self.keepalive_interval)
+            and time.monotonic() < deadline
+        ):
+            try:
+                client.models.list()
+                self.pings += 1
+            except TRANSIENT_ERRORS:
+                pass  # 只是保持連線，失敗就等下一次
+            except Exception:
+                # 不是連線問題，再 ping 也沒有用：記一次 debug log 後停止
+                logger.debug("保持連線的 ping 失敗，停止 ping", exc_info=True)
+                return
+
+    async def arun(self) -> None:
+        """在目前的 event loop 預熱（非同步程式使用，連線池與之後的請求共用）"""
+        started = time.perf_counter()
+        try:
+            await self.model.ainvoke(self.prime_prompt, max_tokens=1)
+            self.prime_seconds = time.perf_counter() - started
+        except TRANSIENT_ERRORS as e:
+            self.error = e
+        except Exception as e:
+            self.error = e  # 不是連線問題也不影響對話，只留下 debug log
+            logger.debug("模型預熱失敗：%r", e, exc_info=True)
+        finally:
+            self.done.set()
+
+        client = getattr(self.model, "root_async_client", None)
+        if client is None or self.keepalive_interval is None:
+            return
+        deadline = time.monotonic() + self.keepalive_window
+        while True:
+            await asyncio.sleep(self.keepalive_interval)
+            if self.stopped.is_set() or time.monotonic() >= deadline:
+                return
+            try:
+                await client.models.list()
+                self.pings += 1
+            except TRANSIENT_ERRORS:
+                pass
+            except Exception:
+                logger.debug("保持連線的 ping 失敗，停止 ping", exc_info=True)
+                return
+
+    def stop(self) -> None:
+        """停止 ping（可重複呼叫）；第一個問題送出時呼叫即可"""
+        self.stopped.set()
+
+    def status(self) -> str:
+        if not self.done.is_set():
+            return "預熱尚未完成"
+        if self.error is not None:
+            return f"預熱失敗：{self.error}"
+        return f"已預熱，預熱請求 {self.prime_seconds:.2f} 秒"
+
+
+def first_turn_report(seconds: float, warmup: ModelWarmup | None) -> str:
+    """第一輪延遲報告，比較 WARMUP=0 與預設值的輸出即可看出預熱效果"""
+    status = warmup.status() if warmup is not None else "冷啟動，未預熱"
+    return f"⏱️  第一輪延遲 {seconds:.2f} 秒（{status}）"
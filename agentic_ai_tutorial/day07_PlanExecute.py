@@ -1,15 +1,23 @@
 import json
 import os
-from datetime import datetime, timedelta
+import sys
+from collections.abc import Iterator
+from pathlib import Path
 from typing import Any
 
 from dotenv import load_dotenv
 from langchain.chat_models import init_chat_model
 
+# 讓子資料夾中的腳本也能匯入專案根目錄的 agent_utils
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from agent_utils.schedule_engine import effective_minutes, format_hhmm, parse_hhmm  # noqa: E402
+
 # ---- 初始化環境變數 ----
 load_dotenv()
 
 MODEL_NAME = os.environ.get("MODEL_NAME", "openai:gpt-oss-20b-local")
+# 串流模式：邊生成邊解析行程步驟；設為 0 改回一次取得完整 JSON
+STREAM_PLAN = os.environ.get("STREAM_PLAN", "1") != "0"
 
 llm = init_chat_model(
 	MODEL_NAME,
@@ -33,18 +41,24 @@ def clean_json_text(text: str) -> str:
 		s = s[first : last + 1]
 	return s.strip()
 
+ATTRACTIONS = ["美泉宮", "美景宮", "聖史蒂芬大教堂"]
+# 超時後最多重新規劃後半段的次數
+MAX_REPLANS = 2
+
+ITINERARY_QUERY = (
+	"請規劃今天從上午 9 點出發，參觀維也納三個景點：\n"
+	f"{'、'.join(ATTRACTIONS)}。\n"
+	"條件：\n"
+	"- 每個景點至少 2 小時\n"
+	"- 景點之間交通 30 分鐘\n"
+	"- 必須在 18:00 前結束\n"
+	"請只輸出 JSON 格式，每個步驟包含：\n"
+	"title, place, minutes, indoor (是否室內, true/false)。"
+)
+
 def request_itinerary() -> dict[str, Any]:
 	"""向模型請求行程並解析為 JSON。"""
-	query = (
-		"請規劃今天從上午 9 點出發，參觀維也納三個景點：\n"
-		"美泉宮、美景宮、聖史蒂芬大教堂。\n"
-		"條件：\n"
-		"- 每個景點至少 2 小時\n"
-		"- 景點之間交通 30 分鐘\n"
-		"- 必須在 18:00 前結束\n"
-		"請只輸出 JSON 格式，每個步驟包含：\n"
-		"title, place, minutes, indoor (是否室內, true/false)。"
-	)
+	query = ITINERARY_QUERY
 
 	# 直接用單訊息呼叫（LangChain 會自動包裝為 HumanMessage）
 	ai_msg = llm.invoke(query)
@@ -64,29 +78,202 @@ def request_itinerary() -> dict[str, Any]:
 			# 最後退回原始字串
 			return {"raw": raw}
 
+# ---- 串流解析 ----
+STEP_KEYS = ("title", "place", "minutes", "indoor")
+
+class ItineraryStreamError(ValueError):
+	"""串流內容已確定不是合法的行程 JSON。"""
+
+class PartialItineraryError(ItineraryStreamError):
+	"""已交出部分步驟後串流才失敗：前段可能已經執行，不能整份重試，只能補上後半段。"""
+
+class StreamingStepParser:
+	"""邊接收 token 邊解析行程陣列，每完成一個步驟物件就立即回傳。
+
+	只追蹤括號深度與字串狀態，不會反覆解析整段文字；
+	內容一旦確定不是合法的行程陣列，就丟出 ItineraryStreamError。
+	"""
+
+	def __init__(self, max_preamble: int = 200):
+		self.max_preamble = max_preamble  # 陣列開始前最多容許的說明文字 / 圍欄長度
+		self.preamble = 0
+		self.started = False  # 是否已讀到陣列的 [
+		self.finished = False  # 是否已讀到陣列的 ]
+		self.depth = 0  # 步驟物件內的括號深度，0 表示位於步驟之間
+		self.in_string = False
+		self.escaped = False
+		self.buffer: list[str] = []  # 目前步驟物件的原始文字
+
+	def feed(self, text: str) -> list[dict[str, Any]]:
+		"""讀入一段新的 token，回傳這段文字中完成的步驟。"""
+		steps = []
+		for ch in text:
+			if self.finished:
+				break  # 陣列結束後的說明文字直接忽略
+			if not self.started:
+				if ch == "[":
+					self.started = True
+				else:
+					self.preamble += 1
+					if self.preamble > self.max_preamble:
+						raise ItineraryStreamError(f"前 {self.max_preamble} 個字元內沒有出現 JSON 陣列")
+				continue
+			if self.depth == 0:
+				if ch == "{":
+					self.depth = 1
+					self.buffer = [ch]
+				elif ch == "]":
+					self.finished = True
+				elif not (ch.isspace() or ch == ","):
+					raise ItineraryStreamError(f"步驟之間出現非預期的字元 {ch!r}")
+				continue
+
+			self.buffer.append(ch)
+			if self.in_string:
+				if self.escaped:
+					self.escaped = False
+				elif ch == "\\":
+					self.escaped = True
+				elif ch == '"':
+					self.in_string = False
+			elif ch == '"':
+				self.in_string = True
+			elif ch in "{[":
+				self.depth += 1
+			elif ch in "}]":
+				self.depth -= 1
+				if self.depth == 0:
+					steps.append(self.parse_step("".join(self.buffer)))
+		return steps
+
+	def parse_step(self, text: str) -> dict[str, Any]:
+		try:
+			step = json.loads(text)
+		except json.JSONDecodeError as e:
+			raise ItineraryStreamError(f"步驟不是合法的 JSON：{e}") from e
+		missing = [key for key in STEP_KEYS if key not in step]
+		if missing:
+			raise ItineraryStreamError(f"步驟缺少欄位 {missing}")
+		if not isinstance(step["minutes"], int | float):
+			raise ItineraryStreamError(f"minutes 不是數字：{step['minutes']!r}")
+		return step
+
+	def finish(self) -> None:
+		"""模型輸出結束時呼叫，確認陣列完整。"""
+		if not self.finished:
+			raise ItineraryStreamError("輸出在行程陣列結束前就中斷了")
+
+def stream_itinerary(query: str = ITINERARY_QUERY, max_attempts: int = 3) -> Iterator[dict[str, Any]]:
+	"""串流模式：每解析完一個步驟就交給執行迴圈。
+
+	輸出確定不是合法 JSON 時立刻中止這次生成並重試，不必等模型寫完 2048 個 token。
+	已交出步驟後才失敗則丟出 PartialItineraryError，由呼叫端決定是否重新規劃後半段。
+	"""
+	for attempt in range(1, max_attempts + 1):
+		parser = StreamingStepParser()
+		received = 0
+		emitted = 0
+		try:
+			for chunk in llm.stream(query):
+				received += len(chunk.text)
+				for step in parser.feed(chunk.text):
+					emitted += 1
+					yield step
+				if parser.finished:
+					break  # 陣列已結束，不必再等模型後面的說明文字
+			parser.finish()
+			return
+		except ItineraryStreamError as e:
+			print(f"⚠️ 第 {attempt} 次生成在第 {received} 個字元中止：{e}")
+			if emitted:
+				# 已交出的步驟可能已經執行，重試會重複排入；行程不完整，不能當作成功
+				raise PartialItineraryError(f"已交出 {emitted} 個步驟後中斷：{e}") from e
+	raise ItineraryStreamError(f"重試 {max_attempts} 次仍無法取得合法的行程")
+
+# ---- 局部重新規劃 ----
+def build_suffix_query(
+	done: list[dict[str, Any]], clock: int, end: int, weather: str, reason: str = "行程超時"
+) -> str:
+	"""只請模型補上後半段：已排定的前段固定不動，提示詞與輸出都比整份重排短得多。"""
+	remaining = end - clock
+	finished = "、".join(task["title"] for task in done) or "（無）"
+	visited = [task for task in done if not task["title"].startswith("前往")]  # 交通步驟不算參觀
+	todo = [
+		place for place in ATTRACTIONS
+		if not any(place in task["title"] or place in task["place"] for task in visited)
+	]
+	return (
+		f"維也納一日遊的{reason}，需要重新安排後半段。\n"
+		f"已排定（不可更動）：{finished}\n"
+		f"現在 {format_hhmm(clock)}，距離 {format_hhmm(end)} 只剩 {remaining} 分鐘，"
+		f"尚未參觀：{'、'.join(todo) or '（無）'}。\n"
+		+ ("今天下雨，交通時間會延長為 1.5 倍。\n" if weather == "rain" else "")
+		+ "可以縮短停留時間或刪去景點，總時間不能超過剩餘時間；交通步驟的 title 以「前往」開頭。\n"
+		"請只輸出剩下步驟的 JSON 陣列，每個步驟包含：\n"
+		"title, place, minutes, indoor (是否室內, true/false)。"
+	)
+
 # Step 3: Tool (模擬天氣 API)
 def get_weather(city: str):
     return "rain"  # 假設今天下雨
 
-data = request_itinerary()
-print("解析後 JSON：", json.dumps(data, ensure_ascii=False, indent=2))
-
 # Step 4: 執行計劃
 weather = get_weather("Vienna")
 print("\n今日天氣：", weather)
 
 
-time = datetime.strptime("09:00", "%H:%M")
-end = datetime.strptime("18:00", "%H:%M")
+# 時間以當天第幾分鐘表示（與 agent_utils.schedule_engine 相同）
+time = parse_hhmm("09:00")
+end = parse_hhmm("18:00")
+travel_factor = 1.5 if weather == "rain" else 1.0  # 下雨天交通延長 1.5 倍
+
+if STREAM_PLAN:
+    # 模型還在生成後面的步驟時，前面的步驟已經開始排程
+    data = stream_itinerary()
+else:
+    data = request_itinerary()
+    print("解析後 JSON：", json.dumps(data, ensure_ascii=False, indent=2))
 
+done = []  # 已排定的步驟，重新規劃時固定不動
+steps = data
+for replan in range(MAX_REPLANS + 1):
+    overrun = None
+    try:
+        for task in steps:
+            is_travel = "前往" in task["title"]
+            duration = effective_minutes(task["minutes"], is_travel, travel_factor)
+            if is_travel and travel_factor > 1:
+                task["title"] += "（因下雨延誤）"
 
-for task in data:
-    duration = task["minutes"]
-    if weather == "rain" and "前往" in task["title"]:
-        duration = int(duration * 1.5)  # 下雨天交通延長 1.5 倍
-        task["title"] += "（因下雨延誤）"
+            finish = time + duration
+            if finish > end:
+                overrun = task
+                break
+            print(f"{format_hhmm(time)}–{format_hhmm(finish)} {task['title']}")
+            done.append(task)
+            time = finish
+    except PartialItineraryError as e:
+        # 前段已經排定，行程被截斷：不能宣告可行，只重新規劃還沒排到的部分
+        print(f"⚠️ 行程生成中斷：{e}")
+        if replan == MAX_REPLANS:
+            print("無法取得完整行程")
+            break
+        print(f"🔁 保留前 {len(done)} 個步驟，重新規劃 {format_hhmm(time)} 之後的行程")
+        steps = stream_itinerary(build_suffix_query(done, time, end, weather, "行程生成中斷"))
+        continue
+    except ItineraryStreamError as e:
+        print(f"無法取得行程：{e}")
+        break
 
-    finish = time + timedelta(minutes=duration)
-    print(f"{time.strftime('%H:%M')}–{finish.strftime('%H:%M')} {task['title']}")
-    time = finish
-    print("行程可行！" if time <= end else "行程超時！")
+    if overrun is None:
+        print("行程可行！")
+        break
+    if hasattr(steps, "close"):
+        steps.close()  # 超時點之後的原計畫用不到了，停止接收模型輸出
+    print(f"⚠️ {overrun['title']} 預計 {format_hhmm(finish)} 結束，超過 {format_hhmm(end)}")
+    if replan == MAX_REPLANS:
+        print("行程超時！")
+        break
+    # 只重新規劃超時點之後的行程
+    print(f"🔁 保留前 {len(done)} 個步驟，重新規劃 {format_hhmm(time)} 之後的行程")
+    steps = stream_itinerary(build_suffix_query(done, time, end, weather))
@@ -1,16 +1,34 @@
-
 import json
 import os
 import re
-from datetime import datetime, timedelta
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
 
 from dotenv import load_dotenv
 from langchain.chat_models import init_chat_model
+from langchain.tools import tool
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
 from rich.console import Console
 
+# 讓子資料夾中的腳本也能匯入專案根目錄的 agent_utils
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from agent_utils.history_middleware import chinese_aware_token_count  # noqa: E402
+from agent_utils.react_stream import STOP_SEQUENCES, ReActStreamParser  # noqa: E402
+from agent_utils.schedule_engine import evaluate_plans, pack_plans, with_travel_legs  # noqa: E402
+
 # ---- 初始化環境變數與模型（使用 LiteLLM Proxy 的 OpenAI 相容端點） ----
 load_dotenv()
 MODEL_NAME = os.environ.get("MODEL_NAME", "openai:gpt-oss-20b-local")
+# 串流模式：動作一完成就停止生成並執行工具；設為 0 改回等完整輸出再用正規表示式解析
+STREAM_REACT = os.environ.get("STREAM_REACT", "1") != "0"
+# 只保留最近幾個回合的完整內容，更早的回合壓縮成一行觀察摘要；設為 0 不壓縮
+REACT_KEEP_ROUNDS = int(os.environ.get("REACT_KEEP_ROUNDS", "2"))
+# 連續幾次無法解析動作就停止，不再浪費回合
+MAX_PARSE_FAILURES = 2
+# text：模型在文字中寫 Action 再由程式解析；tools：用 bind_tools 綁定工具，由模型原生呼叫
+REACT_MODE = os.environ.get("REACT_MODE", "text")
 
 llm = init_chat_model(
     MODEL_NAME,
@@ -37,6 +55,15 @@ TOOLS = {
     "查詢開放狀態": check_open,
 }
 
+# ---- 原生工具呼叫模式使用的工具 schema（名稱需為英數字，參數欄位由型別提示產生） ----
+NATIVE_TOOLS = {
+    t.name: t
+    for t in (
+        tool("get_weather", description="查詢城市今天的天氣，city 為城市名稱")(get_weather),
+        tool("check_open", description="查詢景點今天是否開放，place 為景點名稱")(check_open),
+    )
+}
+
 
 def clean_json_text(text: str) -> str:
     s = text.strip()
@@ -85,124 +112,339 @@ def parse_tool_metadata_call(response: str):
         except Exception:
             return None
 
-    # 根據工具名稱選擇參數欄位
-    if action == "查天氣":
-        arg = payload.get("city")
-    else:
-        arg = payload.get("place")
+    arg = tool_argument(action, payload)
+    return (action, arg) if arg else None
 
+
+def tool_argument(action: str, payload: dict):
+    """根據工具名稱選擇參數欄位"""
+    arg = payload.get("city") if action == "查天氣" else payload.get("place")
     if isinstance(arg, str):
         arg = arg.replace("\n", "").strip()
-    return (action, arg) if arg else None
+    return arg
 
-def react_loop():
-    prompt = """你是一個旅行規劃助理，使用 ReAct 模式回答問題，思考請用繁體中文。
-格式必須包含以下幾種：
-Thought: 你的推理
-Action: 你要執行的工具（格式：查天氣(city) 或 查詢開放狀態(place)）
-Observation: 工具回傳的結果
-Final Answer: 請用 JSON 格式輸出最終行程，例如：
+
+def stream_react_turn(messages):
+    """串流一個回合，回傳 (回應文字, 解析出的動作)
+
+    模型寫完 Action 的右括號（或工具呼叫的 JSON）就停止生成並回傳動作；
+    遇到 Observation: 表示模型開始自己編造結果，同樣停止，後面的內容不採用。
+    """
+    parser = ReActStreamParser()
+    shown = 0  # 已顯示到的位置
+    stream = llm.stream(messages, stop=STOP_SEQUENCES)
+    try:
+        for chunk in stream:
+            # 最終答案要讀到結束，只有動作 / Observation 會提早停止
+            events = [event for event in parser.feed(chunk.text) if event.kind != "final"]
+            end = events[0].end if events else len(parser.text)
+            console.print(parser.text[shown:end], end="", markup=False, highlight=False)
+            shown = end
+            if not events:
+                continue
+            print()
+            event = events[0]
+            if event.kind == "observation":
+                return parser.text[:end], None
+            arg = event.arg if event.payload is None else tool_argument(event.name, event.payload)
+            return parser.text[:end], ((event.name, arg) if arg else None)
+    finally:
+        stream.close()  # 提早結束時停止接收模型輸出
+    print()
+    return parser.text, None
+
+def print_highlighted(response: str):
+    """高亮顯示 Thought / Action / Observation / Final Answer"""
+    parts = re.split(r"(Thought:|Action:|Observation:|Final Answer:)", response)
+    if len(parts) == 1:
+        console.print(response)
+        return
+    if parts[0].strip():
+        console.print(parts[0].strip())
+    style_map = {
+        "Thought:": "bold cyan",
+        "Action:": "bold yellow",
+        "Observation:": "bold green",
+        "Final Answer:": "bold magenta",
+    }
+    for i in range(1, len(parts), 2):
+        token = parts[i]
+        content = parts[i + 1] if i + 1 < len(parts) else ""
+        style = style_map.get(token, None)
+        if style:
+            console.print(token, style=style)
+        else:
+            console.print(token)
+        if content.strip():
+            console.print(content.strip())
+
+
+# 兩種模式共用的最終答案格式與行程約束
+FINAL_ANSWER_RULES = """Final Answer: 請用 JSON 格式輸出最終行程，例如：
 [
   {"place": "美泉宮", "minutes": 120},
   {"place": "聖史蒂芬大教堂", "minutes": 120}
 ]
 
-約束：每個景點至少 120 分鐘；景點之間交通 30 分鐘；09:00 出發且 18:00 前結束；若休館則調整。
+約束：每個景點至少 120 分鐘；景點之間交通 30 分鐘；09:00 出發且 18:00 前結束；若休館則調整。"""
 
-工具僅允許：查天氣(city)、查詢開放狀態(place)。
+REACT_SYSTEM_PROMPT = f"""你是一個旅行規劃助理，使用 ReAct 模式回答問題，思考請用繁體中文。
+格式必須包含以下幾種：
+Thought: 你的推理
+Action: 你要執行的工具（格式：查天氣(city) 或 查詢開放狀態(place)）
+Observation: 工具回傳的結果（由系統提供，不要自己寫）
+{FINAL_ANSWER_RULES}
 
-現在任務：幫我規劃今天去美泉宮、美景宮、聖史蒂芬大教堂的一日行程。"""
+工具僅允許：查天氣(city)、查詢開放狀態(place)。每個回合只執行一個 Action。"""
 
-    for step in range(8):  # 最多 8 回合
-        print(f"\n=== 回合 {step + 1} ===")
-        ai_msg = llm.invoke(prompt)
-        response = getattr(ai_msg, "content", str(ai_msg))
+TOOL_SYSTEM_PROMPT = f"""你是一個旅行規劃助理，思考請用繁體中文。
+需要資訊時直接呼叫工具（get_weather、check_open），同一回合可以一次呼叫多個工具。
+資訊足夠後，回覆中必須包含：
+{FINAL_ANSWER_RULES}"""
+
+REACT_TASK = "現在任務：幫我規劃今天去美泉宮、美景宮、聖史蒂芬大教堂的一日行程。"
+
+# 比較兩種模式時使用的任務集
+REACT_TASKS = [
+    REACT_TASK,
+    "現在任務：幫我規劃今天去美景宮和美泉宮的一日行程。",
+    "現在任務：今天想去聖史蒂芬大教堂、美泉宮，如果美景宮有開也想去，幫我規劃一日行程。",
+]
+
+# 無法解析動作時，下一回合改送格式提醒，而不是一再重送同樣的內容
+FORMAT_REMINDER = (
+    "上一個回應沒有可執行的 Action。請只輸出 Thought，接著一行 "
+    "Action: 查天氣(city) 或 Action: 查詢開放狀態(place)；資訊已足夠就直接輸出 Final Answer。"
+)
+
+
+@dataclass
+class ReActRound:
+    """一個已完成的回合：模型的 Thought / Action 與工具的 Observation"""
 
-        # 高亮顯示 Thought / Action / Observation / Final Answer
-        parts = re.split(r"(Thought:|Action:|Observation:|Final Answer:)", response)
-        if len(parts) == 1:
-            console.print(response)
+    response: str
+    observation: str
+    summary: str  # 壓縮後的一行紀錄，例如「查天氣(Vienna) → 今天維也納是下雨天」
+
+
+@dataclass
+class ReActOutcome:
+    """一次任務的結果，用來比較兩種模式"""
+
+    plan: list
+    rounds: int  # 呼叫模型的次數
+    parse_failures: int  # 沒有可執行動作、也沒有可解析最終答案的回應數
+
+
+def build_messages(rounds: list[ReActRound], keep: int = REACT_KEEP_ROUNDS, task: str = REACT_TASK):
+    """組出這個回合要送出的訊息
+
+    最近 keep 個回合保留完整的 AI 回應與 Observation，更早的回合只留一行摘要，
+    每回合送出的長度不會隨回合數等比增加；keep 為 0 表示不壓縮。
+    """
+    folded = rounds[:-keep] if keep and len(rounds) > keep else []
+    if folded:
+        task += "\n\n先前回合的觀察結果：\n" + "\n".join(f"- {r.summary}" for r in folded)
+    messages = [SystemMessage(REACT_SYSTEM_PROMPT), HumanMessage(task)]
+    for r in rounds[len(folded) :]:
+        messages.append(AIMessage(r.response))
+        messages.append(HumanMessage(f"Observation: {r.observation}"))
+    return messages, len(folded)
+
+
+def print_token_report(round_count: int, sent_total: int, full_total: int):
+    saved = full_total - sent_total
+    console.print(
+        f"共 {round_count} 回合，累計送出約 {sent_total} tokens"
+        f"（不壓縮約 {full_total} tokens，節省 {saved}）",
+        style="bold blue",
+    )
+
+
+def parse_final_answer(response: str):
+    """取出 Final Answer 之後的 JSON 行程，失敗時回傳 None"""
+    try:
+        plan = json.loads(clean_json_text(response.split("Final Answer:")[-1].strip()))
+    except Exception as e:
+        print("\nJSON 解析失敗：", e)
+        return None
+    print("\n最終解析後的行程：", plan)
+    return plan
+
+
+def react_loop(task: str = REACT_TASK, max_rounds: int = 8) -> ReActOutcome:
+    rounds: list[ReActRound] = []
+    failed = None  # 上一回合無法解析的回應，下一回合附上格式提醒
+    failures = 0
+    total_failures = 0
+    sent_total = 0
+    full_total = 0  # 不壓縮時需要送出的量，用來比較
+
+    for step in range(max_rounds):
+        print(f"\n=== 回合 {step + 1} ===")
+        messages, folded = build_messages(rounds, task=task)
+        reminder = [] if failed is None else [AIMessage(failed), HumanMessage(FORMAT_REMINDER)]
+        messages += reminder
+        sent = chinese_aware_token_count(messages)
+        sent_total += sent
+        full_total += chinese_aware_token_count(build_messages(rounds, keep=0, task=task)[0] + reminder)
+        console.print(
+            f"送出約 {sent} tokens（{len(messages)} 則訊息，壓縮 {folded} 個回合）",
+            style="dim",
+        )
+
+        if STREAM_REACT:
+            response, parsed = stream_react_turn(messages)
         else:
-            if parts[0].strip():
-                console.print(parts[0].strip())
-            style_map = {
-                "Thought:": "bold cyan",
-                "Action:": "bold yellow",
-                "Observation:": "bold green",
-                "Final Answer:": "bold magenta",
-            }
-            for i in range(1, len(parts), 2):
-                token = parts[i]
-                content = parts[i + 1] if i + 1 < len(parts) else ""
-                style = style_map.get(token, None)
-                if style:
-                    console.print(token, style=style)
-                else:
-                    console.print(token)
-                if content.strip():
-                    console.print(content.strip())
+            ai_msg = llm.invoke(messages)
+            # 模型自己編造的 Observation 與後續內容不採用
+            response = str(getattr(ai_msg, "content", ai_msg)).split("Observation:")[0]
+            print_highlighted(response)
+            parsed = None
 
         # ---- 如果是最終答案 ----
         if "Final Answer" in response:
-            try:
-                json_str = response.split("Final Answer:")[-1].strip()
-                json_str = clean_json_text(json_str)
-                plan = json.loads(json_str)
-                print("\n最終解析後的行程：", plan)
-                return plan
-            except Exception as e:
-                print("\nJSON 解析失敗：", e)
-                return []
+            print_token_report(step + 1, sent_total, full_total)
+            plan = parse_final_answer(response)
+            return ReActOutcome(plan or [], step + 1, total_failures + (plan is None))
+
+        # ---- 嘗試解析 Action（串流模式已在生成時解析完成） ----
+        if not STREAM_REACT:
+            parsed = parse_action_line(response)
+            if not parsed:
+                parsed = parse_tool_metadata_call(response)
 
-        # ---- 嘗試解析 Action ----
-        parsed = parse_action_line(response)
         if not parsed:
-            parsed = parse_tool_metadata_call(response)
-
-        if parsed:
-            action, arg = parsed
-            if action in TOOLS:
-                console.print(f"\n>> 執行工具：{action}({arg})", style="bold yellow")
-                try:
-                    obs = TOOLS[action](arg)
-                except Exception as e:
-                    obs = f"工具執行失敗：{e}"
-                console.print(f">> 工具回傳：{obs}\n", style="bold green")
-                prompt += f"\nObservation: {obs}"
-            else:
-                console.print(f"\n>> 無效的工具動作：{action}", style="bold red")
-                prompt += "\nObservation: 無效的動作"
+            failures += 1
+            total_failures += 1
+            console.print(f"\n>> 無法解析動作（連續 {failures} 次）", style="bold red")
+            if failures >= MAX_PARSE_FAILURES:
+                print("模型持續沒有依照格式輸出，停止重試。")
+                break
+            failed = response  # 不寫入歷史，只在下一回合附上提醒
+            continue
+        failed = None
+        failures = 0
+
+        action, arg = parsed
+        if action in TOOLS:
+            console.print(f"\n>> 執行工具：{action}({arg})", style="bold yellow")
+            try:
+                obs = TOOLS[action](arg)
+            except Exception as e:
+                obs = f"工具執行失敗：{e}"
+            console.print(f">> 工具回傳：{obs}\n", style="bold green")
         else:
-            console.print("\n>> 無法解析動作", style="bold red")
-            prompt += "\nObservation: 無法解析動作"
+            console.print(f"\n>> 無效的工具動作：{action}", style="bold red")
+            obs = f"無效的動作 {action}，工具僅允許：{'、'.join(TOOLS)}"
+        rounds.append(ReActRound(response.strip(), obs, f"{action}({arg}) → {obs}"))
+
+    print_token_report(step + 1, sent_total, full_total)
+    return ReActOutcome([], step + 1, total_failures)
+
+
+# ---- 原生工具呼叫模式 ----
+def run_tool_calls(tool_calls) -> list[ToolMessage]:
+    """同一回合的多個工具呼叫平行執行，回傳順序與呼叫順序相同"""
+
+    def run(call):
+        name = call["name"]
+        console.print(f">> 執行工具：{name}({call['args']})", style="bold yellow")
+        if name not in NATIVE_TOOLS:
+            return ToolMessage(
+                f"無效的工具 {name}，僅允許：{'、'.join(NATIVE_TOOLS)}",
+                tool_call_id=call["id"],
+                status="error",
+            )
+        try:
+            return NATIVE_TOOLS[name].invoke(call)
+        except Exception as e:
+            return ToolMessage(f"工具執行失敗：{e}", tool_call_id=call["id"], status="error")
+
+    with ThreadPoolExecutor(max_workers=len(tool_calls)) as pool:
+        results = list(pool.map(run, tool_calls))
+    for result in results:
+        console.print(f">> 工具回傳：{result.content}", style="bold green")
+    return results
+
+
+def tool_calling_loop(task: str = REACT_TASK, max_rounds: int = 8) -> ReActOutcome:
+    """用 bind_tools 讓模型直接產生工具呼叫，不必解析文字；最終答案仍是 Final Answer JSON"""
+    model = llm.bind_tools(list(NATIVE_TOOLS.values()))
+    messages = [SystemMessage(TOOL_SYSTEM_PROMPT), HumanMessage(task)]
+    failures = 0
+    total_failures = 0
+
+    for step in range(max_rounds):
+        print(f"\n=== 回合 {step + 1} ===")
+        ai_msg = model.invoke(messages)
+        response = str(ai_msg.content)
+        if response.strip():
+            print_highlighted(response)
+
+        if ai_msg.tool_calls:
+            failures = 0
+            messages.append(ai_msg)
+            messages += run_tool_calls(ai_msg.tool_calls)
+            continue
+
+        if "Final Answer" in response:
+            plan = parse_final_answer(response)
+            return ReActOutcome(plan or [], step + 1, total_failures + (plan is None))
+
+        failures += 1
+        total_failures += 1
+        console.print(f"\n>> 沒有工具呼叫也沒有最終答案（連續 {failures} 次）", style="bold red")
+        if failures >= MAX_PARSE_FAILURES:
+            print("模型持續沒有依照格式輸出，停止重試。")
+            break
+        messages += [ai_msg, HumanMessage("請呼叫工具取得需要的資訊，或依格式輸出 Final Answer。")]
+
+    return ReActOutcome([], step + 1, total_failures)
+
+
+def compare_modes(tasks: list[str] = REACT_TASKS):
+    """同一組任務分別用兩種模式執行，比較回合數與解析失敗率"""
+    loops = {"text": react_loop, "tools": tool_calling_loop}
+    outcomes = {mode: [loop(task) for task in tasks] for mode, loop in loops.items()}
+
+    print("\n=== 模式比較 ===")
+    for mode, results in outcomes.items():
+        answered = [r for r in results if r.plan]
+        calls = sum(r.rounds for r in results)
+        failures = sum(r.parse_failures for r in results)
+        avg_rounds = sum(r.rounds for r in answered) / len(answered) if answered else float("nan")
+        print(
+            f"{mode:>5}：完成 {len(answered)}/{len(results)} 個任務，"
+            f"平均 {avg_rounds:.1f} 回合得到答案，"
+            f"解析失敗率 {failures}/{calls}（{failures / calls:.0%}）"
+        )
 
 
 # ---- 執行行程模擬 ----
 def simulate_schedule(plan, weather="rain"):
     print("\n=== 行程時間模擬 ===")
-    time = datetime.strptime("09:00", "%H:%M")
-    end = datetime.strptime("18:00", "%H:%M")
+    # 景點之間交通 30 分鐘，下雨延長 1.5 倍
+    steps = with_travel_legs([task["minutes"] for task in plan], travel_minutes=30)
+    result = evaluate_plans(*pack_plans([steps]), travel_factor=1.5 if weather == "rain" else 1.0)
 
+    travel_label = "前往下一景點（因下雨延誤）" if weather == "rain" else "前往下一景點"
+    labels = []
     for i, task in enumerate(plan):
-        duration = task["minutes"]
-        finish = time + timedelta(minutes=duration)
-        print(f"{time.strftime('%H:%M')}–{finish.strftime('%H:%M')} 參觀 {task['place']}")
-        time = finish
-
-        if i < len(plan) - 1:  # 景點之間交通
-            travel_time = int(30 * (1.5 if weather == "rain" else 1))
-            finish = time + timedelta(minutes=travel_time)
-            if weather == "rain":
-                print(f"{time.strftime('%H:%M')}–{finish.strftime('%H:%M')} 前往下一景點（因下雨延誤）")
-            else:
-                print(f"{time.strftime('%H:%M')}–{finish.strftime('%H:%M')} 前往下一景點")
-            time = finish
+        if i:
+            labels.append(travel_label)
+        labels.append(f"參觀 {task['place']}")
+    for line in result.timeline(0, labels):
+        print(line)
 
-    print("行程可行！" if time <= end else "行程超時！")
+    print("行程可行！" if result.feasible[0] else "行程超時！")
 
 
 # ---- 主程式 ----
 if __name__ == "__main__":
-    plan = react_loop()
-    if plan:
-        simulate_schedule(plan, weather="rain")
\ No newline at end of file
+    if "--compare" in sys.argv:
+        compare_modes()
+    else:
+        outcome = tool_calling_loop() if REACT_MODE == "tools" else react_loop()
+        if outcome.plan:
+            simulate_schedule(outcome.plan, weather="rain")
\ No newline at end of file
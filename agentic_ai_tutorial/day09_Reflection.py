@@ -1,10 +1,24 @@
+import asyncio
 import json
 import os
-from datetime import datetime, timedelta
+import sys
+import time
+from pathlib import Path
 
+import numpy as np
 from dotenv import load_dotenv
 from langchain.chat_models import init_chat_model
 
+# 讓子資料夾中的腳本也能匯入專案根目錄的 agent_utils
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from agent_utils.schedule_engine import (  # noqa: E402
+    DAY_END,
+    DAY_START,
+    evaluate_plans,
+    pack_plans,
+    shrink_to_fit,
+)
+
 load_dotenv()
 
 # ---- 初始化 LLM ----
@@ -14,6 +28,12 @@ llm = init_chat_model(
     temperature=0.2,
     max_tokens=2048,
 )
+# 超時時先在本地縮短停留時間，做不到才請 LLM Reflection；設為 0 一律交給 LLM
+LOCAL_REPAIR = os.environ.get("LOCAL_REPAIR", "1") != "0"
+# 一次平行產生幾個改進版本（1 表示維持單一版本）與同時送出的請求上限
+REFLECTION_CANDIDATES = int(os.environ.get("REFLECTION_CANDIDATES", "3"))
+REFLECTION_CONCURRENCY = int(os.environ.get("REFLECTION_CONCURRENCY", "4"))
+
 # ---- 工具函式：清理 LLM 輸出的 JSON ----
 def clean_json_str(raw: str) -> str:
     raw = raw.strip()
@@ -22,6 +42,21 @@ def clean_json_str(raw: str) -> str:
         raw = raw.replace("json", "", 1).strip()
     return raw
 
+def extract_json_array(text: str):
+    """從說明文字中找出最後一個 JSON 陣列（Reflection 的改進版通常在最後）"""
+    decoder = json.JSONDecoder()
+    found = None
+    for i, ch in enumerate(text):
+        if ch != "[":
+            continue
+        try:
+            value, _ = decoder.raw_decode(text, i)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(value, list) and value and all(isinstance(item, dict) for item in value):
+            found = value
+    return found
+
 # ---- Step 1: 初始行程（模擬 ReAct 輸出，但會超時） ----
 init_prompt = """
 請幫我規劃今天從上午 9 點出發的行程，包含：
@@ -54,30 +89,120 @@ print(json.dumps(plan, ensure_ascii=False, indent=2))
 # ---- 行程模擬器 ----
 def simulate_schedule(plan, title="行程模擬"):
     print(f"\n=== {title} ===")
-    time = datetime.strptime("09:00", "%H:%M")
-    end = datetime.strptime("18:00", "%H:%M")
-
-    for task in plan:
-        duration = task["minutes"]
-        finish = time + timedelta(minutes=duration)
-        print(f"{time.strftime('%H:%M')}–{finish.strftime('%H:%M')} {task['place']}")
-        time = finish
+    result = evaluate_plans([[task["minutes"] for task in plan]])
+    for line in result.timeline(0, [task["place"] for task in plan]):
+        print(line)
 
-    feasible = time <= end
+    feasible = bool(result.feasible[0])
     print("\n行程可行！" if feasible else "\n行程超時！")
     return feasible
 
 
+# ---- 本地修復：依最低時間與優先度縮短停留時間 ----
+TRAVEL_WORDS = ("交通", "前往", "移動")
+MEAL_WORDS = ("午餐", "餐廳", "用餐", "lunch")
+# 縮短時的下限是本地修復自己的假設，不是任務條件：
+# 午餐至少 1 小時、景點至少 1.5 小時（大約是走完主要參觀路線的時間），交通無法縮短。
+# 修復結果一律再經過與 Reflection 候選相同的檢查（passes_checks），沒通過就交給 LLM。
+MIN_MEAL_MINUTES = 60
+MIN_SIGHT_MINUTES = 90
+
+def repair_rule(task):
+    """回傳 (最低分鐘數, 優先度)，優先度小的先縮短：午餐 → 景點，交通不縮短"""
+    place = str(task["place"]).lower()
+    if any(word in place for word in TRAVEL_WORDS):
+        return task["minutes"], 2
+    if any(word in place for word in MEAL_WORDS):
+        return MIN_MEAL_MINUTES, 0
+    return MIN_SIGHT_MINUTES, 1
+
+def repair_plan_locally(plan):
+    """在 09:00–18:00 內縮短各項時間；最低時間加總仍超時則回傳 None"""
+    rules = [repair_rule(task) for task in plan]
+    minutes = shrink_to_fit(
+        [task["minutes"] for task in plan],
+        minimums=[minimum for minimum, _ in rules],
+        budget=DAY_END - DAY_START,
+        priorities=[priority for _, priority in rules],
+    )
+    if minutes is None:
+        return None
+    return [{**task, "minutes": int(m)} for task, m in zip(plan, minutes)]
+
+
+# ---- 多個候選版本：平行產生、本地評分 ----
+# 每個候選給不同的改進方向，避免平行產生的版本大同小異
+REFLECTION_STRATEGIES = ["平均縮短每一項", "優先縮短午餐", "優先縮短停留最久的景點", "必要時刪去次要行程"]
+REQUIRED_STOPS = [("美泉宮", "schönbrunn"), ("聖史蒂芬", "stephen"), MEAL_WORDS]
+
+def is_valid_plan(plan):
+    return all(
+        isinstance(task.get("place"), str) and isinstance(task.get("minutes"), int | float)
+        for task in plan
+    )
+
+def score_candidates(candidates):
+    """一次模擬所有候選並排序：可行優先，其次涵蓋原始需求的項目數、超時分鐘數、停留總時間"""
+    result = evaluate_plans(*pack_plans([[(task["minutes"], False) for task in plan] for plan in candidates]))
+    coverage = np.array([
+        sum(any(any(word in task["place"].lower() for word in words) for task in plan) for words in REQUIRED_STOPS)
+        for plan in candidates
+    ])
+    used = np.array([sum(task["minutes"] for task in plan) for plan in candidates])
+    order = np.lexsort((-used, result.overtime, -coverage, ~result.feasible))
+    return order, result, coverage
+
+def passes_checks(candidate):
+    """本地修復的結果與 Reflection 候選用同一套標準：格式正確、可行、涵蓋所有原始需求"""
+    if not candidate or not is_valid_plan(candidate):
+        return False
+    _, result, coverage = score_candidates([candidate])
+    return bool(result.feasible[0]) and coverage[0] == len(REQUIRED_STOPS)
+
+async def reflect_in_parallel(prompt, n):
+    """同時送出 n 個 Reflection 請求（最多 REFLECTION_CONCURRENCY 個並行），回傳解析成功的行程"""
+    prompts = [
+        f"{prompt}\n這個版本的改進方向：{REFLECTION_STRATEGIES[i % len(REFLECTION_STRATEGIES)]}。"
+        for i in range(n)
+    ]
+    responses = await llm.abatch(
+        prompts,
+        config={"max_concurrency": REFLECTION_CONCURRENCY},
+        return_exceptions=True,
+    )
+    candidates = []
+    for i, response in enumerate(responses):
+        if isinstance(response, Exception):
+            print(f"第 {i + 1} 個回應產生失敗：{response}")
+            continue
+        candidate = extract_json_array(str(response.content))
+        if candidate and is_valid_plan(candidate):
+            candidates.append(candidate)
+        else:
+            print(f"第 {i + 1} 個回應 JSON 解析失敗")
+    return candidates
+
+
 # ---- Step 2: 模擬初始行程 ----
+feasible = False
+refined_plan = []
 if plan:
     feasible = simulate_schedule(plan, "初始行程模擬")
-    if not feasible:
+    if not feasible and LOCAL_REPAIR:
+        started = time.perf_counter()
+        refined_plan = repair_plan_locally(plan) or []
+        if refined_plan and not passes_checks(refined_plan):
+            print("\n本地修復後的行程沒有通過檢查（仍超時或缺少必要行程），改由 LLM Reflection")
+            refined_plan = []
+        elapsed_us = (time.perf_counter() - started) * 1e6
+        if refined_plan:
+            print(f"\n初始行程超時，已在本地縮短停留時間（{elapsed_us:.0f} µs），不需要 LLM Reflection")
+    if not feasible and not refined_plan:
         print("\n初始行程超時，進入 Reflection 檢討...\n")
 
 
-# ---- Step 3: Reflection 讓 LLM 檢討與改進 ----
-refined_plan = []
-if plan:
+# ---- Step 3: Reflection 讓 LLM 檢討與改進（只在本地無法修復時執行） ----
+if plan and not feasible and not refined_plan:
     reflection_prompt = f"""
 你剛完成以下一日行程規劃：
 {plan}
@@ -98,18 +223,25 @@ if plan:
 2. 找出可能的問題（例如是否超時，時間分配是否合理）。
 3. 提供改進後的版本（JSON 格式，結構與原本相同）。
 """
-    reflection_response = str(llm.invoke(reflection_prompt).content)
-    print("=== Reflection Output ===")
-    print(reflection_response)
-
-    if "[" in reflection_response and "]" in reflection_response:
-        try:
-            refined_str = reflection_response.split("[", 1)[1]
-            refined_str = "[" + refined_str.split("]", 1)[0] + "]"
-            refined_str = clean_json_str(refined_str)
-            refined_plan = json.loads(refined_str)
-        except Exception as e:
-            print("\n改進後行程 JSON 解析失敗：", e)
+    if REFLECTION_CANDIDATES > 1:
+        # 一輪平行產生多個版本，取代「不可行就再來一輪」的多次序列 Reflection
+        started = time.perf_counter()
+        candidates = asyncio.run(reflect_in_parallel(reflection_prompt, REFLECTION_CANDIDATES))
+        print(f"=== 平行 Reflection：{len(candidates)}/{REFLECTION_CANDIDATES} 個有效版本，耗時 {time.perf_counter() - started:.1f} 秒 ===")
+        if candidates:
+            order, scores, coverage = score_candidates(candidates)
+            for rank, i in enumerate(order):
+                status = "可行" if scores.feasible[i] else f"超時 {scores.overtime[i]:.0f} 分鐘"
+                print(f"{rank + 1}. 版本 {i + 1}：{status}，涵蓋 {coverage[i]}/{len(REQUIRED_STOPS)} 項需求")
+            refined_plan = candidates[order[0]]
+    else:
+        reflection_response = str(llm.invoke(reflection_prompt).content)
+        print("=== Reflection Output ===")
+        print(reflection_response)
+
+        refined_plan = extract_json_array(reflection_response) or []
+        if not refined_plan:
+            print("\n改進後行程 JSON 解析失敗")
 
 
 # ---- Step 4: 模擬改進後的行程 ----
@@ -1,8 +1,18 @@
+import asyncio
 import os
+import sys
+import time
+from pathlib import Path
 
 from dotenv import load_dotenv
 from langchain.chat_models import init_chat_model
 
+# 讓子資料夾中的腳本也能匯入專案根目錄的 agent_utils
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from agent_utils.candidate_index import CandidateIndex, clear_winner  # noqa: E402
+from agent_utils.memory_writer import BackgroundMemoryWriter, llm_extractor  # noqa: E402
+from agent_utils.preference_memory import PreferenceMemory, requested_tags  # noqa: E402
+
 load_dotenv()
 # ---- 初始化 LLM ----
 MODEL_NAME = os.environ.get("MODEL_NAME", "openai:gpt-oss-20b-local")
@@ -11,38 +21,95 @@ llm = init_chat_model(
     temperature=0.2,
     max_tokens=2048,
 )
+# 只把本地排序的前幾名交給 LLM
+TOP_K = 3
+# 長期記憶存放位置；預設不保存，設為檔案路徑（例如 preferences.sqlite）才會跨次執行保留
+PREFERENCE_DB = os.environ.get("PREFERENCE_DB", ":memory:")
+# 回覆之後在背景用 LLM 擷取更完整的偏好；設為 0 只用規則擷取
+BACKGROUND_MEMORY = os.environ.get("BACKGROUND_MEMORY", "1") != "0"
+# 下一輪開始前最多等背景擷取幾秒，超過就先用目前的記憶
+MEMORY_FLUSH_TIMEOUT = float(os.environ.get("MEMORY_FLUSH_TIMEOUT", "10"))
 
-# ---- 記憶存放結構 ----
-memory_store = {"diet": {}, "cuisine_pref": []}
-
-def update_memory(user_input: str):
-    if "不吃牛肉" in user_input:
-        memory_store["diet"]["beef"] = False
-    if "豬排" in user_input and "schnitzel" not in memory_store["cuisine_pref"]:
-        memory_store["cuisine_pref"].append("schnitzel")
-
-# 使用者輸入
-user_input = "我不吃牛肉，但喜歡維也納豬排"
-update_memory(user_input)
+# ---- 長期記憶：擷取偏好、去重並取代衝突的舊偏好 ----
+memory = PreferenceMemory(PREFERENCE_DB)
+if memory.facts:
+    # 提醒這次的推薦會受到先前執行時記下的偏好影響
+    print(f"已從 {PREFERENCE_DB} 載入 {len(memory.facts)} 筆先前的偏好：", [fact.text for fact in memory.facts])
 
-print("使用者記憶：", memory_store)
+# 使用者的多輪輸入：前一輪擷取到的偏好，下一輪推薦時就會用到
+USER_TURNS = [
+    "我不吃牛肉，但喜歡維也納豬排",
+    "晚餐想吃清淡一點，海鮮或日本料理都可以",
+]
 candidates = [
     {"name": "市中心牛排館", "tags": ["beef", "steak"]},
     {"name": "市中心壽司店", "tags": ["japanese", "sushi"]},
     {"name": "市中心維也納豬排餐廳", "tags": ["schnitzel", "austrian"]}
 ]
+index = CandidateIndex(candidates)
+
+
+async def recommend(user_input: str) -> str:
+    # 規則擷取只要幾微秒，直接寫入；LLM 擷取留到回覆之後
+    for action, fact in memory.add(user_input):
+        print(f"記憶{action}：{fact.text}")
 
+    # ---- 本地篩選與排序：飲食限制是硬性排除，偏好只加分 ----
+    exclude, weights = memory.preferences()
+    # 這一輪自己提到的需求（例如「海鮮或日本料理都可以」）也要加分
+    requested = requested_tags(user_input)
+    for tag in requested:
+        weights[tag] = weights.get(tag, 0.0) + 1.0
+    ranked = index.search(weights, exclude, k=TOP_K)
+    print("本地排序：", [(item.candidate["name"], item.score) for item in ranked])
 
-prompt = f"""
+    winner = clear_winner(ranked)
+    if not ranked:
+        return "沒有符合飲食限制的餐廳"
+    if winner and not requested:
+        # 這一輪沒有另外的需求，長期偏好已經明確領先，不必再請 LLM 挑選
+        return f"{winner['name']}（本地排序，未呼叫 LLM）"
+
+    # 只放和這幾間候選相關的記憶，而不是整份記憶
+    recalled = memory.recall(" ".join(item.candidate["name"] for item in ranked), k=3)
+    habits = "\n".join(f"- {fact.text}" for fact, _ in recalled) or "（沒有相關記憶）"
+    prompt = f"""
 使用者的飲食習慣：
-{memory_store}
+{habits}
+
+使用者這次的需求：{user_input}
 
-候選餐廳：
-{candidates}
+候選餐廳（已排除不符合飲食限制的餐廳，依偏好排序）：
+{[item.candidate for item in ranked]}
 
 請依照使用者的飲食限制與偏好，選擇最合適的一間餐廳，
 並只輸出餐廳的名稱。
 """
+    response = await llm.ainvoke(prompt)
+    return str(response.content).strip()
+
+
+async def main():
+    writer = BackgroundMemoryWriter(memory, llm_extractor(llm)).start() if BACKGROUND_MEMORY else None
+    for user_input in USER_TURNS:
+        print(f"\n使用者：{user_input}")
+        started = time.perf_counter()
+        answer = await recommend(user_input)
+        print(f"AI 建議的餐廳：{answer}（{time.perf_counter() - started:.2f} 秒）")
+        if writer:
+            writer.submit(user_input)  # 回覆之後才排進背景擷取，不增加這一輪的等待時間
+            try:
+                # 下一輪推薦要看得到這一輪擷取到的偏好
+                await asyncio.wait_for(writer.flush(), MEMORY_FLUSH_TIMEOUT)
+            except TimeoutError:
+                print(f"背景記憶寫入超過 {MEMORY_FLUSH_TIMEOUT:.0f} 秒，先用目前的記憶")
+
+    if writer:
+        await writer.aclose()  # 結束前把佇列中的句子處理完
+        print("\n背景記憶寫入：", writer.stats())
+        for action, fact in writer.changes:
+            print(f"  {action}：{fact.text}")
+    print("使用者記憶：", [fact.text for fact in memory.facts])
+
 
-response = str(llm.invoke(prompt).content)
-print("AI 建議的餐廳：", response.strip())
\ No newline at end of file
+asyncio.run(main())
@@ -1,27 +1,22 @@
-import json
+import asyncio
 import os
-import random
-import re
-from datetime import datetime, timedelta
+import sys
+import time
+from pathlib import Path
 
 from dotenv import load_dotenv
 from langchain.chat_models import init_chat_model
+from pydantic import BaseModel, Field, model_validator
 
-load_dotenv()
+# 讓子資料夾中的腳本也能匯入專案根目錄的 agent_utils
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from agent_utils.async_dag import AsyncDAG  # noqa: E402
+from agent_utils.itinerary_optimizer import optimize_itinerary  # noqa: E402
+from agent_utils.schedule_engine import evaluate_plans, format_hhmm, pack_plans  # noqa: E402
+from agent_utils.structured_output import StructuredLLM, StructuredOutputError  # noqa: E402
+from agent_utils.travel_matrix import TravelTimeMatrix  # noqa: E402
 
-def safe_json_loads(text, fallback=None):
-    """
-    嘗試解析 JSON，會自動移除 ```json ... ``` code fence。
-    如果失敗，就回傳 fallback。
-    """
-    if not text:
-        return fallback
-    # 移除 Markdown code block 標記
-    clean = re.sub(r"^```json\s*|\s*```$", "", text.strip(), flags=re.IGNORECASE|re.MULTILINE)
-    try:
-        return json.loads(clean)
-    except Exception:
-        return fallback
+load_dotenv()
 
 # ===== 0) 初始化 =====
 MODEL_NAME = os.environ.get("MODEL_NAME", "openai:gpt-oss-20b-local")
@@ -30,6 +25,19 @@ LLM = init_chat_model(
     temperature=0.2,
     max_tokens=2048,
 )
+# 規劃完成後每一天各自平行挑餐廳、查交通、統籌；設為 0 改回逐一執行
+CONCURRENT_PIPELINE = os.environ.get("CONCURRENT_PIPELINE", "1") != "0"
+# 同時進行的 LLM / 工具呼叫上限
+MAX_CONCURRENCY = int(os.environ.get("MAX_CONCURRENCY", "4"))
+# 交通時間快取位置，設為 :memory: 則不保存
+TRAVEL_CACHE = os.environ.get("TRAVEL_CACHE", "travel_times.sqlite")
+# LLM 只挑景點與餐廳，排到哪一天、上午或下午由本地最佳化決定；設為 0 沿用 LLM 的排法
+# （平行流程中各天的午餐平行挑選，全部到齊後只排序一次，同樣會跨天交換景點）
+OPTIMIZE_ORDER = os.environ.get("OPTIMIZE_ORDER", "1") != "0"
+# 先用供應商的 JSON schema 模式取得結構化輸出；設為 0 只用提示詞附上 schema + 本地驗證
+NATIVE_STRUCTURED_OUTPUT = os.environ.get("NATIVE_STRUCTURED_OUTPUT", "1") != "0"
+# 輸出不符合 schema 時最多請模型修正幾次
+MAX_REPAIRS = 2
 
 # ===== 1) Memory (使用者偏好) =====
 MEMORY = {
@@ -38,51 +46,104 @@ MEMORY = {
 }
 
 # ===== 2) Tool Use 模擬 =====
+# 查過的路線存在對稱矩陣與 SQLite 中；後端目前是以種子決定的 20–40 分鐘假資料
+TRAVEL_TIMES = TravelTimeMatrix(path=TRAVEL_CACHE)
+
 def travel_time_tool(from_place, to_place):
     """
     模擬呼叫外部 API 查交通時間。
-    這裡用隨機數 20–40 分鐘。
+    同一組地點每次都得到相同結果，查過的路線直接從快取取得。
     """
-    return random.randint(20, 40)
+    return int(TRAVEL_TIMES.travel_time(from_place, to_place))
 
-# ===== 3) Agents 定義 =====
-def planner_agent():
-    prompt = """
-    請規劃維也納 2 日行程，每天上午與下午各安排一個景點，輸出 JSON 格式。
-    範例：
-    {
-        "Day1": {"am": "美泉宮", "pm": "聖史蒂芬大教堂"},
-        "Day2": {"am": "奧地利國家圖書館", "pm": "維也納歌劇院"}
-    }
+# ===== 3) 輸出格式 =====
+# 天數用清單而不是 {"Day1": ...} 的動態 key，供應商的 JSON schema 模式才描述得了
+class DayPlan(BaseModel):
+    day: str = Field(description="天數，例如 Day1")
+    am: str = Field(min_length=1, description="上午景點")
+    pm: str = Field(min_length=1, description="下午景點")
+
+class Itinerary(BaseModel):
+    days: list[DayPlan]
+
+    @model_validator(mode="after")
+    def distinct_sights(self):
+        sights = [sight for item in self.days for sight in (item.am, item.pm)]
+        if len(set(sights)) != len(sights):
+            raise ValueError("同一個景點不能排兩次")
+        return self
+
+    def to_plan(self):
+        return {item.day: {"am": item.am, "pm": item.pm} for item in self.days}
+
+class DayLunch(BaseModel):
+    day: str = Field(description="天數，例如 Day1")
+    restaurant: str = Field(min_length=1, description="午餐餐廳")
+
+class LunchPicks(BaseModel):
+    days: list[DayLunch]
+
+    def to_food(self):
+        return {item.day: item.restaurant for item in self.days}
+
+class DayTransit(BaseModel):
+    day: str = Field(description="天數，例如 Day1")
+    am_to_lunch: int = Field(ge=0, le=240, description="上午景點到午餐的分鐘數")
+    lunch_to_pm: int = Field(ge=0, le=240, description="午餐到下午景點的分鐘數")
+
+class TransitTimes(BaseModel):
+    days: list[DayTransit]
+
+    def to_transit(self):
+        return {item.day: {"am_to_lunch": item.am_to_lunch, "lunch_to_pm": item.lunch_to_pm}
+                for item in self.days}
+
+def require_days(days):
+    """schema 之外的檢查：輸出必須剛好涵蓋這幾天，不符時請模型修正"""
+    def check(output):
+        got = [item.day for item in output.days]
+        if sorted(got) != sorted(days):
+            raise ValueError(f"天數必須剛好是 {list(days)}，收到 {got}")
+    return check
+
+# 每個 Agent 各自統計解析失敗與重試次數
+PLANNER = StructuredLLM(LLM, Itinerary, MAX_REPAIRS, NATIVE_STRUCTURED_OUTPUT)
+FOODIE = StructuredLLM(LLM, LunchPicks, MAX_REPAIRS, NATIVE_STRUCTURED_OUTPUT)
+TRANSPORT = StructuredLLM(LLM, TransitTimes, MAX_REPAIRS, NATIVE_STRUCTURED_OUTPUT)
+
+# ===== 4) Agents 定義 =====
+PLANNER_DAYS = ["Day1", "Day2"]
+PLANNER_PROMPT = f"""
+    請規劃維也納 {len(PLANNER_DAYS)} 日行程（{"、".join(PLANNER_DAYS)}），
+    每天上午與下午各安排一個景點，景點不要重複。
     """
-    resp = str(LLM.invoke(prompt).content)
-    try:
-        return safe_json_loads(resp)
-    except Exception:
-        return None
 
-def foodie_agent(plan):
-    prompt = f"""根據以下行程，挑選午餐餐廳。
+def planner_agent():
+    return PLANNER.invoke(PLANNER_PROMPT, require_days(PLANNER_DAYS)).to_plan()
+
+def foodie_prompt(plan):
+    return f"""根據以下行程，替每一天挑選一間午餐餐廳。
 需符合條件：{MEMORY['diet']}，並偏好 {MEMORY['pref']}。
-輸出 JSON 格式，
-範例：{{"Day1": "Figlmüller（維也納豬排）", "Day2": "Gasthaus Pöschl"}}
-每天一間餐廳。行程: {plan}"""
-    resp = str(LLM.invoke(prompt).content)
-    try:
-        return safe_json_loads(resp)
-    except Exception:
-        return None
+行程: {plan}"""
+
+def foodie_agent(plan):
+    return FOODIE.invoke(foodie_prompt(plan), require_days(plan)).to_food()
 
 def transport_agent(plan, food):
     """
     Transport Agent：呼叫 travel_time_tool 取得所有需要的時間，
-    再交給 LLM 整理成 {DayX: {am_to_lunch, lunch_to_pm}} 的格式。
+    再交給 LLM 整理成 TransitTimes，回傳 {DayX: {am_to_lunch, lunch_to_pm}}。
     """
-    # Step 1: 先收集原始資料
+    # Step 1: 先收集原始資料（所有路線一次整批查詢）
+    legs = []
+    for day, schedule in plan.items():
+        legs += [(schedule["am"], food[day]), (food[day], schedule["pm"])]
+    minutes = iter(int(m) for m in TRAVEL_TIMES.travel_times(legs))
+
     raw_data = []
     for day, schedule in plan.items():
-        am_to_lunch = travel_time_tool(schedule["am"], food[day])
-        lunch_to_pm = travel_time_tool(food[day], schedule["pm"])
+        am_to_lunch = next(minutes)
+        lunch_to_pm = next(minutes)
         raw_data.append({
             "day": day,
             "am": schedule["am"],
@@ -92,63 +153,196 @@ def transport_agent(plan, food):
             "lunch_to_pm": lunch_to_pm
         })
 
-    # Step 2: 請 LLM 整理成結構化 JSON
-    prompt = f"""
-    以下是交通估算的原始資料，請整理成 JSON 格式：
+    # Step 2: 請 LLM 整理成結構化輸出
+    return TRANSPORT.invoke(transport_prompt(raw_data), require_days(plan)).to_transit()
+
+def transport_prompt(raw_data):
+    return f"""
+    以下是交通估算的原始資料，請整理出每一天「上午景點 → 午餐」與「午餐 → 下午景點」的分鐘數：
     {raw_data}
+    """
 
-    格式範例：
-    {{
-      "Day1": {{"am_to_lunch": 25, "lunch_to_pm": 30}},
-      "Day2": {{"am_to_lunch": 22, "lunch_to_pm": 35}}
-    }}
+def optimize_plan(plan, food):
+    """
+    把 LLM 挑的景點與餐廳重新分派到各天與時段，使交通時間最短，
+    交通時間直接查矩陣，不需要 Transport Agent 再呼叫一次 LLM。
     """
-    resp = str(LLM.invoke(prompt).content)
-    return safe_json_loads(resp, {})
+    days = list(plan)
+    sights = [plan[day][slot] for day in days for slot in ("am", "pm")]
+    meals = [food[day] for day in days]
+    minutes, index = TRAVEL_TIMES.matrix(sights + meals)
+    try:
+        result = optimize_itinerary({"sight": sights, "meal": meals}, minutes, index, days=len(days))
+    except ValueError as e:
+        # 例如 LLM 重複挑了同一個景點，地點不夠分派，維持原本的排法
+        print(f"⚠️ 無法重新排序（{e}），維持原本的順序")
+        legs = iter(int(m) for m in TRAVEL_TIMES.travel_times(
+            [leg for day in days for leg in ((plan[day]["am"], food[day]), (food[day], plan[day]["pm"]))]
+        ))
+        return plan, food, {day: {"am_to_lunch": next(legs), "lunch_to_pm": next(legs)} for day in days}
+
+    print(f"行程排序（{result.method}，評估 {result.evaluated} 個候選，{result.seconds * 1000:.1f} ms）："
+          f"交通共 {result.travel:.0f} 分鐘")
+    new_plan, new_food, transit = {}, {}, {}
+    for day, (am, lunch, pm), (am_to_lunch, lunch_to_pm) in zip(days, result.days, result.legs):
+        new_plan[day] = {"am": am, "pm": pm}
+        new_food[day] = lunch
+        transit[day] = {"am_to_lunch": int(am_to_lunch), "lunch_to_pm": int(lunch_to_pm)}
+    return new_plan, new_food, transit
 
 def coordinator_agent(plan, food, transit):
     """
     Coordinator Agent：統籌行程，檢查是否超時 (09:00 ~ 18:00)
     """
-    day_start = datetime.strptime("09:00", "%H:%M")
-    end_limit = datetime.strptime("18:00", "%H:%M")
+    days = list(plan)
+    # 每天一列：上午景點 180 → 交通 → 午餐 90 → 交通 → 下午景點 150，所有天數一次模擬
+    schedule = evaluate_plans(*pack_plans([
+        [
+            (180, False),
+            (transit[day]["am_to_lunch"], True),
+            (90, False),
+            (transit[day]["lunch_to_pm"], True),
+            (150, False),
+        ]
+        for day in days
+    ]))
 
     result = {}
+    for row, day in enumerate(days):
+        starts, ends = schedule.starts[row], schedule.ends[row]
+        steps = [
+            f"{format_hhmm(starts[0])}–{format_hhmm(ends[0])} {plan[day]['am']}",
+            f"{format_hhmm(starts[2])} 午餐：{food[day]} (90 分鐘)",
+            f"{format_hhmm(starts[4])}–{format_hhmm(ends[4])} {plan[day]['pm']}",
+        ]
+        feasible = "行程可行！" if schedule.feasible[row] else "行程超時！"
+        result[day] = {"timeline": steps, "status": feasible}
+
+    return result
+
+# ===== 5) 每天各自平行的流程 =====
+async def atravel_time_tool(from_place, to_place):
+    """交通查詢是外部 API（I/O），放到執行緒中讓多段路線同時查詢"""
+    return await asyncio.to_thread(travel_time_tool, from_place, to_place)
+
+async def aplanner_agent():
+    return (await PLANNER.ainvoke(PLANNER_PROMPT, require_days(PLANNER_DAYS))).to_plan()
+
+async def afoodie_day(day, schedule):
+    """只替這一天挑餐廳（提示詞與 foodie_agent 相同，只是行程只有一天）"""
+    picks = await FOODIE.ainvoke(foodie_prompt({day: schedule}), require_days([day]))
+    return picks.to_food()[day]
+
+async def atransport_day(day, schedule, lunch, am_to_lunch, lunch_to_pm):
+    """把這一天的交通時間交給 LLM 整理；修正後仍不符合格式時直接使用工具查到的數字"""
+    raw = {"day": day, "am": schedule["am"], "lunch": lunch, "pm": schedule["pm"],
+           "am_to_lunch": am_to_lunch, "lunch_to_pm": lunch_to_pm}
+    try:
+        times = await TRANSPORT.ainvoke(transport_prompt([raw]), require_days([day]))
+    except StructuredOutputError as e:
+        print(f"⚠️ {e}，改用工具查到的交通時間")
+        return {"am_to_lunch": am_to_lunch, "lunch_to_pm": lunch_to_pm}
+    return times.to_transit()[day]
+
+def add_day_nodes(dag, day, schedule):
+    """一天的 DAG：午餐 → 兩段交通（同時查詢）→ 交通整理 → 統籌"""
+    async def lunch():
+        return await afoodie_day(day, schedule)
+
+    async def am_leg(food):
+        return await atravel_time_tool(schedule["am"], food)
+
+    async def pm_leg(food):
+        return await atravel_time_tool(food, schedule["pm"])
+
+    async def transport(food, am_to_lunch, lunch_to_pm):
+        return await atransport_day(day, schedule, food, am_to_lunch, lunch_to_pm)
+
+    async def coordinate(food, transit):
+        return coordinator_agent({day: schedule}, {day: food}, {day: transit})[day]
+
+    dag.add(f"{day}/午餐", lunch)
+    dag.add(f"{day}/上午→午餐", am_leg, deps=[f"{day}/午餐"])
+    dag.add(f"{day}/午餐→下午", pm_leg, deps=[f"{day}/午餐"])
+    dag.add(f"{day}/交通", transport, deps=[f"{day}/午餐", f"{day}/上午→午餐", f"{day}/午餐→下午"])
+    dag.add(f"{day}/統籌", coordinate, deps=[f"{day}/午餐", f"{day}/交通"])
+
+def add_optimized_nodes(dag, plan):
+    """每天的午餐平行挑選 → 全部到齊後對所有天數本地排序一次（含交通時間）→ 每天各自統籌"""
     for day, schedule in plan.items():
-        cur = day_start
-        steps = []
+        async def lunch(day=day, schedule=schedule):
+            return await afoodie_day(day, schedule)
 
-        # 上午景點
-        steps.append(f"{cur.strftime('%H:%M')}–{(cur:=cur+timedelta(minutes=180)).strftime('%H:%M')} {schedule['am']}")
+        dag.add(f"{day}/午餐", lunch)
 
-        # 上午 → 午餐
-        cur += timedelta(minutes=transit[day]["am_to_lunch"])
-        steps.append(f"{cur.strftime('%H:%M')} 午餐：{food[day]} (90 分鐘)")
-        cur += timedelta(minutes=90)
+    async def optimize(*lunches):
+        return optimize_plan(plan, dict(zip(plan, lunches)))
 
-        # 午餐 → 下午
-        cur += timedelta(minutes=transit[day]["lunch_to_pm"])
-        steps.append(f"{cur.strftime('%H:%M')}–{(cur:=cur+timedelta(minutes=150)).strftime('%H:%M')} {schedule['pm']}")
+    dag.add("排序", optimize, deps=[f"{day}/午餐" for day in plan])
+    for day in plan:
+        async def coordinate(ordered, day=day):
+            new_plan, food, transit = ordered
+            return coordinator_agent({day: new_plan[day]}, {day: food[day]}, {day: transit[day]})[day]
 
-        feasible = "行程可行！" if cur <= end_limit else "行程超時！"
-        result[day] = {"timeline": steps, "status": feasible}
+        dag.add(f"{day}/統籌", coordinate, deps=["排序"])
 
-    return result
+async def run_concurrent_pipeline():
+    """規劃完成後每一天各自展開，總耗時約為單日的關鍵路徑"""
+    plan = await aplanner_agent()
+    print("Planner:", plan)
 
-# ===== 4) 執行 Demo =====
-if __name__ == "__main__":
-    print("=== Multi-Agent + Tool Use Demo ===")
+    dag = AsyncDAG(max_concurrency=MAX_CONCURRENCY)
+    if OPTIMIZE_ORDER:
+        add_optimized_nodes(dag, plan)
+    else:
+        for day, schedule in plan.items():
+            add_day_nodes(dag, day, schedule)
+    results = await dag.run()
+    print("平行流程：", dag.report())
 
+    # 依天數順序合併
+    if OPTIMIZE_ORDER:
+        _, food, transit = results["排序"]
+    else:
+        food = {day: results[f"{day}/午餐"] for day in plan}
+        transit = {day: results[f"{day}/交通"] for day in plan}
+    print("Foodie:", food)
+    print("Transport (Tool Use):", transit)
+    return {day: results[f"{day}/統籌"] for day in plan}
+
+def run_sequential_pipeline():
     plan = planner_agent()
     print("Planner:", plan)
 
     food = foodie_agent(plan)
     print("Foodie:", food)
 
-    transit = transport_agent(plan, food)
+    if OPTIMIZE_ORDER:
+        plan, food, transit = optimize_plan(plan, food)
+        print("排序後：", plan, food)
+    else:
+        transit = transport_agent(plan, food)
     print("Transport (Tool Use):", transit)
 
-    final = coordinator_agent(plan, food, transit)
+    return coordinator_agent(plan, food, transit)
+
+# ===== 6) 執行 Demo =====
+if __name__ == "__main__":
+    print("=== Multi-Agent + Tool Use Demo ===")
+
+    started = time.perf_counter()
+    try:
+        if CONCURRENT_PIPELINE:
+            final = asyncio.run(run_concurrent_pipeline())
+        else:
+            final = run_sequential_pipeline()
+    except StructuredOutputError as e:
+        print(f"❌ {e}")
+        final = {}
+    print(f"總耗時 {time.perf_counter() - started:.2f} 秒")
+    print("交通時間快取：", TRAVEL_TIMES.stats())
+    for name, agent in (("Planner", PLANNER), ("Foodie", FOODIE), ("Transport", TRANSPORT)):
+        print(f"結構化輸出 {name}：", agent.stats())
     print("\n=== 最終統籌結果 ===")
     for day, info in final.items():
         print(f"\n{day}")
@@ -1,15 +1,22 @@
 import os
+import sys
+from pathlib import Path
 
 from dotenv import load_dotenv
 from langchain.agents import create_agent
 from langchain.chat_models import init_chat_model
 from langchain_core.tools import tool
 
+# 讓子資料夾中的腳本也能匯入專案根目錄的 agent_utils
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from agent_utils.tool_cache import cached_tool  # noqa: E402
+
 # ===== 0) 初始化 =====
 load_dotenv()
 
 # 1. 定義工具（用 @tool 包裝）
 @tool
+@cached_tool(ttl=600)  # 相同城市重複查詢直接回傳快取
 def get_weather(city: str) -> str:
     """查詢指定城市的天氣狀況。"""
     weather_data = {
@@ -1,4 +1,6 @@
 import os
+import sys
+from pathlib import Path
 
 from dotenv import load_dotenv
 from langchain.chat_models import init_chat_model
@@ -8,6 +10,10 @@ from langchain_core.tools import tool
 from langgraph.func import entrypoint, task
 from langgraph.graph import add_messages
 
+# 讓子資料夾中的腳本也能匯入專案根目錄的 agent_utils
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from agent_utils.tool_cache import cached_tool  # noqa: E402
+
 load_dotenv()
 
 # =============== Step 0: 初始化模型 ===============
@@ -20,6 +26,7 @@ LLM = init_chat_model(
 
 # =============== Step 1: 定義工具：查天氣、查距離（順路） ===============
 @tool
+@cached_tool(ttl=600)
 def get_weather(location: str, period: str) -> str:
     """查詢指定地點在某時段的天氣摘要"""
     if "維也納" in location and "下午" in period:
@@ -27,6 +34,7 @@ def get_weather(location: str, period: str) -> str:
     return "晴時多雲"
 
 @tool
+@cached_tool(ttl=None)  # 景點距離不會變，不設過期
 def check_distance(start: str, end: str) -> str:
     """查詢兩個景點是否順路"""
     if start == "納許市場" and end == "藝術史博物館":
@@ -1,4 +1,6 @@
 import os
+import sys
+from pathlib import Path
 
 import requests
 from dotenv import load_dotenv
@@ -6,6 +8,10 @@ from langchain.agents import create_agent
 from langchain.chat_models import init_chat_model
 from langchain_core.tools import tool
 
+# 讓子資料夾中的腳本也能匯入專案根目錄的 agent_utils
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from agent_utils.tool_cache import cached_tool  # noqa: E402
+
 load_dotenv()
 
 # =============== Step 0: 初始化模型 ===============
@@ -20,6 +26,7 @@ if not API_KEY:
 
 # --------- 定義工具 ---------
 @tool
+@cached_tool(ttl=24 * 3600)  # 城市 Location Key 幾乎不變，快取一天
 def accuweather_search_city(city: str, country_code: str = "AT") -> dict:
     """用 AccuWeather 搜尋城市並回傳 Location Key。"""
     url = "https://dataservice.accuweather.com/locations/v1/cities/search"
@@ -32,6 +39,7 @@ def accuweather_search_city(city: str, country_code: str = "AT") -> dict:
     return data[0]
 
 @tool
+@cached_tool(ttl=600)  # 即時天氣 10 分鐘內共用，減少 API 呼叫次數
 def accuweather_current_conditions(location_key: str) -> dict:
     """查詢指定 Location Key 的即時天氣。"""
     url = f"https://dataservice.accuweather.com/currentconditions/v1/{location_key}"
@@ -1,3 +1,7 @@
+import sys
+import time
+from pathlib import Path
+
 from deepagents import create_deep_agent
 from deepagents.backends import CompositeBackend, StateBackend, StoreBackend
 from dotenv import load_dotenv
@@ -9,6 +13,15 @@ from langgraph.checkpoint.memory import MemorySaver
 from langgraph.store.memory import InMemoryStore
 from prompt_toolkit import prompt
 
+# 讓子資料夾中的腳本也能匯入專案根目錄的 agent_utils
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from agent_utils.warmup import (  # noqa: E402
+    WARMUP_ENABLED,
+    ModelWarmup,
+    first_turn_report,
+    keepalive_http_clients,
+)
+
 load_dotenv()
 checkpointer = MemorySaver()
 store = InMemoryStore()
@@ -30,7 +43,7 @@ class WeatherMiddleware(AgentMiddleware):
     tools = [get_weather]
 
 
-llm = init_chat_model("openai:gpt-oss-20b-local")
+llm = init_chat_model("openai:gpt-oss-20b-local", **keepalive_http_clients())
 
 agent = create_deep_agent(
     store=store,
@@ -53,6 +66,10 @@ def stream_agent_updates(user_input: str):
     )
 
 
+# 使用者輸入第一個問題的同時，在背景建立連線並預熱模型
+warmup = ModelWarmup(llm, keepalive_interval=4.0).start() if WARMUP_ENABLED else None
+first_turn = True
+
 while True:
     try:
         user_input = prompt("User: ")
@@ -61,7 +78,13 @@ while True:
             break
         if user_input.strip() == "":
             continue
+        started = time.perf_counter()
+        if warmup is not None:
+            warmup.stop()  # 問題已送出，不必再保持連線
         stream_agent_updates(user_input)
+        if first_turn:
+            print(first_turn_report(time.perf_counter() - started, warmup))
+            first_turn = False
     except KeyboardInterrupt:
         print("\nExiting chat.")
         break
@@ -1,21 +1,48 @@
+import asyncio
 import json
+import os
+import sys
+import time
 from dataclasses import dataclass
+from pathlib import Path
 
 from dotenv import load_dotenv
 from langchain.agents import create_agent
 from langchain.agents.structured_output import ToolStrategy
 from langchain.chat_models import init_chat_model
+from langchain.embeddings import init_embeddings
 from langchain.tools import ToolRuntime, tool
+from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.runnables import RunnableConfig
 from langgraph.checkpoint.memory import InMemorySaver
-from prompt_toolkit import prompt
+from prompt_toolkit import PromptSession
 from prompt_toolkit.history import InMemoryHistory
+from prompt_toolkit.patch_stdout import patch_stdout
 from prompt_toolkit.styles import Style
 from rich.console import Console
 
+# 讓子資料夾中的腳本也能匯入專案根目錄的 agent_utils
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from agent_utils.cancellation import aclose_interrupted_turn  # noqa: E402
+from agent_utils.history_middleware import TokenBudgetMiddleware  # noqa: E402
+from agent_utils.semantic_cache import (  # noqa: E402
+    SemanticCache,
+    embeddings_embedder,
+)
+from agent_utils.streaming import astream_agent  # noqa: E402
+from agent_utils.warmup import (  # noqa: E402
+    WARMUP_ENABLED,
+    ModelWarmup,
+    first_turn_report,
+    keepalive_http_clients,
+)
+
 # ===== 配置區 =====
 load_dotenv()
 MODEL_NAME = "openai:gpt-oss-20b-local"
+# 設為 1 開啟語意快取；EMBEDDING_MODEL（例如 openai:text-embedding-3-small）未設定時使用本地字元向量
+SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE") == "1"
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
 
 # ===== 系統提示詞 =====
 SYSTEM_PROMPT = """你是一位有用的助手。
@@ -32,6 +59,18 @@ class Context:
     """執行時期上下文"""
     user_id: str
 
+# ===== 使用者資料 =====
+# 這裡可以改成從資料庫查詢使用者位置
+USER_LOCATIONS = {
+    "1": "台北",
+    "2": "台南",
+    "3": "高雄",
+}
+
+def lookup_user_location(user_id: str) -> str:
+    """查詢使用者所在城市，查不到時預設台北"""
+    return USER_LOCATIONS.get(user_id, "台北")
+
 # ===== 工具定義 =====
 @tool
 def get_weather_for_location(city: str) -> str:
@@ -47,14 +86,7 @@ def get_weather_for_location(city: str) -> str:
 @tool
 def get_user_location(runtime: ToolRuntime[Context]) -> str:
     """根據使用者 ID 檢索使用者位置。"""
-    # 這裡可以從資料庫查詢使用者位置
-    user_locations = {
-        "1": "台北",
-        "2": "台南",
-        "3": "高雄",
-    }
-    user_id = runtime.context.user_id
-    return user_locations.get(user_id, "台北")
+    return lookup_user_location(runtime.context.user_id)
 
 # ===== 回應格式 =====
 @dataclass
@@ -68,22 +100,41 @@ print("🔧 初始化 LiteLLM 模型...")
 model = init_chat_model(
     MODEL_NAME,
     temperature=1.0,
-    max_tokens=2048
+    max_tokens=2048,
+    **keepalive_http_clients()  # 連線閒置時不會馬上被關閉
 )
 
 # ===== 建立 Agent =====
 print("🤖 建立 Agent...")
 checkpointer = InMemorySaver()
 
+# 每一輪只送最近幾輪對話，更早的內容折疊成摘要
+history_trimmer = TokenBudgetMiddleware(
+    max_tokens=2000,
+    keep_last_turns=3,
+    summary_model=model,
+    verbose=True,
+)
+
 agent = create_agent(
     model=model,
     system_prompt=SYSTEM_PROMPT,
     tools=[get_user_location, get_weather_for_location],
     context_schema=Context,
     response_format=ToolStrategy(WeatherResponse),
-    checkpointer=checkpointer
+    checkpointer=checkpointer,
+    middleware=[history_trimmer]
 )
 
+# ===== 語意快取（選用） =====
+semantic_cache = None
+if SEMANTIC_CACHE:
+    if EMBEDDING_MODEL:
+        embedder = embeddings_embedder(init_embeddings(EMBEDDING_MODEL))
+        semantic_cache = SemanticCache(embedder, threshold=0.9)
+    else:
+        semantic_cache = SemanticCache(threshold=0.8)
+
 # ===== 輔助函數 =====
 def extract_response(response: dict) -> str:
     """從 Agent 回應中提取最終答案"""
@@ -110,14 +161,151 @@ def extract_response(response: dict) -> str:
     
     return "抱歉，無法生成回應"
 
-def chat(user_message: str, config: dict, context: Context) -> str:
-    """執行對話並返回回應"""
-    response = agent.invoke(
+console = Console()
+
+def display_response(text: str):
+    """顯示助手回應"""
+    console.print(f"[bold green]🤖 助手:[/bold green] {text}\n")
+
+async def achat(user_message: str, config: dict, context: Context) -> str:
+    """以串流方式執行一輪對話並即時顯示（語意快取命中時略過 agent）"""
+    location = lookup_user_location(context.user_id)
+    run_config = RunnableConfig(**config)
+    if semantic_cache is not None and (hit := await semantic_cache.alookup(user_message, location)):
+        # 寫回 checkpoint，後續追問仍看得到這一輪；以 model 節點的身分寫入，圖會判定這一輪已結束
+        await agent.aupdate_state(
+            run_config,
+            {"messages": [HumanMessage(user_message), AIMessage(hit.answer)]},
+            as_node="model",
+        )
+        console.print(f"⚡ 語意快取命中（相似度 {hit.similarity:.2f}，節省約 {hit.saved_seconds:.1f} 秒）")
+        display_response(hit.answer)
+        return hit.answer
+
+    started = time.perf_counter()
+    answer = ""
+    streamed = False  # 最後一輪工具呼叫之後是否已串流出回答
+    async for event in astream_agent(
+        agent,
         {"messages": [{"role": "user", "content": user_message}]},
-        config=RunnableConfig(configurable=config),
-        context=context
+        config=run_config,
+        context=context,
+        response_tool=WeatherResponse.__name__,
+    ):
+        if event.type == "token":
+            if not streamed:
+                console.print("[bold green]🤖 助手:[/bold green] ", end="")
+            # patch_stdout 會累積到換行才輸出，避免打斷正在輸入的那一行
+            console.print(event.text, end="", markup=False, highlight=False)
+            streamed = True
+        elif event.type == "tool_call":
+            if streamed:
+                console.print()
+            console.print(f"[dim]   🔧 呼叫工具 {event.name}({event.data})[/dim]")
+            streamed = False
+        elif event.type == "tool_result":
+            console.print(f"[dim]   ✅ {event.name} → {event.text}[/dim]")
+        elif event.type == "final":
+            answer = event.text
+            if streamed:
+                console.print("\n")
+            else:
+                display_response(answer)
+    if semantic_cache is not None:
+        await semantic_cache.astore(user_message, location, answer, time.perf_counter() - started)
+    return answer
+
+class TurnRunner:
+    """依序執行每一輪對話，並可以只取消進行中的那一輪
+
+    同一個 thread 不能同時跑兩輪（checkpoint 會互相覆蓋），
+    回答進行中送出的新輸入會先排隊，等上一輪結束再執行。
+    """
+
+    def __init__(self, config: dict, context: Context, warmup: ModelWarmup | None = None):
+        self.config = config
+        self.context = context
+        self.warmup = warmup
+        self.first_turn = True
+        self.queue: asyncio.Queue[str] = asyncio.Queue()
+        self.current: asyncio.Task | None = None
+
+    @property
+    def busy(self) -> bool:
+        return self.current is not None or not self.queue.empty()
+
+    def submit(self, user_message: str):
+        self.queue.put_nowait(user_message)
+
+    def cancel_current(self) -> bool:
+        """取消進行中的那一輪（排隊中的輸入照常執行）；沒有進行中的回答時回傳 False"""
+        if self.current is None or self.current.done():
+            return False
+        self.current.cancel()
+        return True
+
+    async def run(self):
+        while True:
+            user_message = await self.queue.get()
+            started = time.perf_counter()
+            if self.warmup is not None:
+                self.warmup.stop()  # 問題已送出，不必再保持連線
+            self.current = asyncio.create_task(achat(user_message, self.config, self.context))
+            # 用 wait 而不是 await：取消 self.current 時 run 本身不會跟著結束
+            await asyncio.wait([self.current])
+            if self.current.cancelled():
+                # 補上未完成的工具呼叫，下一輪才能接著同一個 thread 對話
+                await aclose_interrupted_turn(agent, RunnableConfig(**self.config))
+                console.print("\n[yellow]⏹ 已取消這次回答[/yellow]\n")
+            elif (error := self.current.exception()) is not None:
+                console.print(f"[red]❌ 錯誤: {error}[/red]\n")
+            elif self.first_turn:
+                console.print(f"[dim]{first_turn_report(time.perf_counter() - started, self.warmup)}[/dim]\n")
+                self.first_turn = False
+            self.current = None
+            self.queue.task_done()
+
+async def repl(config: dict, context: Context):
+    """互動模式：回答串流時仍可輸入，Ctrl-C 只取消目前的回答"""
+    session = PromptSession(
+        history=InMemoryHistory(),
+        style=Style.from_dict({'prompt': 'cyan bold'}),
+        mouse_support=True,
     )
-    return extract_response(response)
+    # 使用者輸入第一個問題的同時，在背景建立連線並預熱模型（與之後的請求共用連線池）
+    warmup = ModelWarmup(model, keepalive_interval=4.0) if WARMUP_ENABLED else None
+    warmup_task = asyncio.create_task(warmup.arun()) if warmup else None
+    runner = TurnRunner(config, context, warmup)
+    worker = asyncio.create_task(runner.run())
+
+    # patch_stdout：回答輸出在輸入列上方，不會打斷正在輸入的內容
+    with patch_stdout():
+        while True:
+            try:
+                user_input = (await session.prompt_async([('class:prompt', '👤 你: ')])).strip()
+            except KeyboardInterrupt:
+                if runner.cancel_current():
+                    continue
+                console.print("[yellow]👋 再見![/yellow]")
+                break
+            except EOFError:
+                console.print("[yellow]👋 再見![/yellow]")
+                break
+
+            if user_input.lower() in ['exit', 'quit', '結束', '離開']:
+                await runner.queue.join()  # 等排隊中的問題回答完
+                console.print("[yellow]👋 再見![/yellow]")
+                break
+            if not user_input:
+                continue
+            if runner.busy:
+                console.print("[dim]⏳ 已排隊，上一個回答結束後處理[/dim]")
+            runner.submit(user_input)
+
+    worker.cancel()
+    if warmup_task is not None:
+        warmup.stop()
+        warmup_task.cancel()
 
 # ===== 主程式 =====
 if __name__ == "__main__":
@@ -132,61 +320,8 @@ if __name__ == "__main__":
     context = Context(user_id=user_id)
     
     # 互動模式
-    print("\n💬 進入互動模式（輸入 'exit' 結束）\n")
-    
-    # while True:
-    #     try:
-    #         user_input = prompt("👤 你: ").strip()
-    #         if user_input.lower() in ['exit', 'quit', '結束', '離開']:
-    #             print("\n👋 再見！")
-    #             break
-    #         if not user_input:
-    #             continue
-    #         response_text = chat(user_input, config, context)
-    #         print(f"🤖 助手: {response_text}\n")
-    #     except KeyboardInterrupt:
-    #         print("\n\n👋 再見！")
-    #         break
-    #     except Exception as e:
-    #         print(f"❌ 錯誤: {e}\n")
-
-
-    # 設定樣式
-    input_style = Style.from_dict({
-        'prompt': 'cyan bold',
-    })
-
-    console = Console()
-    history = InMemoryHistory()
-
-    def get_user_input() -> str:
-        """取得使用者輸入"""
-        return prompt(
-            [('class:prompt', '👤 你: ')],
-            style=input_style,
-            history=history,
-            mouse_support=True,
-        ).strip()
-
-    def display_response(text: str):
-        """顯示助手回應"""
-        console.print(f"[bold green]🤖 助手:[/bold green] {text}\n")
-
-    while True:
-        try:
-            user_input = get_user_input()
-            if user_input.lower() in ['exit', 'quit', '結束', '離開']:
-                console.print("[yellow]👋 再見![/yellow]")
-                break
-            
-            if not user_input:
-                continue
-            
-            response_text = chat(user_input, config, context)
-            display_response(response_text)
-
-        except KeyboardInterrupt:
-            console.print("\n[yellow]👋 再見![/yellow]")
-            break
-        except Exception as e:
-            console.print(f"[red]❌ 錯誤: {e}[/red]\n")
\ No newline at end of file
+    print("\n💬 進入互動模式（輸入 'exit' 結束，Ctrl-C 取消目前的回答）\n")
+    asyncio.run(repl(config, context))
+
+    if semantic_cache is not None:
+        console.print(f"[cyan]📊 語意快取統計：{semantic_cache.stats()}[/cyan]")
@@ -5,25 +5,50 @@ LangChain + LiteLLM Agent 最終版
 
 import json
 import os
+import sys
+import time
 from dataclasses import dataclass
+from typing import Any
 
 from langchain.agents import create_agent
+from langchain.agents.middleware import ModelRequest, dynamic_prompt
 from langchain.agents.structured_output import ToolStrategy
 from langchain.tools import ToolRuntime, tool
-from langchain_openai import ChatOpenAI
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langgraph.checkpoint.memory import InMemorySaver
 
+from agent_utils.history_middleware import TokenBudgetMiddleware
+from agent_utils.intent_gate import IntentGate
+from agent_utils.semantic_cache import CacheHit, SemanticCache, embeddings_embedder
+from agent_utils.sqlite_checkpointer import BoundedSqliteSaver
+from agent_utils.streaming import stream_agent
+from agent_utils.tool_cache import cached_tool
+from agent_utils.warmup import (
+    WARMUP_ENABLED,
+    ModelWarmup,
+    first_turn_report,
+    keepalive_http_clients,
+)
+
 # ===== 配置區 =====
 LITELLM_BASE_URL = "http://localhost:4000"
 LITELLM_API_KEY = os.getenv("LITELLM_API_KEY", "your_litellm_api_key")
 MODEL_NAME = "gemma-3-12b"
+# 設定後改用 SQLite 保存對話（可跨重啟接續），未設定則使用記憶體
+CHECKPOINT_DB = os.getenv("CHECKPOINT_DB")
+# 設為 1 開啟語意快取；EMBEDDING_MODEL 未設定時使用本地字元向量
+SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE") == "1"
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
+# 使用者資料檔（JSON：{"user_id": {"location": ..., "preferences": ...}}），未設定則使用內建資料
+PROFILE_STORE = os.getenv("PROFILE_STORE")
 
 # ===== 系統提示詞 =====
 SYSTEM_PROMPT = """你是一位專業的天氣助手。
 
 你可以使用兩個工具:
 - get_weather_for_location: 用於獲取特定城市的天氣
-- get_user_location: 用於獲取使用者的位置
+- get_user_location: 用於獲取使用者的位置（提示詞已提供使用者位置時不需要呼叫）
 
 請用繁體中文回覆，態度友善專業。
 
@@ -31,6 +56,9 @@ IMPORTANT: 只回答天氣相關的問題。如果使用者問你其他問題，
 
 """
 
+# 明確與天氣無關的問題，不經過 LLM 直接回覆
+REFUSAL_MESSAGE = "抱歉，我只能回答天氣相關的問題喔！想查哪個城市的天氣呢？"
+
 
 # ===== 上下文結構 =====
 @dataclass
@@ -38,10 +66,48 @@ class Context:
     """執行時期上下文"""
 
     user_id: str
+    location: str | None = None  # 預先載入的使用者位置，None 時由工具查詢
+    preferences: str | None = None  # 預先載入的使用者偏好
+
+
+# ===== 使用者資料 =====
+# 內建的使用者資料，可用 PROFILE_STORE 指向 JSON 檔替換
+DEFAULT_USER_PROFILES = {
+    "1": {"location": "台北", "preferences": "溫度用攝氏，回答簡短"},
+    "2": {"location": "台南", "preferences": "怕熱，提醒防曬"},
+    "3": {"location": "高雄", "preferences": None},
+}
+
+
+def load_user_profiles(path: str | None) -> dict[str, dict]:
+    """啟動時一次載入全部使用者資料，之後查詢都在記憶體完成"""
+    if not path:
+        return dict(DEFAULT_USER_PROFILES)
+    with open(path, encoding="utf-8") as f:
+        return {str(user_id): profile for user_id, profile in json.load(f).items()}
+
+
+USER_PROFILES = load_user_profiles(PROFILE_STORE)
+
+
+def lookup_user_location(user_id: str) -> str:
+    """查詢使用者所在城市，查不到時預設台北"""
+    return USER_PROFILES.get(user_id, {}).get("location") or "台北"
+
+
+def build_context(user_id: str) -> Context:
+    """對話開始時把使用者資料預先放進 Context，省掉 get_user_location 這一輪"""
+    profile = USER_PROFILES.get(user_id, {})
+    return Context(
+        user_id=user_id,
+        location=profile.get("location"),
+        preferences=profile.get("preferences"),
+    )
 
 
 # ===== 工具定義 =====
 @tool
+@cached_tool(ttl=600, maxsize=256)  # 同城市 10 分鐘內直接回傳快取
 def get_weather_for_location(city: str) -> str:
     """獲取指定城市的天氣。"""
     # 這裡可以串接真實的天氣 API
@@ -54,16 +120,24 @@ def get_weather_for_location(city: str) -> str:
 
 
 @tool
+@cached_tool(ttl=3600, maxsize=10_000)  # 依 runtime.context（user_id）快取
 def get_user_location(runtime: ToolRuntime[Context]) -> str:
     """根據使用者 ID 檢索使用者位置。"""
-    # 這裡可以從資料庫查詢使用者位置
-    user_locations = {
-        "1": "台北",
-        "2": "台南",
-        "3": "高雄",
-    }
-    user_id = runtime.context.user_id
-    return user_locations.get(user_id, "台北")
+    return runtime.context.location or lookup_user_location(runtime.context.user_id)
+
+
+# ===== 動態提示詞 =====
+@dynamic_prompt
+def user_profile_prompt(request: ModelRequest) -> str:
+    """Context 已有使用者資料時寫進系統提示詞，模型可直接查天氣"""
+    context = request.runtime.context
+    prompt = SYSTEM_PROMPT
+    if context is None or context.location is None:
+        return prompt
+    prompt += f"使用者目前位置：{context.location}（不需要再呼叫 get_user_location）\n"
+    if context.preferences:
+        prompt += f"使用者偏好：{context.preferences}\n"
+    return prompt
 
 
 # ===== 回應格式 =====
@@ -75,25 +149,150 @@ class WeatherResponse:
     weather_info: str | None = None  # 天氣資訊（如果有的話）
 
 
-model = ChatOpenAI(
-    base_url=LITELLM_BASE_URL,
-    api_key=LITELLM_API_KEY,
-    model=MODEL_NAME,
-    temperature=0.7,
-)
-
 # ===== 建立 Agent =====
-print("🤖 建立 Agent...")
-checkpointer = InMemorySaver()
-
-agent = create_agent(
-    model=model,
-    system_prompt=SYSTEM_PROMPT,
-    tools=[get_user_location, get_weather_for_location],
-    context_schema=Context,
-    response_format=ToolStrategy(WeatherResponse),
-    checkpointer=checkpointer,
-)
+@dataclass
+class Assistant:
+    """agent 與呼叫 agent 之前的本地處理（意圖閘門、語意快取），CLI 與 HTTP 服務共用"""
+
+    model: ChatOpenAI
+    agent: Any
+    intent_gate: IntentGate
+    semantic_cache: SemanticCache | None = None
+
+    def _local_answer(
+        self, user_message: str, context: Context
+    ) -> str | CacheHit | None:
+        """明確無關的問題回傳婉拒訊息，語意快取命中回傳 CacheHit"""
+        if not self.intent_gate.check(user_message).allowed:
+            return REFUSAL_MESSAGE
+        if self.semantic_cache is None:
+            return None
+        return self.semantic_cache.lookup(user_message, cache_location(context))
+
+    def answer_locally(
+        self, user_message: str, config: dict, context: Context
+    ) -> str | None:
+        """不需要跑 agent 就能回答時回傳答案：明確無關的問題、語意快取命中"""
+        local = self._local_answer(user_message, context)
+        if not isinstance(local, CacheHit):
+            return local
+        # 寫回 checkpoint，後續追問仍看得到這一輪；以 model 節點的身分寫入，圖會判定這一輪已結束
+        self.agent.update_state(
+            config, cache_turn(user_message, local), as_node="model"
+        )
+        report_cache_hit(local)
+        return local.answer
+
+    async def aanswer_locally(
+        self, user_message: str, config: dict, context: Context
+    ) -> str | None:
+        """answer_locally 的非同步版本（HTTP 服務使用）：embedding 不會卡住 event loop"""
+        if not self.intent_gate.check(user_message).allowed:
+            return REFUSAL_MESSAGE
+        if self.semantic_cache is None:
+            return None
+        local = await self.semantic_cache.alookup(user_message, cache_location(context))
+        if local is None:
+            return None
+        await self.agent.aupdate_state(
+            config, cache_turn(user_message, local), as_node="model"
+        )
+        report_cache_hit(local)
+        return local.answer
+
+    def remember_answer(
+        self, user_message: str, context: Context, answer: str, latency: float
+    ) -> None:
+        """把實際跑 agent 得到的回答寫入語意快取"""
+        if self.semantic_cache is not None:
+            self.semantic_cache.store(
+                user_message, cache_location(context), answer, latency
+            )
+
+    async def aremember_answer(
+        self, user_message: str, context: Context, answer: str, latency: float
+    ) -> None:
+        """remember_answer 的非同步版本（HTTP 服務使用）"""
+        if self.semantic_cache is not None:
+            await self.semantic_cache.astore(
+                user_message, cache_location(context), answer, latency
+            )
+
+
+def cache_location(context: Context) -> str:
+    return context.location or lookup_user_location(context.user_id)
+
+
+def cache_turn(user_message: str, hit: CacheHit) -> dict:
+    return {"messages": [HumanMessage(user_message), AIMessage(hit.answer)]}
+
+
+def report_cache_hit(hit: CacheHit) -> None:
+    print(
+        f"⚡ 語意快取命中（相似度 {hit.similarity:.2f}，"
+        f"節省約 {hit.saved_seconds:.1f} 秒）"
+    )
+
+
+def build_assistant() -> Assistant:
+    """建立模型、agent、意圖閘門與語意快取；匯入 main 時不會執行，由呼叫端決定何時建立"""
+    model = ChatOpenAI(
+        base_url=LITELLM_BASE_URL,
+        api_key=LITELLM_API_KEY,
+        model=MODEL_NAME,
+        temperature=0.7,
+        **keepalive_http_clients(),  # 連線閒置時不會馬上被關閉
+    )
+
+    print("🤖 建立 Agent...")
+    if CHECKPOINT_DB:
+        checkpointer = BoundedSqliteSaver(
+            CHECKPOINT_DB,
+            ttl_seconds=7 * 24 * 3600,  # 閒置一週的對話自動淘汰
+            max_threads=10_000,  # 最多保留的對話數（LRU）
+            max_checkpoints_per_thread=20,  # 每個對話只保留最近的 checkpoint
+        )
+    else:
+        checkpointer = InMemorySaver()
+
+    # 每一輪只送最近幾輪對話，更早的內容折疊成摘要
+    history_trimmer = TokenBudgetMiddleware(
+        max_tokens=2000,
+        keep_last_turns=3,
+        summary_model=model,
+        verbose=True,
+    )
+
+    agent = create_agent(
+        model=model,
+        system_prompt=SYSTEM_PROMPT,
+        tools=[get_user_location, get_weather_for_location],
+        context_schema=Context,
+        response_format=ToolStrategy(WeatherResponse),
+        checkpointer=checkpointer,
+        # user_profile_prompt 要在前面，摘要才會接在完整的系統提示詞之後
+        middleware=[user_profile_prompt, history_trimmer],
+    )
+
+    # 意圖閘門：本地擋掉明確無關的問題
+    intent_gate = IntentGate(threshold=0.8)
+
+    # 語意快取（選用）
+    semantic_cache = None
+    if SEMANTIC_CACHE:
+        if EMBEDDING_MODEL:
+            embeddings = OpenAIEmbeddings(
+                base_url=LITELLM_BASE_URL,
+                api_key=LITELLM_API_KEY,
+                model=EMBEDDING_MODEL,
+            )
+            semantic_cache = SemanticCache(
+                embeddings_embedder(embeddings), threshold=0.9
+            )
+        else:
+            semantic_cache = SemanticCache(threshold=0.8)
+
+    return Assistant(model, agent, intent_gate, semantic_cache)
 
 
 # ===== 輔助函數 =====
@@ -125,18 +324,107 @@ def extract_response(response: dict) -> str:
     return "抱歉，無法生成回應"
 
 
-def chat(user_message: str, config: dict, context: Context) -> str:
+def chat(
+    assistant: Assistant, user_message: str, config: dict, context: Context
+) -> str:
     """執行對話並返回回應"""
-    response = agent.invoke(
+    if (cached := assistant.answer_locally(user_message, config, context)) is not None:
+        return cached
+    started = time.perf_counter()
+    response = assistant.agent.invoke(
         {"messages": [{"role": "user", "content": user_message}]},
         config=config,
         context=context,
     )
-    return extract_response(response)
+    structured = response.get("structured_response")
+    answer = structured.answer if structured else extract_response(response)
+    assistant.remember_answer(
+        user_message, context, answer, time.perf_counter() - started
+    )
+    return answer
+
+
+def chat_stream(
+    assistant: Assistant, user_message: str, config: dict, context: Context
+) -> str:
+    """以串流方式執行對話：邊生成邊輸出，並顯示工具呼叫進度"""
+    if (cached := assistant.answer_locally(user_message, config, context)) is not None:
+        print(f"🤖 助手: {cached}\n")
+        return cached
+    started = time.perf_counter()
+    streamed = False  # 最後一輪工具呼叫之後是否已串流出回答
+    for event in stream_agent(
+        assistant.agent,
+        {"messages": [{"role": "user", "content": user_message}]},
+        config=config,
+        context=context,
+        response_tool=WeatherResponse.__name__,
+    ):
+        if event.type == "token":
+            if not streamed:
+                print("🤖 助手: ", end="")
+            print(event.text, end="", flush=True)
+            streamed = True
+        elif event.type == "tool_call":
+            if streamed:
+                print()
+            print(f"   🔧 呼叫工具 {event.name}({event.data})", flush=True)
+            streamed = False
+        elif event.type == "tool_result":
+            print(f"   ✅ {event.name} → {event.text}", flush=True)
+        elif event.type == "final":
+            # 模型沒有串流輸出時（例如 provider 不支援），直接顯示完整回答
+            print("\n" if streamed else f"🤖 助手: {event.text}\n")
+            assistant.remember_answer(
+                user_message, context, event.text, time.perf_counter() - started
+            )
+            return event.text
+    return ""
+
+
+# ===== 效能量測 =====
+BENCHMARK_QUESTIONS = [
+    "今天天氣如何？",
+    "我這裡會下雨嗎？",
+    "現在外面幾度？",
+    "明天適合出門嗎？",
+    "高雄天氣怎麼樣？",
+]
+
+
+def count_llm_calls(response: dict) -> int:
+    """AI 訊息數即為模型呼叫次數（摘要呼叫不計）"""
+    return sum(isinstance(msg, AIMessage) for msg in response["messages"])
+
+
+def benchmark_llm_calls(assistant: Assistant, user_id: str = "1") -> None:
+    """比較預先載入使用者資料前後，每個問題平均需要幾次 LLM 呼叫"""
+    for label, context in [
+        ("未預先載入", Context(user_id=user_id)),
+        ("預先載入", build_context(user_id)),
+    ]:
+        calls, started = 0, time.perf_counter()
+        for i, question in enumerate(BENCHMARK_QUESTIONS):
+            # 每題使用新的 thread，避免前一題的工具結果影響這一題
+            config = {"configurable": {"thread_id": f"benchmark-{label}-{i}"}}
+            response = assistant.agent.invoke(
+                {"messages": [{"role": "user", "content": question}]},
+                config=config,
+                context=context,
+            )
+            calls += count_llm_calls(response)
+        elapsed = time.perf_counter() - started
+        n = len(BENCHMARK_QUESTIONS)
+        print(f"📊 {label}：平均每題 {calls / n:.2f} 次 LLM 呼叫，{elapsed / n:.2f} 秒")
 
 
 # ===== 主程式 =====
 if __name__ == "__main__":
+    assistant = build_assistant()
+    if "--benchmark" in sys.argv:
+        benchmark_llm_calls(assistant)
+        sys.exit()
+
     print("\n" + "=" * 60)
     print("🌤️  LangChain + LiteLLM 天氣助手")
     print("=" * 60 + "\n")
@@ -145,7 +433,15 @@ if __name__ == "__main__":
     user_id = "1"  # 使用者 ID
     thread_id = "weather-chat-001"  # 對話 ID
     config = {"configurable": {"thread_id": thread_id}}
-    context = Context(user_id=user_id)
+    context = build_context(user_id)  # 對話開始時預先載入使用者資料
+
+    # 使用者輸入第一個問題的同時，在背景建立連線並預熱模型
+    warmup = (
+        ModelWarmup(assistant.model, keepalive_interval=4.0).start()
+        if WARMUP_ENABLED
+        else None
+    )
+    first_turn = True
 
     # 互動模式
     print("\n💬 進入互動模式（輸入 'exit' 結束）\n")
@@ -160,8 +456,13 @@ if __name__ == "__main__":
             if not user_input:
                 continue
 
-            response_text = chat(user_input, config, context)
-            print(f"🤖 助手: {response_text}\n")
+            started = time.perf_counter()
+            if warmup is not None:
+                warmup.stop()  # 問題已送出，不必再保持連線
+            chat_stream(assistant, user_input, config, context)
+            if first_turn:
+                print(first_turn_report(time.perf_counter() - started, warmup) + "\n")
+                first_turn = False
 
         except KeyboardInterrupt:
             print("\n\n👋 再見！")
@@ -169,3 +470,7 @@ if __name__ == "__main__":
         except Exception as e:
             print(f"❌ 錯誤: {e}\n")
 
+    if warmup is not None:
+        warmup.stop()
+    if assistant.semantic_cache is not None:
+        print(f"📊 語意快取統計：{assistant.semantic_cache.stats()}")
@@ -0,0 +1,249 @@
+"""
+天氣助手 HTTP 服務（FastAPI）
+同一個程序可同時服務多位使用者的多段對話
+
+啟動方式：
+    uv run server.py
+    # 或 uvicorn server:app --host 0.0.0.0 --port 8000
+
+API：
+    POST /chat         一次回傳完整回答
+    POST /chat/stream  以 SSE 串流回答（token / tool_call / tool_result / final / error）
+    GET  /health       目前的併發狀態
+
+agent 在服務啟動時（lifespan）才建立；回答前與 CLI 一樣先經過意圖閘門與語意快取。
+"""
+
+import asyncio
+import json
+import os
+import time
+from collections import defaultdict
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from starlette.background import BackgroundTask
+
+from agent_utils.streaming import astream_agent
+from agent_utils.tool_cache import tool_cache_stats
+from main import (
+    Assistant,
+    Context,
+    WeatherResponse,
+    build_assistant,
+    build_context,
+    extract_response,
+)
+
+# ===== 配置區 =====
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", "64"))  # 全域同時執行的請求數
+MAX_PER_USER = int(os.getenv("MAX_PER_USER", "2"))  # 每位使用者同時的請求數（含排隊）
+MAX_QUEUE = int(os.getenv("MAX_QUEUE", "256"))  # 等待執行的請求上限，超過直接回 503
+
+
+# ===== 併發控制 =====
+class AdmissionLimiter:
+    """全域併發上限 + 每位使用者上限 + 有界等待佇列"""
+
+    def __init__(self, max_in_flight: int, max_per_user: int, max_queue: int):
+        self.max_in_flight = max_in_flight
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.per_user: defaultdict[str, int] = defaultdict(int)
+        self.waiting = 0
+        self.in_flight = 0
+
+    async def acquire(self, user_id: str) -> None:
+        """取得執行名額；超過使用者上限回 429，佇列已滿回 503"""
+        if self.per_user[user_id] >= self.max_per_user:
+            raise HTTPException(429, "同一使用者的請求過多，請稍後再試")
+        if self.semaphore.locked() and self.waiting >= self.max_queue:
+            raise HTTPException(503, "服務忙碌中，請稍後再試")
+
+        self.per_user[user_id] += 1
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        except BaseException:
+            self._release_user(user_id)
+            raise
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+
+    def release(self, user_id: str) -> None:
+        self.in_flight -= 1
+        self.semaphore.release()
+        self._release_user(user_id)
+
+    def _release_user(self, user_id: str) -> None:
+        self.per_user[user_id] -= 1
+        if self.per_user[user_id] <= 0:
+            del self.per_user[user_id]
+
+
+class ThreadLocks:
+    """同一個 thread_id 的請求依序執行，避免 checkpoint 互相覆蓋"""
+
+    def __init__(self):
+        self.locks: dict[str, asyncio.Lock] = {}
+        self.users: defaultdict[str, int] = defaultdict(int)
+
+    async def acquire(self, thread_id: str) -> None:
+        lock = self.locks.setdefault(thread_id, asyncio.Lock())
+        self.users[thread_id] += 1
+        try:
+            await lock.acquire()
+        except BaseException:
+            self._forget(thread_id)
+            raise
+
+    def release(self, thread_id: str) -> None:
+        self.locks[thread_id].release()
+        self._forget(thread_id)
+
+    def _forget(self, thread_id: str) -> None:
+        self.users[thread_id] -= 1
+        if self.users[thread_id] <= 0:
+            del self.users[thread_id]
+            del self.locks[thread_id]
+
+
+limiter = AdmissionLimiter(MAX_IN_FLIGHT, MAX_PER_USER, MAX_QUEUE)
+thread_locks = ThreadLocks()
+
+
+# ===== 請求 / 回應格式 =====
+class ChatRequest(BaseModel):
+    user_id: str
+    thread_id: str
+    message: str
+
+
+class ChatResponse(BaseModel):
+    thread_id: str
+    answer: str
+
+
+# ===== API =====
+assistant: Assistant | None = None
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    """服務啟動時才建立 agent，匯入 server 不會有副作用"""
+    global assistant
+    assistant = build_assistant()
+    yield
+
+
+app = FastAPI(title="天氣助手", lifespan=lifespan)
+
+
+def build_call(request: ChatRequest) -> tuple[dict, dict, Context]:
+    """組出 agent 呼叫所需的 inputs / config / context"""
+    inputs = {"messages": [{"role": "user", "content": request.message}]}
+    config = {"configurable": {"thread_id": request.thread_id}}
+    return inputs, config, build_context(request.user_id)
+
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest) -> ChatResponse:
+    inputs, config, context = build_call(request)
+    await limiter.acquire(request.user_id)
+    try:
+        await thread_locks.acquire(request.thread_id)
+        try:
+            # 與 CLI 相同：無關的問題與語意快取命中不必跑 agent（快取命中會寫回 checkpoint）
+            answer = await assistant.aanswer_locally(request.message, config, context)
+            if answer is None:
+                started = time.perf_counter()
+                response = await assistant.agent.ainvoke(
+                    inputs, config=config, context=context
+                )
+                structured = response.get("structured_response")
+                answer = structured.answer if structured else extract_response(response)
+                await assistant.aremember_answer(
+                    request.message, context, answer, time.perf_counter() - started
+                )
+        finally:
+            thread_locks.release(request.thread_id)
+    finally:
+        limiter.release(request.user_id)
+
+    return ChatResponse(thread_id=request.thread_id, answer=answer)
+
+
+def sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest) -> StreamingResponse:
+    inputs, config, context = build_call(request)
+    # 在回應開始前就取得名額，被拒絕時才能回正確的 HTTP 狀態碼
+    await limiter.acquire(request.user_id)
+
+    async def events() -> AsyncIterator[str]:
+        await thread_locks.acquire(request.thread_id)
+        try:
+            local = await assistant.aanswer_locally(request.message, config, context)
+            if local is not None:
+                yield sse("final", {"text": local})
+                return
+            started = time.perf_counter()
+            async for event in astream_agent(
+                assistant.agent,
+                inputs,
+                config=config,
+                context=context,
+                response_tool=WeatherResponse.__name__,
+            ):
+                payload = {"text": event.text}
+                if event.name:
+                    payload["name"] = event.name
+                if event.data is not None:
+                    payload["args"] = event.data
+                yield sse(event.type, payload)
+                if event.type == "final":
+                    await assistant.aremember_answer(
+                        request.message,
+                        context,
+                        event.text,
+                        time.perf_counter() - started,
+                    )
+        except Exception as e:
+            yield sse("error", {"text": str(e)})
+        finally:
+            thread_locks.release(request.thread_id)
+
+    async def release() -> None:
+        limiter.release(request.user_id)
+
+    # 名額由 response 的 background 歸還：用戶端在 body 開始前就斷線、generator 從未執行時也一樣
+    # （release 是 async，才會在 event loop 上執行，而不是丟到 threadpool 碰 asyncio.Semaphore）
+    return StreamingResponse(
+        events(), media_type="text/event-stream", background=BackgroundTask(release)
+    )
+
+
+@app.get("/health")
+async def health() -> dict:
+    return {
+        "in_flight": limiter.in_flight,
+        "waiting": limiter.waiting,
+        "max_in_flight": MAX_IN_FLIGHT,
+        "active_users": len(limiter.per_user),
+        "tool_cache": tool_cache_stats(),
+    }
+
+
+# ===== 主程式 =====
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", "8000")))
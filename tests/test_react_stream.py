@@ -0,0 +1,48 @@
+import random
+
+import pytest
+
+from agent_utils.react_stream import (
+    FUZZ_CORPUS,
+    ReActStreamParser,
+    _summary,
+    fuzz,
+    parse_react,
+)
+
+
+def first_event(events: list) -> tuple | None:
+    return _summary(events[0] if events else None)
+
+
+@pytest.mark.parametrize(("text", "expected"), FUZZ_CORPUS)
+def test_whole_text(text: str, expected: tuple | None) -> None:
+    assert first_event(parse_react(text)) == expected
+
+
+@pytest.mark.parametrize(("text", "expected"), FUZZ_CORPUS)
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7])
+def test_fixed_chunks(text: str, expected: tuple | None, chunk_size: int) -> None:
+    assert first_event(parse_react(text, chunk_size=chunk_size)) == expected
+
+
+@pytest.mark.parametrize(("text", "expected"), FUZZ_CORPUS)
+def test_random_chunks(text: str, expected: tuple | None) -> None:
+    rng = random.Random(text)
+    for _ in range(50):
+        cuts = sorted(rng.sample(range(1, len(text)), k=min(len(text) - 1, 6)))
+        parser = ReActStreamParser()
+        events = []
+        for a, b in zip([0, *cuts], [*cuts, len(text)]):
+            events += parser.feed(text[a:b])
+        assert first_event(events) == expected, cuts
+
+
+def test_fuzz_corpus() -> None:
+    assert fuzz(rounds=100) == 0
+
+
+def test_stops_after_final() -> None:
+    parser = ReActStreamParser()
+    assert [e.kind for e in parser.feed("Final Answer: 好")] == ["final"]
+    assert parser.feed("\nAction: 查天氣(Vienna)") == []
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from agent_utils.semantic_cache import SemanticCache, normalize_question, question_keys
+
+CACHED = "今天台北會下雨嗎"
+
+
+@pytest.fixture
+def cache() -> SemanticCache:
+    cache = SemanticCache(threshold=0.8)
+    cache.store(CACHED, "台北", "今天台北午後有雷陣雨", latency=3.0)
+    return cache
+
+
+@pytest.mark.parametrize(
+    "question",
+    [
+        "明天台北會下雨嗎",  # 日期不同
+        "後天台北會下雨嗎",
+        "週六台北會下雨嗎",
+        "今天台北會下雪嗎",  # 天氣項目不同
+        "今天台北溫度幾度",
+    ],
+)
+def test_near_miss_questions_do_not_hit(cache: SemanticCache, question: str) -> None:
+    assert cache.lookup(question, "台北") is None
+
+
+@pytest.mark.parametrize(
+    "question", ["台北今天會不會下雨", "請問今天台北會下雨嗎？", "今日台北會下雨嗎"]
+)
+def test_paraphrases_hit(cache: SemanticCache, question: str) -> None:
+    hit = cache.lookup(question, "台北")
+    assert hit is not None
+    assert hit.cached_question == CACHED
+
+
+def test_location_must_match(cache: SemanticCache) -> None:
+    assert cache.lookup(CACHED, "高雄") is None
+
+
+def test_question_without_day_means_today() -> None:
+    assert question_keys(normalize_question("台北天氣如何")) == question_keys(
+        normalize_question("今天台北天氣怎麼樣")
+    )
+
+
+def test_async_lookup_and_store() -> None:
+    cache = SemanticCache()
+
+    async def run() -> None:
+        await cache.astore(CACHED, "台北", "會下雨", latency=1.0)
+        assert (await cache.alookup("台北今天會不會下雨", "台北")) is not None
+        assert (await cache.alookup("明天台北會下雨嗎", "台北")) is None
+
+    asyncio.run(run())
+    assert cache.stats()["hits"] == 1
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from server import AdmissionLimiter, ChatRequest
+
+SCOPE = {"type": "http", "asgi": {"spec_version": "2.3"}}
+
+
+class LocalAssistant:
+    """不跑 agent、直接回答的 Assistant 替身"""
+
+    def __init__(self):
+        self.asked: list[str] = []
+
+    async def aanswer_locally(self, message, config, context):
+        self.asked.append(message)
+        return "本地回答"
+
+
+@pytest.fixture
+def limiter(monkeypatch) -> AdmissionLimiter:
+    limiter = AdmissionLimiter(max_in_flight=1, max_per_user=1, max_queue=1)
+    monkeypatch.setattr(server, "limiter", limiter)
+    monkeypatch.setattr(server, "assistant", LocalAssistant())
+    return limiter
+
+
+def request() -> ChatRequest:
+    return ChatRequest(user_id="u1", thread_id="t1", message="台北天氣如何")
+
+
+async def disconnect_soon() -> dict:
+    await asyncio.sleep(0.01)
+    return {"type": "http.disconnect"}
+
+
+def test_releases_slot_when_client_leaves_before_body(limiter) -> None:
+    async def run() -> None:
+        response = await server.chat_stream(request())
+        assert limiter.in_flight == 1
+
+        async def stuck_send(message: dict) -> None:
+            await asyncio.Event().wait()  # 連回應標頭都送不出去
+
+        await response(SCOPE, disconnect_soon, stuck_send)
+
+    asyncio.run(run())
+    assert server.assistant.asked == []  # body 從未開始
+    assert limiter.in_flight == 0
+    assert not limiter.per_user
+    assert not server.thread_locks.locks
+
+
+def test_releases_slot_after_stream_completes(limiter) -> None:
+    sent: list[dict] = []
+
+    async def run() -> None:
+        response = await server.chat_stream(request())
+
+        async def receive() -> dict:
+            await asyncio.Event().wait()
+
+        async def send(message: dict) -> None:
+            sent.append(message)
+
+        await response(SCOPE, receive, send)
+
+    asyncio.run(run())
+    body = b"".join(m.get("body", b"") for m in sent).decode()
+    assert "event: final" in body
+    assert "本地回答" in body
+    assert limiter.in_flight == 0
+    assert not limiter.per_user
+
+
+def test_rejects_second_request_from_same_user(limiter) -> None:
+    async def run() -> None:
+        await limiter.acquire("u1")
+        with pytest.raises(HTTPException) as error:
+            await limiter.acquire("u1")
+        assert error.value.status_code == 429
+        limiter.release("u1")
+
+    asyncio.run(run())
+    assert not limiter.per_user
@@ -0,0 +1,92 @@
+import time
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.base import empty_checkpoint
+
+from agent_utils.sqlite_checkpointer import BoundedSqliteSaver
+
+
+def config(thread_id: str) -> dict:
+    return {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+
+
+def put(saver: BoundedSqliteSaver, thread_id: str, messages: list) -> None:
+    checkpoint = empty_checkpoint()
+    checkpoint["channel_values"] = {"messages": messages}
+    saver.put(config(thread_id), checkpoint, {}, {})
+
+
+def conversation(turns: int, size: int = 200) -> list:
+    messages = []
+    for turn in range(turns):
+        messages += [
+            HumanMessage(f"問題 {turn} " + "問" * size),
+            AIMessage(f"回答 {turn} " + "答" * size),
+        ]
+    return messages
+
+
+@pytest.fixture
+def saver():
+    with BoundedSqliteSaver(
+        ":memory:", max_thread_bytes=None, compact_every=0
+    ) as saver:
+        yield saver
+
+
+def test_keeps_latest_checkpoints(saver: BoundedSqliteSaver) -> None:
+    saver.max_checkpoints_per_thread = 3
+    for turns in range(1, 6):
+        put(saver, "a", conversation(turns))
+
+    kept = list(saver.list(config("a")))
+    assert len(kept) == 3
+    # 最新的在前，保留的是最後三次寫入
+    assert [len(t.checkpoint["channel_values"]["messages"]) for t in kept] == [10, 8, 6]
+
+
+def test_trims_oldest_turns_of_oversized_checkpoint(saver: BoundedSqliteSaver) -> None:
+    saver.max_thread_bytes = 8_000
+    put(saver, "a", conversation(20))
+
+    messages = saver.get_tuple(config("a")).checkpoint["channel_values"]["messages"]
+    assert 2 <= len(messages) < 40
+    # 從使用者訊息切開，最後一輪一定保留
+    assert messages[0].type == "human"
+    assert messages[-1].content.startswith("回答 19")
+    (size,) = saver.conn.execute("SELECT SUM(size) FROM checkpoints").fetchone()
+    assert size <= saver.max_thread_bytes
+
+
+def test_keeps_last_turn_even_if_too_large(saver: BoundedSqliteSaver) -> None:
+    saver.max_thread_bytes = 100
+    put(saver, "a", conversation(3))
+
+    messages = saver.get_tuple(config("a")).checkpoint["channel_values"]["messages"]
+    assert [m.content.split()[:2] for m in messages] == [["問題", "2"], ["回答", "2"]]
+
+
+def test_compact_expires_idle_threads(saver: BoundedSqliteSaver) -> None:
+    saver.ttl_seconds = 60
+    put(saver, "idle", conversation(1))
+    put(saver, "active", conversation(1))
+    saver.conn.execute(
+        "UPDATE threads SET last_access = ? WHERE thread_id = 'idle'",
+        (time.time() - 120,),
+    )
+
+    assert saver.compact() == {"expired": 1, "evicted": 0, "threads": 1}
+    assert saver.get_tuple(config("idle")) is None
+    assert saver.get_tuple(config("active")) is not None
+
+
+def test_compact_evicts_least_recently_used(saver: BoundedSqliteSaver) -> None:
+    saver.max_threads = 2
+    for thread_id in ("a", "b", "c"):
+        put(saver, thread_id, conversation(1))
+    saver.get_tuple(config("a"))  # 讀取也算使用
+
+    assert saver.compact()["evicted"] == 1
+    assert saver.get_tuple(config("b")) is None
+    assert saver.get_tuple(config("a")) is not None